@@ -0,0 +1,89 @@
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_affe import Affe
+
+
+class AffeWithEval:
+    """A copy of the way Affe used to be built and serialized (a __dict__ per instance, its own list
+    of field names, and eval() on each of them), kept here only to compare against."""
+
+    def __init__(self, id: int):
+        self.id = id
+        self.name_strict = ""
+        self.name_friendly = ""
+        self.story = ""
+        self.attributes_common = {}
+        self.emotions_common = {}
+        self.attributes_rare_textual = {}
+        self.attributes_rare_numerical = {}
+        self.image_url = ""
+        self.website = ""
+        self.animation_url = ""
+        self.legacy_id = ""
+        self.list_of_elements = ['self.' + element for element in Affe.list_of_elements]
+
+    @classmethod
+    def from_affe(cls, affe: Affe):
+        affe_with_eval = cls(affe.id)
+        for element in Affe.list_of_elements:
+            setattr(affe_with_eval, element, getattr(affe, element))
+        return affe_with_eval
+
+    def make_dict(self) -> dict:
+        dict_to_return = {}
+        for item in self.list_of_elements:
+            element_name = item.replace('self.', '')
+            dict_to_return[element_name] = eval(item)
+        return dict_to_return
+
+
+def make_sample_affe(id: int) -> Affe:
+    affe = Affe(id, f"Affe mit Waffe #{id}")
+    affe.set_name_friendly(f"Chimp number {id}")
+    affe.set_story("A story about an ape. " * 10)
+    affe.set_image(f"https://example.com/{id}.png")
+    affe.set_website("https://example.com")
+    affe.add_common_attribute('CHIMP', f"Chimp number {id}")
+    affe.add_common_attribute('AK47', 'Yes')
+    for emotion in ['Anger', 'Anticipation', 'Disgust', 'Fear', 'Joy',
+                    'Negative', 'Positive', 'Sadness', 'Surprise', 'Trust']:
+        affe.add_common_emotion(emotion, id % 5)
+    affe.add_rare_textual_attributes('HAT', 'Fez')
+    affe.add_rare_numerical_attributes('Damage', 3)
+    return affe
+
+
+def measure_memory(factory, num_objects: int) -> float:
+    """Average number of bytes allocated per object when building num_objects objects."""
+    tracemalloc.start()
+    list_objects = [factory(i) for i in range(num_objects)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del list_objects
+    return current / num_objects
+
+
+if __name__ == '__main__':
+    num_objects = 10000
+    list_affen = [make_sample_affe(i) for i in range(1, num_objects + 1)]
+    list_affen_with_eval = [AffeWithEval.from_affe(affe) for affe in list_affen]
+
+    # Both ways of serializing must give exactly the same result.
+    assert all(new.make_dict() == old.make_dict() for new, old in zip(list_affen, list_affen_with_eval))
+
+    seconds_new = min(timeit.repeat(lambda: [affe.make_dict() for affe in list_affen], number=1, repeat=5))
+    seconds_old = min(timeit.repeat(lambda: [affe.make_dict() for affe in list_affen_with_eval], number=1, repeat=5))
+    print(f"make_dict for {num_objects} Affen:")
+    print(f"  eval-based: {seconds_old * 1000:8.1f} ms")
+    print(f"  slotted:    {seconds_new * 1000:8.1f} ms  ({seconds_old / seconds_new:.1f}x faster)")
+
+    bytes_new = measure_memory(lambda i: Affe(i), num_objects)
+    bytes_old = measure_memory(lambda i: AffeWithEval(i), num_objects)
+    print("Memory per empty Affe:")
+    print(f"  eval-based: {bytes_old:8.0f} bytes")
+    print(f"  slotted:    {bytes_new:8.0f} bytes")
@@ -0,0 +1,188 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_fake_nft_api_server import FakeNFTAPIServer
+from class_synthetic_affe_data import SyntheticAffeData
+
+
+def fetch_transfers(synthetic: SyntheticAffeData, args, prefetch: bool = False) -> dict:
+    import pandas as pd
+    from class_moralis_http import MoralisHTTP
+    from class_token_bucket import TokenBucket
+    moralis = MoralisHTTP()
+    get_pages = moralis.get_nft_transfers_pages_prefetching if prefetch else moralis.get_nft_transfers_pages
+    num_rows = 0
+    num_pages = 0
+    # Pages that fail with a 429 or a 5xx (see --server-rps and --error-rate) are retried, as in the pipeline.
+    for list_page in get_pages(synthetic.creator_address, direction='both',
+                               rate_limiter=TokenBucket(args.client_rps) if args.client_rps else None):
+        # Each page is turned into a dataframe and filtered, as the transfers stage does.
+        df_page = pd.DataFrame(list_page)
+        num_rows += len(df_page[df_page['token_address'] == synthetic.contract_address]) if list_page else 0
+        num_pages += 1
+    moralis.close()
+    return {'rows': num_rows, 'pages': num_pages, 'retried': moralis.num_retries}
+
+
+def fetch_transfers_prefetch(synthetic: SyntheticAffeData, args) -> dict:
+    return fetch_transfers(synthetic, args, prefetch=True)
+
+
+def fetch_resync(synthetic: SyntheticAffeData, args) -> dict:
+    from class_moralis_resync_scheduler import MoralisResyncScheduler
+    scheduler = MoralisResyncScheduler(requests_per_second=args.client_rps, burst_size=args.concurrency)
+    report = scheduler.resync_many_nft_tokens_metadata(synthetic.contract_address, synthetic.token_ids)
+    return {'accepted': report['accepted'], 'rejected': report['rejected'], 'retried': report['retried']}
+
+
+def fetch_extras_html(synthetic: SyntheticAffeData, args) -> dict:
+    from class_opensea_html_extractor import OpenseaHTMLPropertiesExtractor
+    opensea = OpenseaHTMLPropertiesExtractor(synthetic.contract_address,
+                                             max_requests_in_flight=args.concurrency,
+                                             requests_per_second=args.client_rps)
+    # Only the tokens that survive refining are scraped (as in the pipeline.)
+    df = opensea.get_many_nfts_properties(synthetic.extras()['token_id'])
+    return {'rows': len(df)}
+
+
+def fetch_metadata(synthetic: SyntheticAffeData, args) -> dict:
+    from class_concurrent_metadata_fetcher import ConcurrentMetadataFetcher
+    from class_pooled_http_client import PooledHTTPClient
+    from class_moralis_http import MoralisHTTP
+    # Every thread gets its own MoralisHTTP on one pooled session, as in the pipeline.
+    client = PooledHTTPClient('moralis', pool_size=args.concurrency)
+    list_clients = []
+
+    def new_moralis_http():
+        moralis = MoralisHTTP(timeout_seconds=client.timeout, session=client.session)
+        list_clients.append(moralis)
+        return moralis
+
+    fetcher = ConcurrentMetadataFetcher(max_requests_in_flight=args.concurrency, requests_per_second=args.client_rps,
+                                        client_factory=new_moralis_http)
+    df = fetcher.get_many_nft_tokens_metadata(synthetic.contract_address, synthetic.token_ids,
+                                              list_of_metadata_fields_to_extract=['name', 'description', 'image'])
+    client.close()
+    return {'rows': len(df), 'retried': sum(moralis.num_retries for moralis in list_clients)}
+
+
+# The fetches that can be pointed at the fake server (the clients read its urls from the environment.)
+dict_fetches = {'transfers': fetch_transfers,
+                'metadata': fetch_metadata,
+                'transfers_prefetch': fetch_transfers_prefetch,
+                'resync': fetch_resync,
+                'extras_html': fetch_extras_html}
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the stages that fetch data, against a local fake of "
+                                                 "the Moralis API and the OpenSea website.")
+    parser.add_argument('--tokens', type=int, default=250, help="Number of tokens. Default: %(default)s")
+    parser.add_argument('--traits', type=int, default=20, help="Number of rare traits. Default: %(default)s")
+    parser.add_argument('--fetches', default=','.join(dict_fetches),
+                        help="Comma-separated fetches to run. Default: all of them (%(default)s)")
+    parser.add_argument('--latency-ms', type=float, default=50, help="Typical latency. Default: %(default)s")
+    parser.add_argument('--latency-distribution', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help="Spread (uniform) or sigma (lognormal) of the latency. Default: %(default)s")
+    parser.add_argument('--page-size', type=int, default=100, help="Transfers per page. Default: %(default)s")
+    parser.add_argument('--server-rps', type=float, default=25,
+                        help="Quota of the fake Moralis API, above which it answers 429. 0 for no limit. "
+                             "Default: %(default)s")
+    parser.add_argument('--opensea-rps', type=float, default=0,
+                        help="Quota of the fake OpenSea website. 0 for no limit. Default: %(default)s")
+    parser.add_argument('--error-rate', type=float, default=0.01,
+                        help="Share of requests answered with a 5xx. Default: %(default)s")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight. Default: %(default)s")
+    parser.add_argument('--client-rps', type=float, default=20,
+                        help="Rate the clients throttle themselves to. Default: %(default)s")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--port', type=int, default=0, help="Port of the fake server (0 picks a free one.)")
+    parser.add_argument('--serve', action='store_true',
+                        help="Only run the fake server (until Ctrl+C), eg. to point the full pipeline at it.")
+    parser.add_argument('--output', default='benchmark_fetch_report.json', help="Where the JSON report is written.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    list_fetch_names = [name.strip() for name in args.fetches.split(',') if name.strip()]
+    list_unknown = [name for name in list_fetch_names if name not in dict_fetches]
+    if list_unknown:
+        parser.error(f"Unknown fetches: {', '.join(list_unknown)}. Known fetches: {', '.join(dict_fetches)}")
+
+    synthetic = SyntheticAffeData(args.tokens, num_traits=args.traits, seed=args.seed)
+    server = FakeNFTAPIServer.from_synthetic_data(synthetic,
+                                                  port=args.port,
+                                                  latency_seconds=args.latency_ms / 1000,
+                                                  latency_distribution=args.latency_distribution,
+                                                  latency_spread=args.latency_spread,
+                                                  page_size=args.page_size,
+                                                  moralis_requests_per_second=args.server_rps or None,
+                                                  opensea_requests_per_second=args.opensea_rps or None,
+                                                  error_rate=args.error_rate,
+                                                  seed=args.seed)
+    with server:
+        # The clients read their base urls (and the API key) from the environment.
+        os.environ.update(server.environment())
+        os.environ.setdefault('MORALIS_KEY', 'fake-key')
+
+        if args.serve:
+            for name, value in server.environment().items():
+                print(f"export {name}={value}")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                sys.exit(0)
+
+        list_results = []
+        for fetch_name in list_fetch_names:
+            requests_before = server.stats['requests']
+            connections_before = server.stats['connections']
+            dict_status_before = dict(server.stats['by_status'])
+            start = time.perf_counter()
+            try:
+                result = dict_fetches[fetch_name](synthetic, args)
+            except Exception as e:
+                # A fetch that still fails once its retries are used up is reported, and the others still run.
+                logging.error(f"{fetch_name} failed: {e!r}")
+                result = {'error': repr(e)}
+            seconds = time.perf_counter() - start
+            num_requests = server.stats['requests'] - requests_before
+            num_connections = server.stats['connections'] - connections_before
+            dict_statuses = {str(status): count - dict_status_before.get(status, 0)
+                             for status, count in server.stats['by_status'].items()
+                             if count - dict_status_before.get(status, 0)}
+            list_results.append({'fetch': fetch_name, 'seconds': seconds, 'requests': num_requests,
+                                 'requests_per_second': num_requests / seconds if seconds else None,
+                                 'connections': num_connections,
+                                 'responses_by_status': dict_statuses, **result})
+            logging.warning(f"{fetch_name:<18} {seconds:8.2f} s, {num_requests} requests, {num_connections} connections, statuses {dict_statuses}, "
+                            f"{result}")
+
+    report = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'git_commit': get_git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'params': {key: value for key, value in vars(args).items() if key not in ('serve', 'output', 'port')},
+              'results': list_results}
+    with open(args.output, mode='w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to '{args.output}'")
@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_affe_data_getter import AffeDataGetter
+from class_affe_data_manipulator import AffeDataManipulator
+from class_affe_index import AffeIndex
+from class_affe_rarity import AffeRarity
+from class_ownership_ledger import OwnershipLedger
+from class_synthetic_affe_data import SyntheticAffeData
+
+
+# The stages that are benchmarked, in the order they run. Each one takes the outputs of the stages
+# before it from 'context' (a dict), and returns its own output, which is stored in 'context' under
+# the name of the stage. The stages that fetch data from the internet are not benchmarked here.
+def stage_refine(context: dict):
+    return context['getter'].refine_nft_data(df_with_nft_data=context['nfts'])
+
+
+def stage_combine(context: dict):
+    return context['getter'].combine_data(list_of_dataframes_with_data_to_combine=[context['extras'],
+                                                                                  context['refine']])
+
+
+def stage_reorganize(context: dict):
+    # reorganize_the_data moves columns around in the dataframe it is given, so it gets a copy.
+    return context['getter'].reorganize_the_data(AffeDataGetter.list_ordered_columns,
+                                                 df_with_combined_data=context['combine'].copy())
+
+
+def stage_make_affe_objects(context: dict):
+    return AffeDataManipulator(context['reorganize'], context['fullpath_run_dir']).make_affe_objects()
+
+
+def stage_dump_all_to_json(context: dict):
+    # Every run of this stage starts from an empty output directory, so that files are really
+    # written (rather than skipped, because they did not change since the previous run.)
+    fullpath_output = context['fullpath_run_dir'] / 'output'
+    for dir_name in ['normal_json', 'opensea_style_json', 'flat_json']:
+        shutil.rmtree(fullpath_output / dir_name, ignore_errors=True)
+    return AffeDataManipulator(context['reorganize'], context['fullpath_run_dir']).dump_all_to_json()
+
+
+def stage_rarity(context: dict):
+    return AffeRarity(context['reorganize']).scores()
+
+
+def stage_index(context: dict):
+    return AffeIndex(context['reorganize'])
+
+
+def stage_ownership_ledger(context: dict):
+    return OwnershipLedger.from_transfers(context['transfers'])
+
+
+dict_stages = {'refine': (stage_refine, 'nfts'),
+               'combine': (stage_combine, 'refine'),
+               'reorganize': (stage_reorganize, 'combine'),
+               'make_affe_objects': (stage_make_affe_objects, 'reorganize'),
+               'dump_all_to_json': (stage_dump_all_to_json, 'reorganize'),
+               'rarity': (stage_rarity, 'reorganize'),
+               'index': (stage_index, 'reorganize'),
+               'ownership_ledger': (stage_ownership_ledger, 'transfers')}
+
+
+def parse_size(text: str) -> int:
+    """A number of tokens, such as 250, 25k or 1M."""
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    text = text.strip().lower()
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+
+def count_rows(output) -> int:
+    try:
+        return len(output)
+    except TypeError:
+        return None
+
+
+def measure(function, context: dict, repeat: int, measure_memory: bool) -> dict:
+    """Run a stage 'repeat' times to time it, and once more to measure its peak memory."""
+    list_seconds = []
+    output = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function(context)
+        list_seconds.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if measure_memory:
+        # Tracing allocations slows python down a lot, which is why it is done in a separate run.
+        # Only memory allocated by python is counted (not, for example, the buffers of pyarrow.)
+        tracemalloc.start()
+        function(context)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {'output': output,
+            'seconds_min': min(list_seconds),
+            'seconds_median': median(list_seconds),
+            'peak_memory_bytes': peak_memory}
+
+
+def run_benchmarks(list_sizes: list, num_traits: int, list_stage_names: list, repeat: int,
+                   measure_memory: bool, storage_format: str, seed: int) -> list:
+    # The stages that were asked for, and every stage whose output they need.
+    set_needed_stages = set(list_stage_names)
+    for stage_name in reversed(list(dict_stages)):
+        if stage_name in set_needed_stages:
+            set_needed_stages.add(dict_stages[stage_name][1])
+
+    # The synthetic traits are given the names of the real ones, so the tables have the same columns.
+    set_not_traits = set(AffeDataManipulator.fields_to_ignore_as_affen_attributes)
+    list_known_trait_names = [col for col in AffeDataGetter.list_ordered_columns if col not in set_not_traits]
+
+    list_results = []
+    for num_tokens in list_sizes:
+        logging.warning(f"Benchmarking {num_tokens} tokens with {num_traits} traits...")
+        with tempfile.TemporaryDirectory(prefix='affe_benchmark_') as dir_name:
+            fullpath_run_dir = Path(dir_name)
+            synthetic = SyntheticAffeData(num_tokens, num_traits=num_traits, seed=seed,
+                                          list_known_trait_names=list_known_trait_names)
+            start = time.perf_counter()
+            context = {'nfts': synthetic.nfts(),
+                       'extras': synthetic.extras(),
+                       'transfers': synthetic.transfers(),
+                       'fullpath_run_dir': fullpath_run_dir,
+                       'getter': AffeDataGetter(synthetic.contract_address, fullpath_run_dir,
+                                                use_response_cache=False, storage_format=storage_format)}
+            logging.warning(f"  synthetic data generated in {time.perf_counter() - start:.2f} s")
+
+            for stage_name, (function, input_name) in dict_stages.items():
+                if stage_name not in list_stage_names:
+                    # Stages that were not asked for still run (once, untimed) if a later stage needs their output.
+                    if stage_name in set_needed_stages:
+                        context[stage_name] = function(context)
+                    continue
+                measurements = measure(function, context, repeat, measure_memory)
+                context[stage_name] = measurements.pop('output')
+                result = {'stage': stage_name,
+                          'num_tokens': num_tokens,
+                          'num_traits': num_traits,
+                          'rows_in': count_rows(context[input_name]),
+                          'rows_out': count_rows(context[stage_name]),
+                          **measurements}
+                list_results.append(result)
+                memory = f", peak {result['peak_memory_bytes'] / 2 ** 20:.1f} MiB" if measure_memory else ''
+                logging.warning(f"  {stage_name:<20} {result['seconds_min'] * 1000:10.1f} ms{memory}")
+    return list_results
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(dict_previous: dict, dict_current: dict):
+    """Print, for every stage and size in both reports, how the time and memory changed."""
+    def key(result):
+        return result['stage'], result['num_tokens'], result['num_traits']
+    dict_previous_results = {key(result): result for result in dict_previous['results']}
+    print(f"{'stage':<20} {'tokens':>9} {'before ms':>11} {'after ms':>11} {'ratio':>7} {'memory ratio':>13}")
+    for result in dict_current['results']:
+        previous = dict_previous_results.get(key(result))
+        if previous is None:
+            continue
+        ratio = result['seconds_min'] / previous['seconds_min'] if previous['seconds_min'] else float('nan')
+        memory_ratio = ''
+        if result['peak_memory_bytes'] and previous['peak_memory_bytes']:
+            memory_ratio = f"{result['peak_memory_bytes'] / previous['peak_memory_bytes']:.2f}"
+        print(f"{result['stage']:<20} {result['num_tokens']:>9} {previous['seconds_min'] * 1000:>11.1f} "
+              f"{result['seconds_min'] * 1000:>11.1f} {ratio:>7.2f} {memory_ratio:>13}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the offline stages of the pipeline on synthetic data.")
+    parser.add_argument('--sizes', default='250,2500,25k',
+                        help="Comma-separated numbers of tokens (eg. 250,25k,1M). Default: %(default)s")
+    parser.add_argument('--traits', type=int, default=20, help="Number of rare traits. Default: %(default)s")
+    parser.add_argument('--stages', default=','.join(dict_stages),
+                        help="Comma-separated stages to benchmark. Default: all of them (%(default)s)")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per stage. Default: %(default)s")
+    parser.add_argument('--no-memory', action='store_true', help="Do not measure peak memory.")
+    parser.add_argument('--storage-format', default='parquet', choices=['parquet', 'feather', 'csv'])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_report.json', help="Where the JSON report is written.")
+    parser.add_argument('--compare', metavar='PREVIOUS_REPORT',
+                        help="A report from a previous run (eg. another commit) to compare against.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+
+    list_stage_names = [name.strip() for name in args.stages.split(',') if name.strip()]
+    list_unknown = [name for name in list_stage_names if name not in dict_stages]
+    if list_unknown:
+        parser.error(f"Unknown stages: {', '.join(list_unknown)}. Known stages: {', '.join(dict_stages)}")
+
+    report = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'git_commit': get_git_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'params': {'sizes': [parse_size(size) for size in args.sizes.split(',')],
+                         'num_traits': args.traits,
+                         'repeat': args.repeat,
+                         'measure_memory': not args.no_memory,
+                         'storage_format': args.storage_format,
+                         'seed': args.seed}}
+    report['results'] = run_benchmarks(report['params']['sizes'], args.traits, list_stage_names, args.repeat,
+                                       not args.no_memory, args.storage_format, args.seed)
+    with open(args.output, mode='w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to '{args.output}'")
+
+    if args.compare:
+        with open(args.compare, mode='r') as f:
+            compare_reports(json.load(f), report)
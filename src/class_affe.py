@@ -1,10 +1,33 @@
 import json
+from operator import attrgetter
 from pathlib import Path
+from class_change_aware_writer import ChangeAwareWriter
 
 
 class Affe:
     """Each instance of this class represents and individual ape."""
 
+    # The fields of the class in order of preference (this is the order in which they appear
+    # in the dictionary returned by make_dict.) The list CAN be auto-computed in code with dir(),
+    # but the result is sorted alphabetically, so I prefer to keep it here. It is also used as
+    # the __slots__ of the class, so instances don't carry a __dict__ (or a copy of this list.)
+    list_of_elements = ('id',
+                        'name_strict',
+                        'name_friendly',
+                        'story',
+                        'attributes_common',
+                        'emotions_common',
+                        'attributes_rare_textual',
+                        'attributes_rare_numerical',
+                        'image_url',
+                        'website',
+                        'animation_url',
+                        'legacy_id'
+                        )
+    __slots__ = list_of_elements
+    # Reads all of the fields above from an instance in one call (see make_dict.)
+    _get_all_elements = attrgetter(*list_of_elements)
+
     def __init__(self, id: int, name_strict: str = ""):
         """
         Method to initialize an object representing an ape.
@@ -22,22 +45,6 @@ class Affe:
         self.website = ""
         self.animation_url = ""
         self.legacy_id = ""
-        # the list below CAN be auto-computed in code with dir() and (not) callable() and getattr(),
-        # but the result is sorted alphabetically, so I prefer to keep a list here that tracks the
-        # elements of the class in order of preference.
-        self.list_of_elements = ['self.id',
-                                 'self.name_strict',
-                                 'self.name_friendly',
-                                 'self.story',
-                                 'self.attributes_common',
-                                 'self.emotions_common',
-                                 'self.attributes_rare_textual',
-                                 'self.attributes_rare_numerical',
-                                 'self.image_url',
-                                 'self.website',
-                                 'self.animation_url',
-                                 'self.legacy_id'
-                                 ]
     # ------------------------ END FUNCTION ------------------------ #
 
     def __repr__(self):
@@ -114,7 +121,8 @@ class Affe:
         self.add_common_attribute("Trusts in Humanity", False)
     # ------------------------ END FUNCTION ------------------------ #
 
-    def dump_to_json(self, full_path_to_output_directory: Path, style: str, pretty: bool = True) -> dict:
+    def dump_to_json(self, full_path_to_output_directory: Path, style: str, pretty: bool = True,
+                     writer: ChangeAwareWriter = None) -> dict:
         """
         A method to dump to disk the object
         :param full_path_to_output_directory: The directory to save the object to. The filename will
@@ -126,6 +134,8 @@ class Affe:
           - 'nft-style' will organize and rename the fields slightly so that places like OpenSea will 'understand'
             the metadata. Eg. 'story' will be renamed to 'description' in the json output.
         :param pretty: Whether the json should be indented or not
+        :param writer: If given (it should be writing to full_path_to_output_directory), the file is
+          written through it, which means it is only rewritten if its content changed.
         :return: The dictionary that was used to dump the object to json format.
         """
         dict_to_dump = {}
@@ -140,6 +150,9 @@ class Affe:
         kwargs = {}
         if pretty:
             kwargs = {'indent': 2}
+        if writer is not None:
+            writer.write_json(full_path_to_json_file.name, dict_to_dump, **kwargs)
+            return dict_to_dump
         with open(full_path_to_json_file, mode='w') as f:
             json.dump(dict_to_dump, f, **kwargs)
         return dict_to_dump
@@ -151,11 +164,7 @@ class Affe:
         in the class is saved as an element in the dictionary.
         :return: A dictionary representing an Affe.
         """
-        dict_to_return = {}
-        for item in self.list_of_elements:
-            element_name = item.replace('self.', '')
-            dict_to_return[element_name] = eval(item)
-        return dict_to_return
+        return dict(zip(self.list_of_elements, self._get_all_elements(self)))
     # ------------------------ END FUNCTION ------------------------ #
 
     def make_dict_nft_style(self) -> dict:
@@ -0,0 +1,212 @@
+import numpy as np
+import pandas as pd
+from class_affe import Affe
+
+
+class AffeCollection:
+    """This class holds many Affen in columnar form, so that questions about the whole collection
+    are answered with array operations rather than loops over Affe objects. Emotions and numeric
+    rare traits are stored as a dense integer matrix (one row per Affe, one column per trait), and
+    textual traits as categorical codes. Individual Affe objects can still be rebuilt on demand."""
+
+    # The value stored in the matrices for an Affe that does not have a particular trait.
+    missing_value = -1
+
+    def __init__(self, iterable_with_affen):
+        """
+        Initialize the AffeCollection class.
+        :param iterable_with_affen: The Affe objects that make up the collection.
+        """
+        list_affen = list(iterable_with_affen)
+        self.ids = np.array([affe.id for affe in list_affen], dtype=np.int64)
+        self.dict_row_of_id = {affe_id: row for row, affe_id in enumerate(self.ids.tolist())}
+
+        # Fields that are not part of any matrix are kept as-is, so Affe objects can be rebuilt.
+        self.list_scalars = [{'name_strict': affe.name_strict,
+                              'name_friendly': affe.name_friendly,
+                              'story': affe.story,
+                              'image_url': affe.image_url,
+                              'website': affe.website,
+                              'animation_url': affe.animation_url,
+                              'legacy_id': affe.legacy_id,
+                              'attributes_common': dict(affe.attributes_common)} for affe in list_affen]
+
+        # Integer matrices: the emotions, and the numeric rare traits.
+        self.emotion_names, self.emotions = self.__build_int_matrix(
+            [affe.emotions_common for affe in list_affen])
+        self.numeric_trait_names, self.numeric_traits = self.__build_int_matrix(
+            [affe.attributes_rare_numerical for affe in list_affen])
+
+        # Textual traits, as categorical codes. codes[row, col] is the position of the value in
+        # categories[trait name] (or missing_value if the Affe does not have that trait.)
+        self.text_trait_names = self.__ordered_keys([affe.attributes_rare_textual for affe in list_affen])
+        self.dict_text_categories = {}
+        self.text_codes = np.full((len(list_affen), len(self.text_trait_names)), self.missing_value, dtype=np.int32)
+        for col, trait in enumerate(self.text_trait_names):
+            values = pd.Categorical([affe.attributes_rare_textual.get(trait) for affe in list_affen])
+            self.dict_text_categories[trait] = list(values.categories)
+            self.text_codes[:, col] = values.codes
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def from_dataframe(cls, df_affen: pd.DataFrame, full_path_to_data_dir):
+        """Build a collection from the final Affen dataframe (eg. the content of affe.csv.)"""
+        # Imported here, as the manipulator imports a fair amount that this class otherwise doesn't need.
+        from class_affe_data_manipulator import AffeDataManipulator
+        return cls(AffeDataManipulator(df_affen, full_path_to_data_dir).make_affe_objects())
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __len__(self):
+        return len(self.ids)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def distribution(self, trait: str) -> pd.Series:
+        """
+        How many Affen have each value of a trait (an emotion, a numeric or a textual trait.)
+        :return: A series of value -> count, sorted by value. Affen without the trait are not counted.
+        """
+        matrix, col = self.__locate(trait)
+        column = matrix[:, col]
+        present = column != self.missing_value
+        values, counts = np.unique(column[present], return_counts=True)
+        if matrix is self.text_codes:
+            values = [self.dict_text_categories[trait][code] for code in values]
+        return pd.Series(counts, index=values, name=trait)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def distributions(self, emotions: bool = True, numeric_traits: bool = True) -> pd.DataFrame:
+        """
+        The distribution of every emotion and/or numeric trait at once.
+        :return: A dataframe with one row per trait and one column per value.
+        """
+        list_names = []
+        list_matrices = []
+        if emotions:
+            list_names.extend(self.emotion_names)
+            list_matrices.append(self.emotions)
+        if numeric_traits:
+            list_names.extend(self.numeric_trait_names)
+            list_matrices.append(self.numeric_traits)
+        if not list_names:
+            return pd.DataFrame()
+        matrix = np.hstack(list_matrices)
+        max_value = max(int(matrix.max(initial=0)), 0)
+        # One bincount per column, shifted by one so that missing values (-1) land in bin 0,
+        # which is then dropped.
+        counts = np.apply_along_axis(lambda column: np.bincount(column + 1, minlength=max_value + 2), 0, matrix)
+        return pd.DataFrame(counts[1:].T, index=list_names, columns=range(0, max_value + 1))
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def mask(self, trait: str, equals=None, minimum: int = None, maximum: int = None) -> np.ndarray:
+        """
+        A boolean array (one element per Affe) that is True where the Affe meets a condition on a
+        trait. Several masks can be combined with & | ~ before passing them to ids_where.
+        :param trait: The name of an emotion, numeric or textual trait.
+        :param equals: If given, the value of the trait must be equal to this.
+        :param minimum: If given, the value of a numeric trait must be at least this.
+        :param maximum: If given, the value of a numeric trait must be at most this.
+        :return: If no condition is given, the mask is True wherever the Affe has the trait.
+        """
+        matrix, col = self.__locate(trait)
+        column = matrix[:, col]
+        result = column != self.missing_value
+        if matrix is self.text_codes:
+            if minimum is not None or maximum is not None:
+                raise ValueError(f"Trait '{trait}' is textual, so it cannot be compared with a minimum or maximum.")
+            if equals is not None:
+                list_categories = self.dict_text_categories[trait]
+                code = list_categories.index(equals) if equals in list_categories else self.missing_value - 1
+                result &= column == code
+            return result
+        if equals is not None:
+            result &= column == equals
+        if minimum is not None:
+            result &= column >= minimum
+        if maximum is not None:
+            result &= column <= maximum
+        return result
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def ids_where(self, mask: np.ndarray) -> np.ndarray:
+        """The ids of the Affen for which a mask (see the mask method) is True."""
+        return self.ids[mask]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def lookup(self, affe_id: int) -> dict:
+        """
+        All the emotions and traits of one Affe.
+        :return: A dict of trait name -> value, only for the traits the Affe has.
+        """
+        row = self.dict_row_of_id[affe_id]
+        dict_traits = {}
+        for names, matrix in ((self.emotion_names, self.emotions), (self.numeric_trait_names, self.numeric_traits)):
+            for col, name in enumerate(names):
+                if matrix[row, col] != self.missing_value:
+                    dict_traits[name] = int(matrix[row, col])
+        for col, name in enumerate(self.text_trait_names):
+            code = self.text_codes[row, col]
+            if code != self.missing_value:
+                dict_traits[name] = self.dict_text_categories[name][code]
+        return dict_traits
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_affe(self, affe_id: int) -> Affe:
+        """Rebuild the Affe object of one Affe of the collection."""
+        row = self.dict_row_of_id[affe_id]
+        dict_scalars = self.list_scalars[row]
+        affe = Affe(affe_id, dict_scalars['name_strict'])
+        affe.set_name_friendly(dict_scalars['name_friendly'])
+        affe.set_story(dict_scalars['story'])
+        affe.set_image(dict_scalars['image_url'])
+        affe.set_website(dict_scalars['website'])
+        affe.set_animation(dict_scalars['animation_url'])
+        affe.set_legacyid(dict_scalars['legacy_id'])
+        for name, value in dict_scalars['attributes_common'].items():
+            affe.add_common_attribute(name, value)
+        for col, name in enumerate(self.emotion_names):
+            if self.emotions[row, col] != self.missing_value:
+                affe.add_common_emotion(name, int(self.emotions[row, col]))
+        for col, name in enumerate(self.text_trait_names):
+            code = self.text_codes[row, col]
+            if code != self.missing_value:
+                affe.add_rare_textual_attributes(name, self.dict_text_categories[name][code])
+        for col, name in enumerate(self.numeric_trait_names):
+            if self.numeric_traits[row, col] != self.missing_value:
+                affe.add_rare_numerical_attributes(name, int(self.numeric_traits[row, col]))
+        return affe
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __iter__(self):
+        """Iterate over the collection as Affe objects (each one is rebuilt as it is reached.)"""
+        for affe_id in self.ids.tolist():
+            yield self.get_affe(affe_id)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __build_int_matrix(self, list_dicts: list):
+        list_names = self.__ordered_keys(list_dicts)
+        dict_col_of_name = {name: col for col, name in enumerate(list_names)}
+        matrix = np.full((len(list_dicts), len(list_names)), self.missing_value, dtype=np.int32)
+        for row, dict_values in enumerate(list_dicts):
+            for name, value in dict_values.items():
+                matrix[row, dict_col_of_name[name]] = value
+        return list_names, matrix
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __ordered_keys(list_dicts: list) -> list:
+        """All the keys of a list of dicts, in order of first appearance."""
+        dict_keys = {}
+        for dict_values in list_dicts:
+            dict_keys.update(dict.fromkeys(dict_values))
+        return list(dict_keys)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __locate(self, trait: str):
+        """The matrix that holds a trait, and the column of the trait within that matrix."""
+        for names, matrix in ((self.emotion_names, self.emotions),
+                              (self.numeric_trait_names, self.numeric_traits),
+                              (self.text_trait_names, self.text_codes)):
+            if trait in names:
+                return matrix, names.index(trait)
+        raise KeyError(f"The collection has no trait called '{trait}'.")
+    # ------------------------ END FUNCTION ------------------------ #
@@ -1,27 +1,112 @@
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import mkdir
 from os.path import exists
 import pandas as pd
 from pathlib import Path
-from class_api_interactions_moralis import MoralisAPIinteractions
-from class_api_interactions_opensea import OpenseaAPIinteractions
-from class_selenium_opensea import SeleniumOnOpensea
+import requests
+from class_keyed_join import KeyedJoin
+from class_moralis_http import MoralisHTTP
+from class_moralis_resync_scheduler import MoralisResyncScheduler
+from class_opensea_html_extractor import OpenseaHTMLPropertiesExtractor
+from class_opensea_http import OpenseaHTTP
+from class_ownership_ledger import OwnershipLedger
+from class_pooled_http_client import PooledHTTPClient
+from class_response_cache import ResponseCache
+from class_run_instrumentation import RunInstrumentation
+from class_stage_graph import Stage, StageGraph
+from class_table_storage import TableStorage
+from class_token_bucket import TokenBucket
+from class_token_journal import TokenJournal
 from helper_functions import get_last_segment_of_url
 
+# Selenium, and the streaming pipeline (which may need it) are slow to import, and only some of
+# the stages use them, so they are imported by the methods that need them (see get_affe_data.py,
+# whose short subcommands don't.)
+
 
 class AffeDataGetter:
     """This class orchestrates the extraction of Affe data ."""
 
-    def __init__(self, contract_address_with_affe_data, full_path_to_data_dir: Path):
+    # The columns that should appear first (and in this order) in the final data.
+    list_ordered_columns = ['name', 'CHIMP', 'AK47', 'Anger', 'Anticipation', 'Disgust',
+                            'Fear', 'Joy', 'Negative', 'Positive', 'Sadness', 'Surprise',
+                            'Trust', 'description', 'SPECIAL ABILITY', 'TRINKET',
+                            'FIREWORKS', 'HAT', 'FLOWER', 'SUNGLASSES',
+                            'PET', 'MONOCLE', 'APEBALL', 'PIPE', 'JEWELLERY', 'CIGAR',
+                            'SEASON', 'BOWTIE', 'SPECIAL ATTRIBUTE', 'DRINK', 'PANTS',
+                            'FLAG', 'Damage', 'Parry', 'Speed']
+    # The fields of the metadata of each token that are kept from the responses of Moralis.
+    metadata_fields_of_interest = ['name', 'description', 'image', 'external_link', 'animation_url']
+    # The stages of the pipeline (see build_stage_graph) that fetch data from the internet, and
+    # the ones that only work on data that is already on disk.
+    network_stage_names = ['transfers', 'ownership', 'resync', 'moralis_metadata', 'opensea_augment', 'extras']
+    offline_stage_names = ['refine', 'combine', 'reorganize']
+
+    def __init__(self, contract_address_with_affe_data, full_path_to_data_dir: Path,
+                 moralis_max_requests_in_flight: int = 8,
+                 moralis_requests_per_second: float = 5.0,
+                 moralis_max_marker_pages: int = 50,
+                 opensea_num_browsers: int = 4,
+                 opensea_properties_backend: str = 'selenium',
+                 use_response_cache: bool = True,
+                 response_cache_ttl_hours: float = 7 * 24,
+                 storage_format: str = 'parquet',
+                 export_csv: bool = False,
+                 fullpath_prometheus_textfile: Path = None,
+                 trace_python_allocations: bool = False,
+                 http_clients: dict = None,
+                 http_pool_size: int = 16,
+                 http_connect_timeout_seconds: float = 10,
+                 http_read_timeout_seconds: float = 30):
         """
         Initialize the AffeDataGetter class.
         Args:
             full_path_to_data_dir: Path to a directory where this class will output
               intermediate working files, and final output files to. The directory
               should already exist.
+            moralis_max_requests_in_flight: How many metadata requests may be waiting on
+              the Moralis API at the same time.
+            moralis_requests_per_second: The sustained request rate allowed by our Moralis
+              plan; metadata requests are throttled to stay below it.
+            moralis_max_marker_pages: The most pages of the Moralis listing of the contract that are
+              read to learn the current sync markers of the tokens (see get_live_sync_markers.) Cached
+              metadata is only served for tokens whose markers were found. None reads the whole listing.
+            opensea_num_browsers: How many headless browsers scrape OpenSea at the same time.
+            opensea_properties_backend: How the extra properties of each NFT are obtained from
+              OpenSea. Acceptable values are 'selenium' (render the item page in a browser) and
+              'html' (download the raw item page and parse the JSON embedded in it.)
+            use_response_cache: Whether per-token API responses are cached on disk between runs, so
+              that tokens that have not changed are not fetched again. Set to False to bypass the cache.
+            response_cache_ttl_hours: How long a cached response is trusted for.
+            storage_format: The format in which intermediate and final tables are stored. Acceptable
+              values are 'parquet', 'feather' and 'csv' (see TableStorage.)
+            export_csv: Whether a CSV copy of every intermediate table is written as well. The final
+              table is always exported to CSV too (affe.csv.)
+            fullpath_prometheus_textfile: If given, the measurements of every run (see
+              RunInstrumentation) are also written to this file, in the Prometheus text format
+              (eg. into the directory read by the textfile collector of node_exporter.)
+            trace_python_allocations: Whether the peak memory allocated by python is measured for
+              every stage (on top of the memory of the process.) It slows the run down noticeably.
+            http_clients: The HTTP clients (PooledHTTPClient) to talk to each API with, as a dict with
+              the keys 'moralis' and 'opensea' (eg. to share them between several getters, or to
+              point them at a fake server.) The ones that are not provided are created, with the
+              settings below, and closed by close(). The ones provided are left to their owner to close.
+            http_pool_size: How many connections are kept open to each API.
+            http_connect_timeout_seconds: How long to wait for a connection to an API to be established.
+            http_read_timeout_seconds: How long to wait for an API to send data.
         """
 
         self.affe_contract_address = contract_address_with_affe_data
+        self.moralis_max_requests_in_flight = moralis_max_requests_in_flight
+        self.moralis_requests_per_second = moralis_requests_per_second
+        self.moralis_max_marker_pages = moralis_max_marker_pages
+        self.opensea_num_browsers = opensea_num_browsers
+        if opensea_properties_backend not in ('selenium', 'html'):
+            raise ValueError(f"Unknown OpenSea properties backend -> '{opensea_properties_backend}'")
+        self.opensea_properties_backend = opensea_properties_backend
 
         # This class will store some files on disk in three directories called
         # 'intermediate_files', 'manual_files', and 'output', so we'll check to see if they exist,
@@ -36,163 +121,556 @@ class AffeDataGetter:
         if not exists(self.fullpath_dir_output):
             mkdir(self.fullpath_dir_output)
 
+        # Every run measures how long each stage took, how many calls it made to the APIs, how many
+        # rows it read and wrote, etc. (see RunInstrumentation), and writes it all to a report.
+        self.trace_python_allocations = trace_python_allocations
+        self.instrumentation = RunInstrumentation(trace_python_allocations=trace_python_allocations)
+        self.fullpath_run_report = full_path_to_data_dir / 'run_report.json'
+        self.fullpath_prometheus_textfile = fullpath_prometheus_textfile
+
+        # One long-lived client per API, whose connections are kept alive and shared by every stage
+        # (and every thread) of every run, so they are only opened (and handshaked) once. Every
+        # request to Moralis (see new_moralis_http) and to OpenSea (see new_opensea_http and
+        # new_opensea_html_extractor) goes through them.
+        self.http_clients = dict(http_clients) if http_clients else {}
+        self.list_owned_http_client_names = []
+        for api_name in ['moralis', 'opensea']:
+            if api_name not in self.http_clients:
+                self.http_clients[api_name] = PooledHTTPClient(api_name,
+                                                               pool_size=http_pool_size,
+                                                               connect_timeout_seconds=http_connect_timeout_seconds,
+                                                               read_timeout_seconds=http_read_timeout_seconds)
+                self.list_owned_http_client_names.append(api_name)
+
+        # Tables are stored with an explicit schema, in the format chosen above
+        self.table_storage = TableStorage(storage_format=storage_format, export_csv=export_csv,
+                                          instrumentation=self.instrumentation)
+
         # Intermediate files
-        self.fullpath_eoa_nft_transfers = self.fullpath_dir_intermediate_files / 'xlii_transactions.csv'
-        self.fullpath_nfts_data = self.fullpath_dir_intermediate_files / 'nfts.csv'
-        self.fullpath_nfts_including_manual_additions = self.fullpath_dir_intermediate_files / 'nfts_manual_os_additions.csv'
-        self.fullpath_nfts_refined_data = self.fullpath_dir_intermediate_files / 'nfts_refined.csv'
-        self.fullpath_nfts_extra_data = self.fullpath_dir_intermediate_files / 'nfts_extra_data.csv'
-        self.fullpath_combined_nft_data = self.fullpath_dir_intermediate_files / 'combined_data.csv'
+        dir_intermediate = self.fullpath_dir_intermediate_files
+        self.fullpath_eoa_nft_transfers = self.table_storage.path(dir_intermediate, 'xlii_transactions')
+        self.fullpath_eoa_nft_transfers_high_water_mark = self.fullpath_dir_intermediate_files / 'xlii_transactions_hwm.json'
+        self.fullpath_nfts_data = self.table_storage.path(dir_intermediate, 'nfts')
+        self.fullpath_nfts_including_manual_additions = self.table_storage.path(dir_intermediate, 'nfts_manual_os_additions')
+        self.fullpath_nfts_refined_data = self.table_storage.path(dir_intermediate, 'nfts_refined')
+        self.fullpath_nfts_extra_data = self.table_storage.path(dir_intermediate, 'nfts_extra_data')
+        self.fullpath_combined_nft_data = self.table_storage.path(dir_intermediate, 'combined_data')
+        self.fullpath_resync_report = self.fullpath_dir_intermediate_files / 'resync_report.json'
+        # The complete transfer history of every Affe (not only the transfers of the creator), from
+        # which the OwnershipLedger is built (see update_ownership_ledger.)
+        self.fullpath_ownership_ledger = self.table_storage.path(dir_intermediate, 'ownership_ledger')
+
+        # Journals of the tokens that the long network stages have finished with (see TokenJournal),
+        # so that a run that dies halfway through one of them can carry on where it stopped.
+        self.fullpath_resync_journal = self.fullpath_dir_intermediate_files / 'resync.journal.jsonl'
+        self.fullpath_nfts_data_journal = self.fullpath_dir_intermediate_files / 'nfts.journal.jsonl'
+        self.fullpath_nfts_extra_data_journal = self.fullpath_dir_intermediate_files / 'nfts_extra_data.journal.jsonl'
+
+        # Cache of per-token responses from Moralis and OpenSea (see ResponseCache)
+        self.response_cache = ResponseCache(self.fullpath_dir_intermediate_files / 'response_cache',
+                                            ttl_seconds=response_cache_ttl_hours * 3600,
+                                            enabled=use_response_cache)
 
         # Manually augmented files
         self.fullpath_additional_opensea_urls = self.fullpath_dir_manual_files / 'additional_opensea_urls.csv'
 
         # Finished product files
-        self.fullpath_final = self.fullpath_dir_output / 'affe.csv'
+        self.fullpath_final = self.table_storage.path(self.fullpath_dir_output, 'affe')
+
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __enter__(self):
+        return self
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def close(self):
+        """Close the connections of the HTTP clients that this class created (see __init__.)"""
+        for api_name in self.list_owned_http_client_names:
+            self.http_clients[api_name].close()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def new_moralis_http(self) -> MoralisHTTP:
+        """A MoralisHTTP that sends its requests through the shared Moralis client."""
+        client = self.http_clients['moralis']
+        return MoralisHTTP(timeout_seconds=client.timeout, session=client.session,
+                           instrumentation=self.instrumentation)
+    # ------------------------ END FUNCTION ------------------------ #
 
+    def new_opensea_http(self) -> OpenseaHTTP:
+        """An OpenseaHTTP that sends its requests through the shared OpenSea client."""
+        client = self.http_clients['opensea']
+        return OpenseaHTTP(timeout_seconds=client.timeout, session=client.session,
+                           instrumentation=self.instrumentation)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def new_opensea_html_extractor(self) -> OpenseaHTMLPropertiesExtractor:
+        """An OpenseaHTMLPropertiesExtractor that downloads the pages through the shared OpenSea client."""
+        client = self.http_clients['opensea']
+        return OpenseaHTMLPropertiesExtractor(self.affe_contract_address, timeout_seconds=client.timeout,
+                                              session=client.session, instrumentation=self.instrumentation)
     # ------------------------ END FUNCTION ------------------------ #
 
     def build_affen_data_files(self,
                                request_moralis_metadata_resync: bool = False,
-                               use_data_already_on_disk: bool = False):
+                               use_data_already_on_disk: bool = False,
+                               full_backfill_of_transfers: bool = False):
         """
         This method gets as much data as it can about Affe mit Waffe, compiling the data
         from several sources, and produces an output file in the form of a csv or parquet.
         The output file is saved in a directory called 'output'.
+        Stages whose inputs have not changed since they last ran are skipped (see build_stage_graph.)
         :param request_moralis_metadata_resync: set this parameter to True if the metadata for some
           NFTs seems to be missing. This will cause a resync of metadata to be requested for each
           token, using the Moralis API.
         :param use_data_already_on_disk: sometimes it can be useful to simply re-process previously
           downloaded data that is already on disk. This parameter can be used to specify this.
+        :param full_backfill_of_transfers: set this parameter to True to download the complete transfer
+          history again, rather than only the transfers since the previous run.
         """
+        self.__start_run()
+        graph = self.build_stage_graph(request_moralis_metadata_resync=request_moralis_metadata_resync,
+                                       full_backfill_of_transfers=full_backfill_of_transfers)
+        try:
+            if use_data_already_on_disk:
+                # Only the stages that work on data already on disk are considered, and each of them
+                # only re-runs if its inputs (or parameters) changed since the last time it ran.
+                graph.run(targets=self.offline_stage_names, include_upstream=False)
+            else:
+                # Data on the internet may have changed even if nothing on disk did, so the stages that
+                # fetch data always run. The stages downstream of them only re-run if what was fetched
+                # is different to what was fetched the previous time.
+                graph.invalidate(self.network_stage_names)
+                graph.run()
+        finally:
+            # The report is written even when a stage fails, as that is when it is needed the most.
+            self.write_run_report()
 
-        # Declarations below are to avoid pycharm from warning about possible use before declaration
-        df_transfers = pd.DataFrame
-        df_nfts = pd.DataFrame
-        # If this method was asked to process the data from disk, then the first method (below) is not
-        # used (only its output, saved to disk, from previous runs of the code, will be used.)
-        if not use_data_already_on_disk:
-            logging.info("---------- GETTING NFT TRANSFER TRANSACTIONS ----------")
-            df_transfers = self.get_eoa_nft_transfers_from_moralis(do_some_refining=True)
+        logging.info("---------- AFFE DATA PREVIEW ----------")
+        self.show_data_on_console(use_data_already_on_disk=True)
 
-        if request_moralis_metadata_resync:
-            # By definition, it doesn't make sense to ask Moralis to re-sync its nft data
-            # if one is only using data from disk. So the code below is only run when the data being
-            # used is NOT from disk.
-            if not use_data_already_on_disk:
-                logging.info("---------- REQUESTING METADATA RESYNC ----------")
-                set_token_ids = set(df_transfers['token_id'])
-                self.request_moralis_to_resync_nft_metadata(set_token_ids)
-
-        # By definition, it doesn't make sense to fetch nft data from Moralis
-        # if one is only using data from disk. So the code below is only run when the data being
-        # used is NOT from disk.
-        if not use_data_already_on_disk:
-            logging.info("---------- GETTING NFT METADATA FROM ON-CHAIN TOKEN URIs ----------")
-            df_nfts = self.get_nft_metadata_from_moralis(df_transfers)
+        logging.info("FOR THE FULL SET OF DATA see the affe.csv file saved to data/output directory.")
+    # ------------------------ END FUNCTION ------------------------ #
 
-        # By definition, it doesn't make sense to fetch nft data from OpenSea
-        # if one is only using data from disk. So the code below is only run when the data being
-        # used is NOT from disk.
-        if not use_data_already_on_disk:
-            logging.info("---------- GETTING NFT METADATA FROM OFF-CHAIN TOKEN URIs ----------")
-            df_nfts_with_manual_os_additions = self.augment_nft_list_using_opensea(df_nfts)
-
-        logging.info("---------- REFINING NFT METADATA ----------")
-        # Below, if we are only going to refine data on disk, we only need to pass one parameter
-        # to the function. However, in the case where use_data_already_on_disk is false (ie. we
-        # want to use data passed as a parameter) we need to add the other parameter as well.
-        kwargs = {'use_data_already_on_disk': use_data_already_on_disk}
-        if not use_data_already_on_disk:
-            kwargs['df_with_nft_data'] = df_nfts_with_manual_os_additions
-        df_refined_nfts = self.refine_nft_data(**kwargs)
+    def build_affen_data_files_streaming(self,
+                                         request_moralis_metadata_resync: bool = False,
+                                         full_backfill_of_transfers: bool = False,
+                                         queue_size: int = 64) -> dict:
+        """
+        The same as build_affen_data_files followed by AffeDataManipulator.dump_all_to_json, but
+        rather than running one stage after the other over every token, each token goes through
+        all the stages on its own, as soon as the previous stage is done with it (see
+        StreamingAffePipeline), so the stages overlap, and the json of the first Affen is written
+        within seconds. Only the transfers (and the ownership ledger, and the resync, if requested)
+        are done beforehand, as they are needed to know which tokens there are.
+        :param request_moralis_metadata_resync: See build_affen_data_files.
+        :param full_backfill_of_transfers: See build_affen_data_files.
+        :param queue_size: How many tokens may wait between two stages of the stream.
+        :return: The report of the streaming run (see StreamingAffePipeline.run.)
+        """
+        from class_streaming_affe_pipeline import StreamingAffePipeline
+        self.__start_run()
+        report = None
+        try:
+            with self.instrumentation.stage('transfers'):
+                df_transfers = self.get_eoa_nft_transfers_from_moralis(do_some_refining=True,
+                                                                       full_backfill=full_backfill_of_transfers)
+            list_token_ids = []
+            if not df_transfers.empty:
+                df_transfers = df_transfers[df_transfers['token_address'] == self.affe_contract_address]
+                list_token_ids = list(dict.fromkeys(df_transfers['token_id']))
+            with self.instrumentation.stage('ownership'):
+                self.update_ownership_ledger(list_token_ids)
+            if request_moralis_metadata_resync:
+                with self.instrumentation.stage('resync'):
+                    self.__run_resync_stage(request_moralis_metadata_resync)
+            with self.instrumentation.stage('streaming'):
+                report = StreamingAffePipeline(self, queue_size=queue_size).run(list_token_ids)
+        finally:
+            self.write_run_report(extra={'streaming': report} if report else None)
+        return report
+    # ------------------------ END FUNCTION ------------------------ #
 
-        # By definition, it doesn't make sense to scrape nft data from OpenSea
-        # if one is only using data from disk. So the code below is only run when the data being
-        # used is NOT from disk (ie. it is being fetched from the interwebs.)
-        if not use_data_already_on_disk:
-            logging.info("---------- GETTING ADDITIONAL NFT METADATA FROM OPENSEA ----------")
-            df_extras = self.get_extra_metadata_from_opensea(df_refined_nfts)
-
-        logging.info("---------- COMBINING METADATA ----------")
-        # Below, if we are only going to combine data on disk, we only need to pass one parameter
-        # to the function. However, in the case where use_data_already_on_disk is false (ie. we
-        # want to use data passed as a parameter) we need to add the other parameter as well.
-        kwargs = {'use_data_already_on_disk': use_data_already_on_disk}
-        if not use_data_already_on_disk:
-            kwargs['list_of_dataframes_with_data_to_combine'] = [df_extras, df_refined_nfts]
-        df_combined = self.combine_data(**kwargs)
-
-        logging.info("---------- REORDERING METADATA ----------")
-        list_ordered_columns = ['name', 'CHIMP', 'AK47', 'Anger', 'Anticipation', 'Disgust',
-                                'Fear', 'Joy', 'Negative', 'Positive', 'Sadness', 'Surprise',
-                                'Trust', 'description', 'SPECIAL ABILITY', 'TRINKET',
-                                'FIREWORKS', 'HAT', 'FLOWER', 'SUNGLASSES',
-                                'PET', 'MONOCLE', 'APEBALL', 'PIPE', 'JEWELLERY', 'CIGAR',
-                                'SEASON', 'BOWTIE', 'SPECIAL ATTRIBUTE', 'DRINK', 'PANTS',
-                                'FLAG', 'Damage', 'Parry', 'Speed']
-        # Below, if we are only going to reorder data on disk, we only need to pass one parameter
-        # to the function. However, in the case where use_data_already_on_disk is false (ie. we
-        # want to use data passed as a parameter) we need to add the other parameter as well.
-        kwargs = {'use_data_already_on_disk': use_data_already_on_disk}
-        if not use_data_already_on_disk:
-            kwargs['df_with_combined_data'] = df_combined
-        df_final = self.reorganize_the_data(list_ordered_columns, **kwargs)
+    def build_stage_graph(self,
+                          request_moralis_metadata_resync: bool = False,
+                          full_backfill_of_transfers: bool = False) -> StageGraph:
+        """
+        This method models the steps that build the Affen data as a graph of stages. Each stage
+        reads the outputs of the stages it depends on from disk, writes its own output file, and
+        records next to that file a fingerprint of its inputs and parameters, so that it is only
+        re-run when one of them changes (or when it is explicitly invalidated.)
+        :param request_moralis_metadata_resync: Whether the 'resync' stage should actually ask
+          Moralis to resync the metadata of the tokens.
+        :param full_backfill_of_transfers: Whether the 'transfers' stage downloads the complete
+          transfer history, rather than only the transfers since the previous run.
+        :return: The graph, ready to be run.
+        """
+        graph = StageGraph(instrumentation=self.instrumentation)
+        graph.add_stage(Stage('transfers',
+                              lambda: self.get_eoa_nft_transfers_from_moralis(do_some_refining=True,
+                                                                              full_backfill=full_backfill_of_transfers),
+                              self.fullpath_eoa_nft_transfers,
+                              params={'contract': self.affe_contract_address, 'do_some_refining': True}))
+        graph.add_stage(Stage('ownership',
+                              lambda: self.update_ownership_ledger(),
+                              self.fullpath_ownership_ledger,
+                              dependencies=['transfers'],
+                              params={'contract': self.affe_contract_address}))
+        graph.add_stage(Stage('resync',
+                              lambda: self.__run_resync_stage(request_moralis_metadata_resync),
+                              self.fullpath_resync_report,
+                              dependencies=['transfers'],
+                              params={'requested': request_moralis_metadata_resync}))
+        graph.add_stage(Stage('moralis_metadata',
+                              lambda: self.get_nft_metadata_from_moralis(),
+                              self.fullpath_nfts_data,
+                              dependencies=['transfers', 'resync']))
+        graph.add_stage(Stage('opensea_augment',
+                              self.__run_opensea_augment_stage,
+                              self.fullpath_nfts_including_manual_additions,
+                              dependencies=['moralis_metadata'],
+                              fullpaths_extra_inputs=[self.fullpath_additional_opensea_urls]))
+        graph.add_stage(Stage('refine',
+                              lambda: self.refine_nft_data(use_data_already_on_disk=True),
+                              self.fullpath_nfts_refined_data,
+                              dependencies=['opensea_augment']))
+        graph.add_stage(Stage('extras',
+                              lambda: self.get_extra_metadata_from_opensea(),
+                              self.fullpath_nfts_extra_data,
+                              dependencies=['refine'],
+                              params={'backend': self.opensea_properties_backend}))
+        graph.add_stage(Stage('combine',
+                              lambda: self.combine_data(use_data_already_on_disk=True),
+                              self.fullpath_combined_nft_data,
+                              dependencies=['refine', 'extras']))
+        graph.add_stage(Stage('reorganize',
+                              lambda: self.reorganize_the_data(self.list_ordered_columns, use_data_already_on_disk=True),
+                              self.fullpath_final,
+                              dependencies=['combine'],
+                              params={'columns': self.list_ordered_columns}))
+        return graph
+    # ------------------------ END FUNCTION ------------------------ #
 
-        logging.info("---------- AFFE DATA PREVIEW ----------")
-        # Below, if we are only going to display data on disk, we only need to pass one parameter
-        # to the function. However, in the case where use_data_already_on_disk is false (ie. we
-        # want to use data passed as a parameter) we need to add the other parameter as well.
-        kwargs = {'use_data_already_on_disk': use_data_already_on_disk}
-        if not use_data_already_on_disk:
-            kwargs['df_with_final_data'] = df_final
-        self.show_data_on_console(**kwargs)
+    def run_stages(self,
+                   list_stage_names: list = None,
+                   list_stages_to_invalidate: list = None,
+                   include_upstream: bool = True,
+                   request_moralis_metadata_resync: bool = False,
+                   full_backfill_of_transfers: bool = False) -> dict:
+        """
+        Run some stages (by name) of the graph built by build_stage_graph, skipping the ones that
+        are already up to date.
+        :param list_stage_names: The stages to bring up to date. If not provided, all of them are.
+        :param list_stages_to_invalidate: Stages that should run even if their inputs did not change.
+        :param include_upstream: Whether the stages the requested stages depend on are brought up
+          to date as well.
+        :return: A dict of stage name -> 'ran' or 'skipped'.
+        """
+        self.__start_run()
+        graph = self.build_stage_graph(request_moralis_metadata_resync=request_moralis_metadata_resync,
+                                       full_backfill_of_transfers=full_backfill_of_transfers)
+        if list_stages_to_invalidate:
+            graph.invalidate(list_stages_to_invalidate)
+        try:
+            return graph.run(targets=list_stage_names, include_upstream=include_upstream)
+        finally:
+            self.write_run_report()
+    # ------------------------ END FUNCTION ------------------------ #
 
-        logging.info("FOR THE FULL SET OF DATA see the affe.csv file saved to data/output directory.")
+    def write_run_report(self, extra: dict = None) -> dict:
+        """
+        Write what was measured during the current run (see RunInstrumentation) to run_report.json
+        in the data directory and, if a Prometheus textfile was configured, to that file as well.
+        :param extra: Anything else to add to the report (eg. the report of a streaming run.)
+        :return: The report.
+        """
+        dict_extra = {'contract_address': self.affe_contract_address,
+                      'response_cache': dict(self.response_cache.stats),
+                      'http_clients': {api_name: client.stats for api_name, client in self.http_clients.items()}}
+        if extra:
+            dict_extra.update(extra)
+        report = self.instrumentation.write_report(self.fullpath_run_report, extra=dict_extra)
+        if self.fullpath_prometheus_textfile:
+            self.instrumentation.write_prometheus_textfile(self.fullpath_prometheus_textfile, report=report)
+        return report
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __start_run(self):
+        """Start measuring a new run, so that the report only covers the stages of this run."""
+        self.instrumentation = RunInstrumentation(trace_python_allocations=self.trace_python_allocations)
+        self.table_storage.instrumentation = self.instrumentation
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __run_resync_stage(self, request_moralis_metadata_resync: bool):
+        report = {'requested': request_moralis_metadata_resync}
+        if request_moralis_metadata_resync:
+            df_transfers = self.table_storage.read(self.fullpath_eoa_nft_transfers, 'transfers', columns=['token_id'])
+            set_token_ids = set(df_transfers['token_id'])
+            report.update(self.request_moralis_to_resync_nft_metadata(set_token_ids))
+        with open(self.fullpath_resync_report, mode='w') as f:
+            json.dump(report, f, indent=2, default=str)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __run_opensea_augment_stage(self):
+        df_nfts = self.table_storage.read(self.fullpath_nfts_data, 'nfts')
+        df_augmented = self.augment_nft_list_using_opensea(df_nfts)
+        # When there are no manual additions, the stage output is simply the data from Moralis.
+        if df_augmented is None:
+            self.table_storage.write(df_nfts, self.fullpath_nfts_including_manual_additions, 'nfts')
     # ------------------------ END FUNCTION ------------------------ #
 
-    def get_eoa_nft_transfers_from_moralis(self, do_some_refining: bool = False) -> pd.DataFrame:
+    def get_eoa_nft_transfers_from_moralis(self,
+                                           do_some_refining: bool = False,
+                                           full_backfill: bool = False) -> pd.DataFrame:
         """
         This method gets all the NFT transfers that the creator of the Affe has performed
         in the Opensea Storefront contract.
+        The history of an address only ever grows, so after the first run, only the transfers
+        from the last block seen in the previous run onwards are requested; they are appended to
+        the history already on disk (and de-duplicated, as the last block is requested again.)
+        The complete history (on the first run, or when asked for) is written to disk one page at
+        a time, as the pages arrive, so memory is bounded by the size of a page rather than by the
+        length of the history.
         :param do_some_refining: Refine down to only where the address is the creator (as opposed
           to NFTs that have been SENT to the address, and only include NFT transfers in the Opensea
           Storefront contract where the Affe live.
+        :param full_backfill: Ignore the history on disk, and download the complete history of
+          the address again.
         :return: Pandas dataframe with the transfers. However, this information will also get saved
           to disk in the 'intermediate_files' directory.
         """
-        moralis = MoralisAPIinteractions()
-
         # the account for which we want to query nft transactions
         # In this case, we are querying the address that creates the Monkeyverse DAO NFTs
         eoa = "0x023a3905E3B33634758871712f4293Ddb919B67F"
 
-        # below get all the NFT transactions done by some address
-        df = moralis.get_nft_transfers(eoa, direction='both')
+        high_water_mark = None
+        if not full_backfill and exists(self.fullpath_eoa_nft_transfers):
+            high_water_mark = self.__load_transfers_high_water_mark(do_some_refining)
+
+        # The next page is downloaded while the current one is being refined (see
+        # MoralisHTTP.get_nft_transfers_pages_prefetching.) A page that fails with a 429 or a server
+        # error is requested again (with the same cursor), within our quota.
+        moralis = self.new_moralis_http()
+        rate_limiter = TokenBucket(self.moralis_requests_per_second)
+        # The high-water mark is taken before any refining, as it refers to what has been
+        # downloaded (not to what has been kept.)
+        dict_marks = {'new_high_water_mark': None}
+
+        def refined_pages(from_block: int = None):
+            for list_page in moralis.get_nft_transfers_pages_prefetching(eoa, direction='both', from_block=from_block,
+                                                                        rate_limiter=rate_limiter):
+                df_page = pd.DataFrame(list_page)
+                dict_marks['new_high_water_mark'] = self.__later_high_water_mark(
+                    dict_marks['new_high_water_mark'], self.__find_transfers_high_water_mark(df_page))
+                yield self.__refine_transfers(df_page) if do_some_refining else df_page
+
+        if high_water_mark is None:
+            logging.info("Downloading the complete transfer history.")
+            num_rows = self.table_storage.write_batches(refined_pages(), self.fullpath_eoa_nft_transfers, 'transfers')
+            logging.info(f"{num_rows} transfers written to the history.")
+            df = self.table_storage.read(self.fullpath_eoa_nft_transfers, 'transfers')
+        else:
+            logging.info(f"Downloading transfers from block {high_water_mark['block_number']} onwards.")
+            # Only the transfers since the previous run are downloaded, so they are few, and they are
+            # merged with the history on disk in memory.
+            list_dfs = list(refined_pages(from_block=high_water_mark['block_number']))
+            # The new rows are cast to the same schema the history on disk was written with, so that
+            # old and new rows can be compared when de-duplicating.
+            df = self.table_storage.apply_schema(pd.concat(list_dfs, ignore_index=True) if list_dfs
+                                                 else pd.DataFrame(), 'transfers')
+            df_history = self.table_storage.read(self.fullpath_eoa_nft_transfers, 'transfers')
+            if not df_history.empty:
+                num_rows_before = len(df_history)
+                # Newest transfers first (which is the order Moralis returns them in.)
+                df = pd.concat([df, self.table_storage.apply_schema(df_history, 'transfers')], ignore_index=True)
+                list_key_columns = [col for col in ['transaction_hash', 'log_index', 'token_address', 'token_id']
+                                    if col in df.columns]
+                df = df.drop_duplicates(subset=list_key_columns if list_key_columns else None, keep='first')
+                logging.info(f"{len(df) - num_rows_before} new transfers appended to the history.")
+            self.table_storage.write(df, self.fullpath_eoa_nft_transfers, 'transfers')
+        moralis.close()
+
+        new_high_water_mark = dict_marks['new_high_water_mark']
+        if new_high_water_mark is None:
+            new_high_water_mark = high_water_mark
+        if new_high_water_mark is not None:
+            new_high_water_mark['refined'] = do_some_refining
+            with open(self.fullpath_eoa_nft_transfers_high_water_mark, mode='w') as f:
+                json.dump(new_high_water_mark, f, indent=2)
+        return df
+    # ------------------------ END FUNCTION ------------------------ #
 
-        if do_some_refining:
-            # account of interest
-            # In this case, we are filtering the address that creates the Monkeyverse DAO NFTs
-            # this is, in fact, the same address as above, but the results in the df have lower-case
-            # address, so we are re-declaring the same addres, with different case, so the filtering
-            # works
-            eoa = "0x023a3905e3b33634758871712f4293ddb919b67f"
+    def update_ownership_ledger(self, iterable_with_token_ids=None) -> OwnershipLedger:
+        """
+        The transfers of the creator only show who got each Affe first, so to know who holds an Affe
+        (at any block), the transfers of every Affe are downloaded, whoever sent and received them,
+        and fed to the OwnershipLedger saved beside the other tables. After the first run, only the
+        transfers since the latest one of each token in the ledger are requested (that block is
+        requested again; the ledger skips the transfers it already has.)
+        :param iterable_with_token_ids: The IDs of the tokens to update. If not provided, the tokens
+          in the transfers of the creator (see get_eoa_nft_transfers_from_moralis) are.
+        :return: The updated ledger. It is also saved to disk in the 'intermediate_files' directory.
+        """
+        if iterable_with_token_ids is None:
+            df_transfers = self.table_storage.read(self.fullpath_eoa_nft_transfers, 'transfers',
+                                                   columns=['token_address', 'token_id'])
+            df_transfers = df_transfers[df_transfers['token_address'] == self.affe_contract_address]
+            iterable_with_token_ids = df_transfers['token_id']
+        list_token_ids = [str(token_id) for token_id in dict.fromkeys(iterable_with_token_ids)]
+        ledger = self.load_ownership_ledger()
+        dict_from_blocks = {token_id: ledger.last_block_of(token_id) for token_id in list_token_ids}
+
+        # Every token takes (at least) a request of its own, so several are kept in flight at once,
+        # within our quota. Each thread gets its own MoralisHTTP, all of them on the shared session.
+        rate_limiter = TokenBucket(self.moralis_requests_per_second)
+        thread_local = threading.local()
+
+        def fetch_transfers(token_id: str) -> pd.DataFrame:
+            moralis = getattr(thread_local, 'moralis', None)
+            if moralis is None:
+                moralis = thread_local.moralis = self.new_moralis_http()
+            list_transfers = []
+            for list_page in moralis.get_nft_token_transfers_pages(self.affe_contract_address, token_id,
+                                                                   from_block=dict_from_blocks[token_id],
+                                                                   rate_limiter=rate_limiter):
+                list_transfers.extend(list_page)
+            return pd.DataFrame(list_transfers)
+
+        num_new = 0
+        num_failed = 0
+        with ThreadPoolExecutor(max_workers=self.moralis_max_requests_in_flight) as executor:
+            futures = {executor.submit(fetch_transfers, token_id): token_id for token_id in list_token_ids}
+            for future in as_completed(futures):
+                try:
+                    df_token_transfers = future.result()
+                except Exception as e:
+                    # The ledger keeps what it had for the token, and the next run asks for its
+                    # transfers from the same block again.
+                    logging.warning(f"Failed to fetch the transfers of token -> '{futures[future]}': {e}")
+                    num_failed += 1
+                    continue
+                # The ledger is fed one token at a time, as the transfers arrive (only the timeline
+                # of that token is rebuilt.)
+                num_new += ledger.add_transfers(df_token_transfers)
+
+        logging.info(f"Ownership ledger: {num_new} new transfers of {len(list_token_ids)} tokens "
+                     f"({num_failed} tokens failed), up to block {ledger.last_block}.")
+        self.table_storage.write(ledger.transfers(), self.fullpath_ownership_ledger, 'ownership')
+        return ledger
+    # ------------------------ END FUNCTION ------------------------ #
 
-            # keep only the rows for a certain contract
-            df = df[df['token_address'] == self.affe_contract_address]
-            # keep only the rows where the eoa is the 'from' address of interest
-            df = df[df['from_address'] == eoa]
+    def load_ownership_ledger(self) -> OwnershipLedger:
+        """The OwnershipLedger saved by update_ownership_ledger (an empty one if there is none yet.)"""
+        if not exists(self.fullpath_ownership_ledger):
+            return OwnershipLedger(self.affe_contract_address)
+        return OwnershipLedger.from_transfers(self.table_storage.read(self.fullpath_ownership_ledger, 'ownership'),
+                                              self.affe_contract_address)
+    # ------------------------ END FUNCTION ------------------------ #
 
-        df.to_csv(self.fullpath_eoa_nft_transfers, index=False)
+    def __refine_transfers(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Keep only the transfers in the Affen contract that were sent by the creator of the Affe."""
+        if df.empty:
+            return df
+        # account of interest
+        # In this case, we are filtering the address that creates the Monkeyverse DAO NFTs
+        # this is, in fact, the same address as above, but the results in the df have lower-case
+        # address, so we are re-declaring the same addres, with different case, so the filtering
+        # works
+        eoa = "0x023a3905e3b33634758871712f4293ddb919b67f"
+
+        # keep only the rows for a certain contract
+        df = df[df['token_address'] == self.affe_contract_address]
+        # keep only the rows where the eoa is the 'from' address of interest
+        df = df[df['from_address'] == eoa]
         return df
     # ------------------------ END FUNCTION ------------------------ #
 
-    def request_moralis_to_resync_nft_metadata(self, iterable_with_token_ids):
-        moralis = MoralisAPIinteractions()
-        moralis.resync_many_nft_tokens_metadata(self.affe_contract_address,
-                                                iterable_with_token_ids,
-                                                log_api_response=True,
-                                                sleep_time_between_requests=1)
+    def __load_transfers_high_water_mark(self, do_some_refining: bool) -> dict:
+        """
+        Load the last block/transfer processed by a previous run. None is returned (meaning that a
+        full backfill is needed) if there is no mark, or if the history on disk was refined
+        differently than what is being asked for now.
+        """
+        if not exists(self.fullpath_eoa_nft_transfers_high_water_mark):
+            return None
+        with open(self.fullpath_eoa_nft_transfers_high_water_mark, mode='r') as f:
+            high_water_mark = json.load(f)
+        if high_water_mark.get('refined') != do_some_refining:
+            logging.info("The transfer history on disk was refined differently, so it will be downloaded again.")
+            return None
+        return high_water_mark
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __find_transfers_high_water_mark(df_transfers: pd.DataFrame) -> dict:
+        """
+        Find the most recent transfer in a dataframe of transfers.
+        :return: A dict with the 'block_number' and 'transfer_index' of that transfer, or None if
+          the dataframe has no transfers.
+        """
+        if df_transfers.empty or 'block_number' not in df_transfers.columns:
+            return None
+        block_numbers = pd.to_numeric(df_transfers['block_number'], errors='coerce')
+        if block_numbers.isna().all():
+            return None
+        position = block_numbers.reset_index(drop=True).idxmax()
+        high_water_mark = {'block_number': int(block_numbers.iloc[position])}
+        if 'transfer_index' in df_transfers.columns:
+            high_water_mark['transfer_index'] = str(df_transfers['transfer_index'].iloc[position])
+        return high_water_mark
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __later_high_water_mark(high_water_mark_a: dict, high_water_mark_b: dict) -> dict:
+        """The more recent of two high-water marks (either of which may be None.)"""
+        if high_water_mark_a is None:
+            return high_water_mark_b
+        if high_water_mark_b is None:
+            return high_water_mark_a
+        if high_water_mark_b['block_number'] > high_water_mark_a['block_number']:
+            return high_water_mark_b
+        return high_water_mark_a
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def request_moralis_to_resync_nft_metadata(self, iterable_with_token_ids) -> dict:
+        """
+        This method asks Moralis to resync the metadata of each token. Rather than waiting a fixed
+        amount of time between requests, the requests are sent in bursts as large as our quota
+        allows (the quota is read from the rate-limit headers that Moralis returns, starting from
+        the rate configured for this class), backing off whenever Moralis answers with a 429.
+        :param iterable_with_token_ids: The IDs of the tokens to resync.
+        :return: A report (dict) with how many resyncs were accepted, rejected and retried.
+        """
+        list_token_ids = list(iterable_with_token_ids)
+
+        # The outcome of every token is journaled as soon as it is known, so if a previous run died
+        # halfway through, the tokens it already got accepted are not sent again.
+        journal = TokenJournal(self.fullpath_resync_journal, params={'contract': self.affe_contract_address})
+        list_token_ids_to_send = [token_id for token_id in list_token_ids if journal.get(token_id) != 'accepted']
+        scheduler = MoralisResyncScheduler(moralis_http=self.new_moralis_http(),
+                                           requests_per_second=self.moralis_requests_per_second,
+                                           instrumentation=self.instrumentation)
+        scheduler_report = scheduler.resync_many_nft_tokens_metadata(self.affe_contract_address,
+                                                                     list_token_ids_to_send,
+                                                                     on_token_done=journal.record)
+        dict_outcomes = journal.records(list_token_ids)
+        list_accepted = [token_id for token_id in list_token_ids if dict_outcomes.get(str(token_id)) == 'accepted']
+        list_rejected = [token_id for token_id in list_token_ids if dict_outcomes.get(str(token_id)) == 'rejected']
+        report = {'accepted': len(list_accepted),
+                  'rejected': len(list_rejected),
+                  'retried': scheduler_report['retried'],
+                  'rejected_token_ids': list_rejected,
+                  'resumed_from_journal': len(list_token_ids) - len(list_token_ids_to_send)}
+
+        # The metadata of any token that Moralis agreed to resync may change, so whatever we have
+        # cached for it can no longer be trusted.
+        self.response_cache.invalidate('moralis_metadata', self.affe_contract_address, list_accepted)
+        self.response_cache.save()
+        journal.discard()
+        return report
     # ------------------------ END FUNCTION ------------------------ #
 
     def get_nft_metadata_from_moralis(self,
@@ -207,9 +685,17 @@ class AffeDataGetter:
         """
         df = df_with_nft_transfers
         if df_with_nft_transfers.empty:
-            df = pd.read_csv(self.fullpath_eoa_nft_transfers)
-
-        moralis = MoralisAPIinteractions()
+            df = self.table_storage.read(self.fullpath_eoa_nft_transfers, 'transfers',
+                                         columns=['token_address', 'token_id'])
+
+        from class_concurrent_metadata_fetcher import ConcurrentMetadataFetcher
+        # The metadata of each token is fetched with its own request, and almost all the time
+        # of this stage is spent waiting on the network, so several requests are kept in flight
+        # at once (throttled so that we stay within the limits of our Moralis plan.)
+        # Every thread gets its own MoralisHTTP, all of them on the shared (pooled) session.
+        moralis = ConcurrentMetadataFetcher(max_requests_in_flight=self.moralis_max_requests_in_flight,
+                                            requests_per_second=self.moralis_requests_per_second,
+                                            client_factory=self.new_moralis_http)
 
         # because the function that gets token metadata takes as an input a particular contract
         # address, we should filter the df (in case it was not done already upstream) to that
@@ -217,18 +703,120 @@ class AffeDataGetter:
         df = df[df['token_address'] == self.affe_contract_address]
 
         set_token_ids = set(df['token_id'])
-
-        list_of_metadata_fields_of_interest = ['name', 'description', 'image', 'external_link', 'animation_url']
-        df_tokens = moralis.get_many_nft_tokens_metadata(
+        list_of_metadata_fields_of_interest = self.metadata_fields_of_interest
+
+        # Every token is journaled as soon as it has been fetched, so if a previous run died halfway
+        # through this stage, the tokens it already fetched are taken from the journal.
+        journal = TokenJournal(self.fullpath_nfts_data_journal,
+                               params={'contract': self.affe_contract_address,
+                                       'fields': list_of_metadata_fields_of_interest})
+
+        # Tokens that were fetched in a previous run are served from the response cache, as long as
+        # their sync markers are still the ones Moralis reports now; only the rest are requested from
+        # Moralis (along with those an interrupted run fetched before they changed.)
+        dict_live_markers = self.get_live_sync_markers(set_token_ids)
+        list_cached_rows = []
+        list_token_ids_not_cached = []
+        set_token_ids_to_fetch = set()
+        for token_id in set_token_ids:
+            cached_rows = self.get_cached_moralis_metadata(token_id, dict_live_markers)
+            if cached_rows is None:
+                list_token_ids_not_cached.append(token_id)
+                if self.get_journaled_moralis_metadata(token_id, journal, dict_live_markers) is None:
+                    set_token_ids_to_fetch.add(token_id)
+            else:
+                list_cached_rows.extend(cached_rows)
+        logging.info(f"{len(set_token_ids) - len(list_token_ids_not_cached)} tokens served from the response cache, "
+                     f"{len(list_token_ids_not_cached) - len(set_token_ids_to_fetch)} from the journal of an "
+                     f"interrupted run, {len(set_token_ids_to_fetch)} to fetch from Moralis.")
+
+        moralis.get_many_nft_tokens_metadata(
             self.affe_contract_address,
-            set_token_ids,
-            list_of_metadata_fields_to_extract=list_of_metadata_fields_of_interest)
-
-        df_tokens.to_csv(self.fullpath_nfts_data, index=False)
+            set_token_ids_to_fetch,
+            list_of_metadata_fields_to_extract=list_of_metadata_fields_of_interest,
+            on_token_done=lambda token_id, df_token: journal.record(token_id, df_token.to_dict('records')))
+
+        # The rows of the tokens that were not in the cache are assembled from the journal (whether
+        # they were fetched by this run or by the one that was interrupted.) Rows journaled before the
+        # token changed are left out (their token could not be fetched again in this run.)
+        list_fetched_rows = []
+        for token_id in list_token_ids_not_cached:
+            list_rows = self.get_journaled_moralis_metadata(token_id, journal, dict_live_markers)
+            if list_rows:
+                self.response_cache.put('moralis_metadata', self.affe_contract_address, token_id, list_rows,
+                                        markers=ResponseCache.sync_markers_from_record(list_rows[0]))
+                list_fetched_rows.extend(list_rows)
+        self.response_cache.save()
+
+        df_tokens = pd.concat([pd.DataFrame(list_cached_rows), pd.DataFrame(list_fetched_rows)], ignore_index=True)
+        self.table_storage.write(df_tokens, self.fullpath_nfts_data, 'nfts')
+        journal.discard()
         return df_tokens
 
     # ------------------------ END FUNCTION ------------------------ #
 
+    def get_live_sync_markers(self, iterable_with_token_ids) -> dict:
+        """
+        Moralis reports the sync markers of a token ('token_hash' and 'last_metadata_sync') in the
+        listing of its contract, a page of 100 tokens per request, so the markers that every token
+        has right now are learnt from it before anything is served from the response cache (see
+        MoralisHTTP.get_nft_sync_markers.) The contract of the Affen is shared with many other
+        collections, so at most moralis_max_marker_pages pages are read.
+        :param iterable_with_token_ids: The IDs of the tokens whose markers are wanted.
+        :return: A dict of token_id (as a str) -> markers (see ResponseCache.sync_markers_from_record),
+          with the tokens whose markers were found. If the listing cannot be read, the dict is empty.
+        """
+        set_token_ids = set(iterable_with_token_ids)
+        if not set_token_ids or not self.response_cache.enabled:
+            # Without a cache there is nothing to check the markers against.
+            return {}
+        moralis = self.new_moralis_http()
+        try:
+            dict_markers = moralis.get_nft_sync_markers(self.affe_contract_address, set_token_ids,
+                                                        max_pages=self.moralis_max_marker_pages,
+                                                        rate_limiter=TokenBucket(self.moralis_requests_per_second))
+        except requests.RequestException as e:
+            logging.warning(f"Could not read the sync markers from Moralis, no metadata will be served "
+                            f"from the response cache: {e}")
+            return {}
+        finally:
+            moralis.close()
+        logging.info(f"Current sync markers found for {len(dict_markers)} of {len(set_token_ids)} tokens.")
+        return {token_id: ResponseCache.sync_markers_from_record(record) for token_id, record in dict_markers.items()}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_cached_moralis_metadata(self, token_id, dict_live_markers: dict):
+        """
+        :param token_id: The id of the token.
+        :param dict_live_markers: The current sync markers of the tokens (see get_live_sync_markers.)
+        :return: The Moralis metadata rows cached for the token, or None if there are none, or if it
+          is not known whether the token changed since they were cached (no current markers for it.)
+        """
+        markers = dict_live_markers.get(str(token_id))
+        if markers is None:
+            return None
+        return self.response_cache.get('moralis_metadata', self.affe_contract_address, token_id,
+                                       current_markers=markers)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def get_journaled_moralis_metadata(token_id, journal: TokenJournal, dict_live_markers: dict):
+        """
+        :param token_id: The id of the token.
+        :param journal: The journal of the Moralis metadata stage (see get_nft_metadata_from_moralis.)
+        :param dict_live_markers: The current sync markers of the tokens (see get_live_sync_markers.)
+        :return: The Moralis metadata rows that an interrupted run journaled for the token, or None if
+          there are none, or if Moralis has seen the token change since.
+        """
+        list_rows = journal.get(token_id)
+        if list_rows is None:
+            return None
+        markers = dict_live_markers.get(str(token_id))
+        if list_rows and markers is not None and ResponseCache.sync_markers_from_record(list_rows[0]) != markers:
+            return None
+        return list_rows
+    # ------------------------ END FUNCTION ------------------------ #
+
     def augment_nft_list_using_opensea(self,
                                        df_with_nft_data: pd.DataFrame) -> pd.DataFrame:
         """
@@ -257,55 +845,82 @@ class AffeDataGetter:
             # So, if a file exists, at a pre-defined location on disk, with additional OpenSea
             # URLs, we'll add them to set of IDs that OpenSea will be scraped for.
             if exists(self.fullpath_additional_opensea_urls):
-                df_os_urls = pd.read_csv(self.fullpath_additional_opensea_urls)
-
-                # below we apply a function (which extracts the ID from the end of a URL)
-                # to every URL (every 'row') in the column of the dataframe, AND we
-                # cast the resulting items to a set.
-                set_additional_ids = set(df_os_urls['opensea_url'].apply(get_last_segment_of_url))
-
-                set_existing_ids = set(df_with_nft_data['token_id'])
-
-                # now we remove from the set of additional IDs any IDs that may have already
-                # been 'discovered' by upstream functions. This might happen if the list stored
-                # on disk of OpenSea URLs has the ID of an ape that had previously not been
-                # transferred, but it was recently sold (thereby maybe the list on disk has not
-                # been updated yet, but an on-chain transaction now exists, so prior methods
-                # would have started to 'see' the NFT.)
-                set_ids = set_additional_ids - set_existing_ids
-
-                opensea = OpenseaAPIinteractions()
-
-                list_tokens = opensea.get_many_nft_tokens_metadata(self.affe_contract_address,
-                                                                   set_ids,
-                                                                   return_as='list')
-                # We now should have a list which contains dictionaries, where each dict represents
-                # data about one specific nft/token. Now we'll manipulate the data so it is fairly
-                # similar (in format) to the data gathered so far from Moralis, and then merge
-                # the data.
-                list_to_append = []
-                for item in list_tokens:
-
-                    if 'name' not in item:
-                        logging.warning("name missing...")
-
-                    dict_to_add = {}
-                    token_id = item.pop('token_id')
-                    dict_to_add['token_address'] = self.affe_contract_address
-                    dict_to_add['token_id'] = token_id
-                    dict_to_add['name'] = item['name']
-                    dict_to_add['metadata'] = str(item)
-                    dict_to_add['description'] = item['description']
-                    dict_to_add['image'] = item['image']
-                    dict_to_add['external_link'] = item['external_link']
-                    list_to_append.append(dict_to_add)
+                list_to_append = self.get_manual_opensea_additions(set(df_with_nft_data['token_id']))
 
                 df_to_append = pd.DataFrame(list_to_append)
                 df_tokens = pd.concat([df_with_nft_data, df_to_append])
-                df_tokens.to_csv(self.fullpath_nfts_including_manual_additions, index=False)
+                self.table_storage.write(df_tokens, self.fullpath_nfts_including_manual_additions, 'nfts')
                 return df_tokens
     # ------------------------ END FUNCTION ------------------------ #
 
+    def get_manual_opensea_additions(self, set_existing_ids: set) -> list:
+        """
+        Get the metadata (from OpenSea's tokenURI) of the Affen in the manually maintained list of
+        OpenSea URLs (see augment_nft_list_using_opensea), in the same format as the rows that
+        Moralis returns.
+        :param set_existing_ids: The ids of the tokens that are already known (these are skipped.)
+        :return: A list with a dict per token.
+        """
+        if not exists(self.fullpath_additional_opensea_urls):
+            return []
+        df_os_urls = pd.read_csv(self.fullpath_additional_opensea_urls)
+
+        # below we apply a function (which extracts the ID from the end of a URL)
+        # to every URL (every 'row') in the column of the dataframe, AND we
+        # cast the resulting items to a set.
+        set_additional_ids = set(df_os_urls['opensea_url'].apply(get_last_segment_of_url))
+
+        # now we remove from the set of additional IDs any IDs that may have already
+        # been 'discovered' by upstream functions. This might happen if the list stored
+        # on disk of OpenSea URLs has the ID of an ape that had previously not been
+        # transferred, but it was recently sold (thereby maybe the list on disk has not
+        # been updated yet, but an on-chain transaction now exists, so prior methods
+        # would have started to 'see' the NFT.)
+        set_ids = set_additional_ids - set_existing_ids
+
+        # Tokens whose OpenSea metadata was fetched in a previous run are served from the
+        # response cache.
+        list_tokens = []
+        set_ids_to_fetch = set()
+        for token_id in set_ids:
+            cached_item = self.response_cache.get('opensea_metadata', self.affe_contract_address, token_id)
+            if cached_item is None:
+                set_ids_to_fetch.add(token_id)
+            else:
+                list_tokens.append(cached_item)
+
+        opensea = self.new_opensea_http()
+        list_fetched = opensea.get_many_nft_tokens_metadata(self.affe_contract_address, set_ids_to_fetch)
+        for item in list_fetched:
+            if 'token_id' in item:
+                self.response_cache.put('opensea_metadata', self.affe_contract_address,
+                                        item['token_id'], item)
+        self.response_cache.save()
+        list_tokens.extend(list_fetched)
+        # We now should have a list which contains dictionaries, where each dict represents
+        # data about one specific nft/token. Now we'll manipulate the data so it is fairly
+        # similar (in format) to the data gathered so far from Moralis, and then merge
+        # the data.
+        list_to_append = []
+        for item in list_tokens:
+
+            if 'name' not in item:
+                logging.warning("name missing...")
+
+            dict_to_add = {}
+            token_id = item.pop('token_id')
+            dict_to_add['token_address'] = self.affe_contract_address
+            dict_to_add['token_id'] = token_id
+            dict_to_add['name'] = item.get('name')
+            dict_to_add['metadata'] = str(item)
+            dict_to_add['description'] = item.get('description')
+            dict_to_add['image'] = item.get('image')
+            dict_to_add['external_link'] = item.get('external_link')
+            list_to_append.append(dict_to_add)
+
+        return list_to_append
+    # ------------------------ END FUNCTION ------------------------ #
+
     def refine_nft_data(self,
                         use_data_already_on_disk: bool = False,
                         df_with_nft_data: pd.DataFrame = pd.DataFrame) -> pd.DataFrame:
@@ -326,7 +941,7 @@ class AffeDataGetter:
         if not use_data_already_on_disk:  # we check for this case first as it is the default and more common
             df = df_with_nft_data
         else:
-            df = pd.read_csv(self.fullpath_nfts_including_manual_additions)
+            df = self.table_storage.read(self.fullpath_nfts_including_manual_additions, 'nfts')
 
         if not df.empty:
             # the line below can be used to keep only rows that are NOT nan (ie. get rid of the rows
@@ -352,17 +967,33 @@ class AffeDataGetter:
 
             df_refined = pd.concat([df_substring1, df_substring2, df_nans])
 
-        df_refined.to_csv(self.fullpath_nfts_refined_data, index=False)
+        self.table_storage.write(df_refined, self.fullpath_nfts_refined_data, 'nfts')
         return df_refined
     # ------------------------ END FUNCTION ------------------------ #
 
+    @staticmethod
+    def is_affe_record(record: dict) -> bool:
+        """
+        The rule of refine_nft_data, for a single token (eg. a row that Moralis returned, as a dict):
+        the token is kept if its name says it is an Affe, or if it has no metadata (as many of the
+        tokens without metadata are Affen too.)
+        """
+        if pd.isna(record.get('metadata')):
+            return True
+        name = record.get('name')
+        if not isinstance(name, str):
+            return False
+        return name.lower().startswith("affe mit") or name.startswith("Affe #")
+    # ------------------------ END FUNCTION ------------------------ #
+
     def get_extra_metadata_from_opensea(self,
                                         df_with_refined_nft_data: pd.DataFrame = pd.DataFrame) -> pd.DataFrame:
         """
         This method receives a dataframe that has info in it about NFTs, but up to this point
         that data only has the metadata that Opensea stores in the URI location. However, Opensea
         seems to store additional properties about the NFTs offchain AND somewhere that is not at
-        the token URI. This method attempts to grab that additional data using Selenium.
+        the token URI. This method attempts to grab that additional data, either using Selenium or
+        by parsing the raw item pages (see opensea_properties_backend in __init__.)
         :param df_with_refined_nft_data: The information about NFTs can be passed
           directly to this method in this parameter. If this parameter is not provided, this
           method will attempt to laod the information from a default location on disk containing
@@ -371,7 +1002,8 @@ class AffeDataGetter:
         """
         df = df_with_refined_nft_data
         if df_with_refined_nft_data.empty:
-            df = pd.read_csv(self.fullpath_nfts_refined_data)
+            df = self.table_storage.read(self.fullpath_nfts_refined_data, 'nfts',
+                                         columns=['token_address', 'token_id', *ResponseCache.sync_marker_fields])
 
         # because the function that gets token metadata takes as an input a particular contract
         # address, we should filter the df (in case it was not done already upstream) to that
@@ -379,56 +1011,113 @@ class AffeDataGetter:
         df = df[df['token_address'] == self.affe_contract_address]
         set_token_ids = set(df['token_id'])
 
-        opensea = SeleniumOnOpensea(self.affe_contract_address)
-        opensea.start_driver()
-        df_extra_data = opensea.get_many_nfts_properties(set_token_ids)
-        opensea.close_driver()
-
-        df_extra_data.to_csv(self.fullpath_nfts_extra_data, index=False)
+        # The scraped properties of a token are cached together with the sync markers that Moralis
+        # reported for that token, so a token is only scraped again once Moralis sees it change. The
+        # markers come from the metadata stage, which only keeps cached rows whose markers are current.
+        # The markers are keyed by the token id as a str, the same way the journal keys its tokens.
+        dict_markers = {}
+        for record in df.to_dict('records'):
+            dict_markers[str(record['token_id'])] = ResponseCache.sync_markers_from_record(record)
+        list_cached_rows = []
+        list_token_ids_not_cached = []
+        for token_id in set_token_ids:
+            cached_row = self.response_cache.get('opensea_properties', self.affe_contract_address, token_id,
+                                                 current_markers=dict_markers[str(token_id)])
+            if cached_row is None:
+                list_token_ids_not_cached.append(token_id)
+            else:
+                list_cached_rows.append(cached_row)
+
+        # Every token is journaled (with its sync markers) as soon as it has been scraped. Tokens that
+        # an interrupted run already scraped are not scraped again, unless Moralis has seen them
+        # change since.
+        journal = TokenJournal(self.fullpath_nfts_extra_data_journal,
+                               params={'contract': self.affe_contract_address,
+                                       'backend': self.opensea_properties_backend})
+        set_token_ids_to_fetch = {token_id for token_id in list_token_ids_not_cached
+                                  if journal.get(token_id, {}).get('markers') != dict_markers[str(token_id)]}
+        logging.info(f"{len(set_token_ids) - len(list_token_ids_not_cached)} tokens served from the response cache, "
+                     f"{len(list_token_ids_not_cached) - len(set_token_ids_to_fetch)} from the journal of an "
+                     f"interrupted run, {len(set_token_ids_to_fetch)} to scrape.")
+
+        if self.opensea_properties_backend == 'html':
+            # The properties are already in the JSON embedded in the item page, so a plain
+            # HTTP download (no browser) is enough to get them.
+            opensea = self.new_opensea_html_extractor()
+        else:
+            # Scraping one page per token is slow, so the tokens are split into shards and each shard
+            # is scraped by its own browser.
+            from class_selenium_worker_pool import SeleniumWorkerPool
+            opensea = SeleniumWorkerPool(self.affe_contract_address, num_workers=self.opensea_num_browsers,
+                                         instrumentation=self.instrumentation)
+        if set_token_ids_to_fetch:
+            opensea.get_many_nfts_properties(
+                set_token_ids_to_fetch,
+                on_token_done=lambda token_id, list_rows: journal.record(
+                    token_id, {'markers': dict_markers[str(token_id)], 'rows': list_rows}))
+
+        list_fetched_rows = []
+        for token_id, journaled in journal.records(list_token_ids_not_cached).items():
+            if journaled['markers'] != dict_markers[token_id]:
+                # The scrape of a token that changed since it was journaled failed in this run.
+                continue
+            for record in journaled['rows']:
+                # Only the properties this token actually has are cached (not the NaNs that come from
+                # other tokens having more properties.)
+                row = {key: value for key, value in record.items() if value == value}
+                # Stored under the token id of the journal (the scraper may give it with another type.)
+                self.response_cache.put('opensea_properties', self.affe_contract_address, token_id, row,
+                                        markers=dict_markers[token_id])
+                list_fetched_rows.append(row)
+        self.response_cache.save()
+
+        df_extra_data = pd.concat([pd.DataFrame(list_cached_rows), pd.DataFrame(list_fetched_rows)],
+                                  ignore_index=True)
+        self.table_storage.write(df_extra_data, self.fullpath_nfts_extra_data, 'extras')
+        journal.discard()
         return df_extra_data
     # ------------------------ END FUNCTION ------------------------ #
 
     def combine_data(self,
                      use_data_already_on_disk: bool = False,
-                     list_of_dataframes_with_data_to_combine: list[pd.DataFrame] = []) -> pd.DataFrame:
+                     list_of_dataframes_with_data_to_combine: list[pd.DataFrame] = [],
+                     list_of_priorities: list[int] = None) -> pd.DataFrame:
         """
         This method combines several dataframes that contain relevant data about the NFTs. The
         dataframes are assumed to all contain a column called 'token_id' that can be used for
-        the merge.
+        the merge. All the dataframes are joined in a single pass (see KeyedJoin), and they are
+        not modified.
         :param use_data_already_on_disk: Tells the method whether to use data already on disk
           or whether to use data being passed as the next parameter. If use_data_already_on_disk
           is set to True, the next parameter will be ignored even if it contains data.
         :param list_of_dataframes_with_data_to_combine: A list containing the dataframes with NFT data.
+        :param list_of_priorities: The priority of each dataframe (same order as the list above.)
+          Where several dataframes have a column with the same name, the values are coalesced into
+          a single column, taking the value from the dataframe with the highest priority that has
+          one. If not provided, dataframes earlier in the list win.
         :return: A pandas dataframe with the combined information of all the dataframes that were
           joined based on 'token_id'.
         """
-        df_refined = pd.DataFrame
-        df_extras = pd.DataFrame
-        df_combined = pd.DataFrame
+        df_combined = pd.DataFrame()
 
         if use_data_already_on_disk:
             # If method was asked to get data from disk, this method will attempt to grab data from
             # the refined NFT data and the extra opensea data on disk.
-            df_refined = pd.read_csv(self.fullpath_nfts_refined_data)
-            df_extras = pd.read_csv(self.fullpath_nfts_extra_data)
+            df_refined = self.table_storage.read(self.fullpath_nfts_refined_data, 'nfts')
+            df_extras = self.table_storage.read(self.fullpath_nfts_extra_data, 'extras')
             list_of_dataframes_with_data_to_combine = [df_extras, df_refined]
+            list_of_priorities = None
 
         if list_of_dataframes_with_data_to_combine:
-            counter = 0
-            df_combined = list_of_dataframes_with_data_to_combine[counter]
-            df_combined.set_index('token_id', inplace=True)
-            num_dfs_to_combine_with = len(list_of_dataframes_with_data_to_combine) - 1
-            while counter < num_dfs_to_combine_with:
-                counter += 1
-                df_to_combine_with = list_of_dataframes_with_data_to_combine[counter]
-                df_to_combine_with.set_index('token_id', inplace=True)
-                df_combined = df_combined.merge(df_to_combine_with, how='outer', left_index=True, right_index=True)
-
-            df_combined.reset_index(inplace=True)
-
-        df_combined.to_csv(self.fullpath_combined_nft_data, index=False)
+            if list_of_priorities is None:
+                list_of_priorities = [0] * len(list_of_dataframes_with_data_to_combine)
+            joiner = KeyedJoin(key='token_id')
+            for df, priority in zip(list_of_dataframes_with_data_to_combine, list_of_priorities):
+                joiner.add_source(df, priority=priority)
+            df_combined = joiner.join()
+
+        self.table_storage.write(df_combined, self.fullpath_combined_nft_data, 'combined')
         return df_combined
-
     # ------------------------ END FUNCTION ------------------------ #
 
     def reorganize_the_data(self,
@@ -451,7 +1140,7 @@ class AffeDataGetter:
         if not use_data_already_on_disk:
             df = df_with_combined_data
         else:
-            df = pd.read_csv(self.fullpath_combined_nft_data)
+            df = self.table_storage.read(self.fullpath_combined_nft_data, 'combined')
 
         if not df.empty:
             counter = 0
@@ -471,7 +1160,9 @@ class AffeDataGetter:
                     logging.warning(f"While re-ordering columns, expected to find a column named '{col_name}', but "
                                     f"it was not present in the data.")
 
-        df.to_csv(self.fullpath_final, index=False)
+        # The final table is always exported to CSV as well (affe.csv), as that is the file that
+        # people (and other scripts) look for in the output directory.
+        self.table_storage.write(df, self.fullpath_final, 'final', export_csv=True)
         return df
 
     # ------------------------ END FUNCTION ------------------------ #
@@ -494,7 +1185,7 @@ class AffeDataGetter:
         if not use_data_already_on_disk:
             df = df_with_final_data
         else:
-            df = pd.read_csv(self.fullpath_final)
+            df = self.table_storage.read(self.fullpath_final, 'final')
 
         if not df.empty:
             pd.set_option("display.max_columns", None)
@@ -513,6 +1204,6 @@ class AffeDataGetter:
         """
         df = pd.DataFrame
         if exists(self.fullpath_final):
-            df = pd.read_csv(self.fullpath_final)
+            df = self.table_storage.read(self.fullpath_final, 'final')
         return df
     # ------------------------ END FUNCTION ------------------------ #
@@ -2,8 +2,10 @@ import logging
 from os import mkdir
 from os.path import exists
 import pandas as pd
-import json
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from class_affe import Affe
+from class_change_aware_writer import ChangeAwareWriter
 from pathlib import Path
 from math import isnan
 from typing import Union
@@ -29,6 +31,12 @@ class AffeDataManipulator:
                                             'token_uri', 'metadata', 'last_token_uri_sync', 'last_metadata_sync',
                                             'image', 'external_link', 'animation_url', 'transfer_index']
 
+    # For each style of json: the directory (within 'output') its files are written to, and the
+    # name of the file with the whole collection.
+    json_styles = {'normal': ('normal_json', '00_all_affen.json'),
+                   'nft-style': ('opensea_style_json', '00_all_affen_nft_style.json'),
+                   'flat': ('flat_json', '00_all_affen_flat.json')}
+
     def __init__(self, affen_data: pd.DataFrame, full_path_to_data_dir: Path):
         """
         Initialize the AffeDataManipulator class.
@@ -37,6 +45,8 @@ class AffeDataManipulator:
             the 1155 Opensea Storefront contract.
         """
         self.df_affen = affen_data
+        # How each column is turned into a field of an Affe object is worked out only once.
+        self.column_plan = self.__build_column_plan()
 
         # Some methods in this class will store files on disk in a directory called 'output',
         # so we'll check to see if it exists, and if not it will be created.
@@ -48,78 +58,153 @@ class AffeDataManipulator:
     def dump_all_to_json(self, normal_json: bool = True,
                          opensea_style_json: bool = True,
                          flat_json: bool = True,
-                         pretty: bool = True):
+                         pretty: bool = True,
+                         num_writer_threads: int = 8):
         """
         Method to dump to disk Affen data in json format.
+        Each row is converted into an Affe object only once, and every requested style is derived
+        from that one object. The files are handed to a pool of writer threads, so the conversion
+        of the next rows does not wait on the disk.
         :param normal_json: Each Affe object, in a json representation very similar to how each Affe
           object is abstracted in the Affe class.
         :param opensea_style_json: Json formatted in a typical NFT format, in particular following
           the metadata standards of Opensea.
-        :return:
+        :param flat_json: Json where each Affe is a flat set of key/value pairs.
+        :param pretty: Whether the json should be indented or not
+        :param num_writer_threads: The number of threads writing files to disk.
+        :return: For each style, a report (dict) of how many files were added, changed, unchanged
+          and removed (see ChangeAwareWriter.) Files whose content did not change are not touched.
         """
-        list_with_all_affen_normal = []
-        list_with_all_affen_opensea_style = []
-        list_with_all_affen_flat = []
-        fullpath_dir_normal_json = Path
-        fullpath_dir_opensea_json = Path
         kwargs = ({'indent': 2} if pretty else {})
 
-        if normal_json:
-            fullpath_dir_normal_json = self.fullpath_dir_output / 'normal_json'
-            if not exists(fullpath_dir_normal_json):
-                mkdir(fullpath_dir_normal_json)
-            for row in self.df_affen.itertuples():
-                affe = self.__convert_df_row_to_affe_object(row)
-                # In the line below, the method dumps the json to disk, but also returns the dictionary
-                # that was used to generate the json, which we then append to the running tally of Affen
-                the_ape_as_dict = affe.dump_to_json(fullpath_dir_normal_json, 'normal', pretty)
-                list_with_all_affen_normal.append(the_ape_as_dict)
-            # Dump the whole list to a single file as well
-            full_path_to_collection_file = fullpath_dir_normal_json / '00_all_affen.json'
-            with open(full_path_to_collection_file, mode='w') as f:
-                json.dump(list_with_all_affen_normal, f, **kwargs)
+        # For each requested style: the directory it goes to, the name of the file with the whole
+        # collection, and the running tally of Affen (as dictionaries) for that file.
+        list_style_names = [style_name for style_name, wanted in [('normal', normal_json),
+                                                                  ('nft-style', opensea_style_json),
+                                                                  ('flat', flat_json)] if wanted]
+        dict_styles = self.make_json_style_writers(list_style_names)
 
-        if opensea_style_json:
-            fullpath_dir_opensea_json = self.fullpath_dir_output / 'opensea_style_json'
-            if not exists(fullpath_dir_opensea_json):
-                mkdir(fullpath_dir_opensea_json)
+        with ThreadPoolExecutor(max_workers=max(1, num_writer_threads)) as writer:
+            list_futures = []
             for row in self.df_affen.itertuples():
                 affe = self.__convert_df_row_to_affe_object(row)
-                # The line below changes some of the metadata from the way it exists in
-                # the OpenSea 1155 Storefront contract into the way we want it to be in
-                # the 721 contract.
-                affe.perform_721_hygene()
-                affe.initialize_new_traits()
+                dict_affe_by_style = self.affe_as_dict_by_style(affe, list_style_names)
 
-                # In the line below, the method dumps the json to disk, but also returns the dictionary
-                # that was used to generate the json, which we then append to the running tally of Affen
-                the_ape_as_dict = affe.dump_to_json(fullpath_dir_opensea_json, 'nft-style', pretty)
-                list_with_all_affen_opensea_style.append(the_ape_as_dict)
-            # Dump the whole list to a single file as well
-            full_path_to_collection_file = fullpath_dir_opensea_json / '00_all_affen_nft_style.json'
-            with open(full_path_to_collection_file, mode='w') as f:
-                json.dump(list_with_all_affen_opensea_style, f, **kwargs)
+                for style_name, the_ape_as_dict in dict_affe_by_style.items():
+                    style = dict_styles[style_name]
+                    style['list_all_affen'].append(the_ape_as_dict)
+                    list_futures.append(writer.submit(style['writer'].write_json,
+                                                      str(affe.id) + '.json',
+                                                      the_ape_as_dict, **kwargs))
 
-        if flat_json:
-            fullpath_dir_flat_json = self.fullpath_dir_output / 'flat_json'
-            if not exists(fullpath_dir_flat_json):
-                mkdir(fullpath_dir_flat_json)
-            for row in self.df_affen.itertuples():
-                affe = self.__convert_df_row_to_affe_object(row)
-                # The line below changes some of the metadata from the way it exists in
-                # the OpenSea 1155 Storefront contract into the way we want it to be in
-                # the 721 contract.
-                affe.perform_721_hygene()
-                affe.initialize_new_traits()
+            # Dump the whole list of each style to a single file as well
+            for style in dict_styles.values():
+                list_futures.append(writer.submit(style['writer'].write_json,
+                                                  style['collection_file'],
+                                                  style['list_all_affen'], **kwargs))
+            # result() re-raises any error that happened while writing a file.
+            for future in list_futures:
+                future.result()
+
+        return {style_name: style['writer'].finish() for style_name, style in dict_styles.items()}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def make_json_style_writers(self, list_style_names: list) -> dict:
+        """
+        Get the output directory of each style of json ready.
+        :param list_style_names: Styles from json_styles.
+        :return: A dict of style name -> dict with the 'dir' of the style, the name of its
+          'collection_file', a 'writer' (a ChangeAwareWriter, so only files whose content changed
+          since the previous export are rewritten) and an empty 'list_all_affen'.
+        """
+        dict_styles = {}
+        for style_name in list_style_names:
+            dir_name, collection_file = self.json_styles[style_name]
+            style = {'dir': self.fullpath_dir_output / dir_name,
+                     'collection_file': collection_file,
+                     'list_all_affen': []}
+            if not exists(style['dir']):
+                mkdir(style['dir'])
+            style['writer'] = ChangeAwareWriter(style['dir'])
+            dict_styles[style_name] = style
+        return dict_styles
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def affe_as_dict_by_style(affe: Affe, list_style_names: list) -> dict:
+        """
+        Represent an Affe as a dictionary in each of the styles of json. The Affe object is modified
+        along the way (see Affe.perform_721_hygene), so it should not be used afterwards.
+        :param list_style_names: Styles from json_styles.
+        :return: A dict of style name -> the Affe as a dictionary in that style.
+        """
+        dict_affe_by_style = {}
+        if 'normal' in list_style_names:
+            # The 'normal' style is taken before the changes below are made to the object,
+            # and it shares some dictionaries with the object, so it is copied.
+            dict_affe_by_style['normal'] = deepcopy(affe.make_dict())
+        if ('nft-style' in list_style_names) or ('flat' in list_style_names):
+            # The line below changes some of the metadata from the way it exists in
+            # the OpenSea 1155 Storefront contract into the way we want it to be in
+            # the 721 contract.
+            affe.perform_721_hygene()
+            affe.initialize_new_traits()
+            if 'nft-style' in list_style_names:
+                dict_affe_by_style['nft-style'] = affe.make_dict_nft_style()
+            if 'flat' in list_style_names:
+                dict_affe_by_style['flat'] = affe.make_dict_flat()
+        return dict_affe_by_style
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def make_affe_objects(self) -> list[Affe]:
+        """
+        Convert every row of the data into an Affe object (as it exists in the 1155 Storefront
+        contract, ie. without the changes made for the 721 contract.)
+        :return: A list with an Affe object per row.
+        """
+        return [self.__convert_df_row_to_affe_object(row) for row in self.df_affen.itertuples()]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __build_column_plan(self) -> dict:
+        """
+        Work out, once per dataframe, what to do with each of its columns when converting a row into
+        an Affe object: the position of the column in a rowtuple, and which kind of field it is
+        (scalar field, common attribute, emotion, rare textual or rare numerical attribute, or a
+        column to ignore.) Converting a row is then a matter of walking through this plan, rather
+        than looking every column up by name, for every row.
+        :return: A dict with the positions of the scalar fields, and lists of (column, position)
+          or (column, position, kind) for each kind of attribute.
+        """
+        plan = {'scalars': {}, 'common': [], 'emotions': [], 'rare': []}
+        for field in ['name', 'CHIMP', 'description', 'image', 'external_link', 'animation_url', 'token_id']:
+            plan['scalars'][field] = self.__rowtuple_loc(field)
+        for field in self.fields_all_affen_common_attributes:
+            if field in self.df_affen.columns:
+                plan['common'].append((field, self.__rowtuple_loc(field)))
+        for field in self.fields_all_affen_emotions:
+            if field in self.df_affen.columns:
+                plan['emotions'].append((field, self.__rowtuple_loc(field)))
 
-                # In the line below, the method dumps the json to disk, but also returns the dictionary
-                # that was used to generate the json, which we then append to the running tally of Affen
-                the_ape_as_dict = affe.dump_to_json(fullpath_dir_flat_json, 'flat', pretty)
-                list_with_all_affen_flat.append(the_ape_as_dict)
-            # Dump the whole list to a single file as well
-            full_path_to_collection_file = fullpath_dir_flat_json / '00_all_affen_flat.json'
-            with open(full_path_to_collection_file, mode='w') as f:
-                json.dump(list_with_all_affen_flat, f, **kwargs)
+        set_fields_to_ignore = set(self.fields_to_ignore_as_affen_attributes)
+        for col in self.df_affen.columns:
+            # We'll only add miscellaneous attributes to the ape, if the column is not in a list
+            # that help to filter non-attribute column names, and if the column name does not
+            # contain 'unnamed' (as some previous pandas operations may result in some 'unnamed'
+            # columns.)
+            if (col in set_fields_to_ignore) or ('unnamed' in col.lower()):
+                continue
+            # A column whose values are all 'X of Y' strings is a rare numerical attribute, and
+            # one without any such value is a rare textual attribute. Anything else (which should
+            # not happen, but the data is scraped) is decided value by value.
+            list_has_of = [' of ' in value for value in self.df_affen[col] if type(value) is str]
+            if list_has_of and all(list_has_of):
+                kind = 'rare_numerical'
+            elif not any(list_has_of):
+                kind = 'rare_textual'
+            else:
+                kind = 'rare_mixed'
+            plan['rare'].append((col, self.__rowtuple_loc(col), kind))
+        return plan
     # ------------------------ END FUNCTION ------------------------ #
 
     def __convert_df_row_to_affe_object(self, df_rowtuple):
@@ -130,24 +215,22 @@ class AffeDataManipulator:
         :return: an Affe object
         """
         affe_data = df_rowtuple
-        strict_name = affe_data[self.__rowtuple_loc('name')]
+        dict_scalars = self.column_plan['scalars']
+        strict_name = affe_data[dict_scalars['name']]
         id = self.__extract_affe_number_from_strict_name(strict_name)
 
         affe = Affe(id)
         affe.set_name_strict(strict_name)
-        # There is a lot going on in each line below, so lets break it down.
-        # The __rowtuple_loc method returns the column number in which to look for the relevant value
-        # That integer is then passed as the index for the 'affe_data' list (although I don't think the
-        # object is striclty a list, it is still accessed by integer-index)
-        # Then, in order to avoid having NaN in any of the results, the value that is extracted from 'affe_data'
-        # is checked for NaN (and if it is Nan it is converted to an empty string instead
-        # by the __check_for_nan method.)
-        affe.set_name_friendly(self.__check_for_nan(affe_data[self.__rowtuple_loc('CHIMP')]))
-        affe.set_story(self.__check_for_nan(affe_data[self.__rowtuple_loc('description')]))
-        affe.set_image(self.__check_for_nan(affe_data[self.__rowtuple_loc('image')]))
-        affe.set_website(self.__check_for_nan(affe_data[self.__rowtuple_loc('external_link')]))
-        affe.set_animation(self.__check_for_nan(affe_data[self.__rowtuple_loc('animation_url')]))
-        affe.set_legacyid(self.__check_for_nan(affe_data[self.__rowtuple_loc('token_id')]))
+        # The positions of the scalar fields in the rowtuple were worked out once, in the column
+        # plan. In order to avoid having NaN in any of the results, each value that is extracted
+        # from 'affe_data' is checked for NaN (and if it is Nan it is converted to an empty string
+        # instead by the __check_for_nan method.)
+        affe.set_name_friendly(self.__check_for_nan(affe_data[dict_scalars['CHIMP']]))
+        affe.set_story(self.__check_for_nan(affe_data[dict_scalars['description']]))
+        affe.set_image(self.__check_for_nan(affe_data[dict_scalars['image']]))
+        affe.set_website(self.__check_for_nan(affe_data[dict_scalars['external_link']]))
+        affe.set_animation(self.__check_for_nan(affe_data[dict_scalars['animation_url']]))
+        affe.set_legacyid(self.__check_for_nan(affe_data[dict_scalars['token_id']]))
 
         self.__add_common_attributes_to_affe_obj(affe, affe_data)
         self.__add_common_emotions_to_affe_obj(affe, affe_data)
@@ -163,8 +246,8 @@ class AffeDataManipulator:
           itertuples, and represents a row with data about an ape.
         :return: nothing is returned, because the Affe object should be modified in-place
         """
-        for field in self.fields_all_affen_common_attributes:
-            value = df_rowtuple[self.__rowtuple_loc(field)]
+        for field, position in self.column_plan['common']:
+            value = df_rowtuple[position]
             # We only add an attribute if it has a value. If it's returned as 'empty
             # string' we don't add anything.
             if value:
@@ -178,8 +261,8 @@ class AffeDataManipulator:
           itertuples, and represents a row with data about an ape.
         :return: nothing is returned, because the Affe object should be modified in-place
         """
-        for field in self.fields_all_affen_emotions:
-            value = df_rowtuple[self.__rowtuple_loc(field)]
+        for field, position in self.column_plan['emotions']:
+            value = df_rowtuple[position]
             # We only add an attribute if it has a value. If it's returned as 'empty
             # string' we don't add anything.
             if value:
@@ -201,33 +284,28 @@ class AffeDataManipulator:
           itertuples, and represents a row with data about an ape.
         :return: nothing is returned, because the Affe object should be modified in-place
         """
-        columns = list(self.df_affen.columns)
-        for col in columns:
-            # We'll only add miscellaneous attributes to the ape, if the column is not in a list
-            # that help to filter non-attribute column names, and if the column name does not
-            # contain 'unnamed' (as some previous pandas operations may result in some 'unnamed'
-            # columns.)
-            if (col not in self.fields_to_ignore_as_affen_attributes) and ('unnamed' not in col.lower()):
-                value = df_rowtuple[self.__rowtuple_loc(col)]
-                if value:
-                    if type(value) is float:
-                        if isnan(value):
-                            continue
-                        else:
-                            logging.debug(f"Encountered a non-nan float value for "
-                                            f"Affe -> {the_affe.name_strict}")
-                    elif type(value) is str:
-                        # Because many of the attributes were scraped form Opensea website (rather than a
-                        # formal API, if they are numeric, they likely come as a string in the format of
-                        # 'X of Y' - so here, we are looking for that format.
-                        if ' of ' in value:
-                            num = int(value.split(sep=' of ')[0])
-                            the_affe.add_rare_numerical_attributes(col, num)
-                        else:
-                            the_affe.add_rare_textual_attributes(col, value)
+        for col, position, kind in self.column_plan['rare']:
+            value = df_rowtuple[position]
+            if value:
+                if type(value) is float:
+                    if isnan(value):
+                        continue
                     else:
-                        logging.debug(f"Encountered a value that is neither string nor float for "
+                        logging.debug(f"Encountered a non-nan float value for "
                                         f"Affe -> {the_affe.name_strict}")
+                elif type(value) is str:
+                    # Because many of the attributes were scraped form Opensea website (rather than a
+                    # formal API, if they are numeric, they likely come as a string in the format of
+                    # 'X of Y' - so here, we are looking for that format (unless the column plan
+                    # already knows which of the two the column holds.)
+                    if kind == 'rare_numerical' or (kind == 'rare_mixed' and ' of ' in value):
+                        num = int(value.split(sep=' of ')[0])
+                        the_affe.add_rare_numerical_attributes(col, num)
+                    else:
+                        the_affe.add_rare_textual_attributes(col, value)
+                else:
+                    logging.debug(f"Encountered a value that is neither string nor float for "
+                                    f"Affe -> {the_affe.name_strict}")
     # ------------------------ END FUNCTION ------------------------ #
 
     def __extract_affe_number_from_strict_name(self, strict_name: str) -> int:
@@ -0,0 +1,321 @@
+import logging
+import re
+import numpy as np
+import pandas as pd
+from class_affe_rarity import AffeRarity
+
+
+class AffeIndex:
+    """This class answers questions such as 'which apes have a HAT, a Joy of at least 4, and are in
+    the museum' without scanning the Affen table. When it is built, it makes inverted indexes from
+    every (trait, value) and every owner to the apes that have them, and keeps the numeric traits
+    sorted, so that a lookup only costs as much as the number of apes it returns.
+
+    Apes are referred to internally by their row in the table, and every set of apes is a sorted
+    numpy array of rows, so that sets can be combined with intersect/union/difference."""
+
+    # Owners that can be referred to by a name in queries (eg. 'owner = museum'.)
+    default_owner_aliases = {'museum': '0x11f515b85d46ba8aba99cc7a7b385fe9986fe964'}
+
+    # Values such as '3 of 5' (see AffeDataManipulator) or plain numbers are numeric.
+    regex_numeric_value = re.compile(r'^\s*(-?\d+(?:\.\d+)?)(?:\s+of\s+\d+)?\s*$')
+
+    # The tokens of the query language: parentheses, comparison operators, quoted strings and words.
+    regex_query_token = re.compile(r'\s*(?:(\(|\))|(>=|<=|!=|=|>|<|≥|≤|≠)|"([^"]*)"|([^\s()=<>!≥≤≠"]+))')
+    query_keywords = {'AND', 'OR', 'NOT', 'PRESENT'}
+    dict_operator_aliases = {'≥': '>=', '≤': '<=', '≠': '!='}
+
+    def __init__(self, df_affen: pd.DataFrame, list_trait_columns: list = None, owner_aliases: dict = None,
+                 key: str = 'token_id', owner_column: str = 'owner_of'):
+        """
+        Initialize the AffeIndex class.
+        :param df_affen: The final Affen table (eg. the content of output/affe.csv.)
+        :param list_trait_columns: The columns to index as traits. By default, the same traits
+          that the rarity scores are computed from (see AffeRarity.)
+        :param owner_aliases: Names that can be used instead of an address in owner queries. By
+          default, 'museum' is the address of the museum.
+        :param key: The column that identifies each ape.
+        :param owner_column: The column with the address of the owner of each ape.
+        """
+        if list_trait_columns is None:
+            list_trait_columns = AffeRarity.default_trait_columns(df_affen)
+        self.list_trait_columns = list_trait_columns
+        self.owner_aliases = {name.lower(): address.lower() for name, address
+                              in (self.default_owner_aliases if owner_aliases is None else owner_aliases).items()}
+        self.token_ids = df_affen[key].astype(str).to_numpy(dtype=object)
+        self.all_rows = np.arange(len(df_affen), dtype=np.int64)
+
+        # (trait, value) -> rows, and trait -> rows of apes that have the trait at all.
+        self.dict_value_postings = {}
+        self.dict_presence_postings = {}
+        # trait -> (values sorted ascending, the rows they belong to), for the numeric traits.
+        self.dict_sorted_numeric = {}
+        for col in list_trait_columns:
+            self.__index_trait(col, df_affen[col] if col in df_affen.columns else pd.Series(dtype=object))
+
+        self.dict_owner_postings = {}
+        if owner_column in df_affen.columns:
+            self.dict_owner_postings = self.__postings(df_affen[owner_column].str.lower())
+        logging.debug(f"Indexed {len(self.all_rows)} apes: {len(self.dict_value_postings)} trait values, "
+                      f"{len(self.dict_sorted_numeric)} numeric traits, {len(self.dict_owner_postings)} owners.")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    # ------------------------------------------------------------------------------------------ #
+    # Sets of apes. Each of these returns a sorted array of rows, which can be combined with
+    # all_of, any_of and none_of, and turned into token ids with token_ids_of.
+    # ------------------------------------------------------------------------------------------ #
+
+    def with_trait(self, trait: str, value=None) -> np.ndarray:
+        """
+        The apes that have a trait.
+        :param value: If given, only the apes whose value of the trait is exactly this. For numeric
+          traits, the value is compared as a number (so 4 matches '4 of 5'.)
+        """
+        if value is None:
+            return self.dict_presence_postings.get(trait, self.__empty())
+        if trait in self.dict_sorted_numeric:
+            number = self.__as_number(value)
+            if number is not None:
+                return self.in_range(trait, minimum=number, maximum=number)
+        return self.dict_value_postings.get((trait, str(value)), self.__empty())
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def in_range(self, trait: str, minimum: float = None, maximum: float = None,
+                 include_minimum: bool = True, include_maximum: bool = True) -> np.ndarray:
+        """
+        The apes whose value of a numeric trait (eg. an emotion) is within a range. Both ends are
+        optional, and included unless stated otherwise.
+        """
+        if trait not in self.dict_sorted_numeric:
+            if trait in self.dict_presence_postings:
+                raise ValueError(f"Trait '{trait}' is not numeric, so it cannot be compared with a range.")
+            return self.__empty()
+        values, rows = self.dict_sorted_numeric[trait]
+        start = 0 if minimum is None else np.searchsorted(values, minimum, side='left' if include_minimum else 'right')
+        stop = len(values) if maximum is None else np.searchsorted(values, maximum,
+                                                                   side='right' if include_maximum else 'left')
+        return np.sort(rows[start:stop])
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def owned_by(self, owner: str) -> np.ndarray:
+        """The apes owned by an address (or by one of the names in owner_aliases.)"""
+        owner = owner.lower()
+        return self.dict_owner_postings.get(self.owner_aliases.get(owner, owner), self.__empty())
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def all_of(*sets_of_rows: np.ndarray) -> np.ndarray:
+        """The apes that are in every one of the sets (AND.)"""
+        # Starting with the smallest set keeps every intersection as cheap as possible.
+        list_sets = sorted(sets_of_rows, key=len)
+        result = list_sets[0]
+        for rows in list_sets[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def any_of(*sets_of_rows: np.ndarray) -> np.ndarray:
+        """The apes that are in at least one of the sets (OR.)"""
+        return np.unique(np.concatenate(sets_of_rows)) if sets_of_rows else np.empty(0, dtype=np.int64)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def none_of(self, *sets_of_rows: np.ndarray, within: np.ndarray = None) -> np.ndarray:
+        """
+        The apes that are in none of the sets (NOT.)
+        :param within: If given, only the apes in this set are considered; otherwise all apes are.
+          Passing it is much cheaper than intersecting the result afterwards.
+        """
+        within = self.all_rows if within is None else within
+        return np.setdiff1d(within, self.any_of(*sets_of_rows), assume_unique=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def token_ids_of(self, rows: np.ndarray) -> list:
+        """The token ids of a set of apes."""
+        return self.token_ids[rows].tolist()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    # ------------------------------------------------------------------------------------------ #
+    # Text queries.
+    # ------------------------------------------------------------------------------------------ #
+
+    def query(self, text: str) -> list:
+        """
+        Find apes with a query such as: HAT PRESENT AND Joy >= 4 AND owner = museum
+        The query is made of conditions, combined with AND, OR, NOT and parentheses (AND binds
+        tighter than OR.) A condition is one of:
+          - <trait> PRESENT
+          - <trait> = <value>   or   <trait> != <value>
+          - <trait> >= <number> (or >, <=, <; also written as ≥ and ≤) for numeric traits
+          - owner = <address or alias>
+        Trait names and values with spaces or special characters are written in double quotes
+        (eg. "SPECIAL ABILITY" = "Laser Eyes"); unquoted names made of several words also work.
+        :return: The token ids of the apes that match, in the order of the table.
+        """
+        list_tokens = self.__tokenize(text)
+        rows, position = self.__parse_or(list_tokens, 0)
+        if position != len(list_tokens):
+            raise ValueError(f"Unexpected '{list_tokens[position][1]}' in query: {text}")
+        return self.token_ids_of(rows)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __tokenize(self, text: str) -> list:
+        """Split a query into a list of (kind, text) tuples, kind being paren, op, quoted or word."""
+        list_tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = self.regex_query_token.match(text, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Could not understand the query from '{text[position:]}': {text}")
+            paren, op, quoted, word = match.groups()
+            if paren is not None:
+                list_tokens.append(('paren', paren))
+            elif op is not None:
+                list_tokens.append(('op', self.dict_operator_aliases.get(op, op)))
+            elif quoted is not None:
+                list_tokens.append(('quoted', quoted))
+            else:
+                list_tokens.append(('word', word))
+            position = match.end()
+        return list_tokens
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __is_keyword(self, list_tokens: list, position: int, keyword: str = None) -> bool:
+        if position >= len(list_tokens) or list_tokens[position][0] != 'word':
+            return False
+        text = list_tokens[position][1]
+        return text == keyword if keyword else text in self.query_keywords
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __parse_or(self, list_tokens: list, position: int):
+        list_sets = []
+        rows, position = self.__parse_and(list_tokens, position)
+        list_sets.append(rows)
+        while self.__is_keyword(list_tokens, position, 'OR'):
+            rows, position = self.__parse_and(list_tokens, position + 1)
+            list_sets.append(rows)
+        return (list_sets[0] if len(list_sets) == 1 else self.any_of(*list_sets)), position
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __parse_and(self, list_tokens: list, position: int):
+        # The negated terms of an AND are subtracted from the intersection of the rest, rather than
+        # turned into the (large) set of every other ape first.
+        list_positive = []
+        list_negative = []
+        while True:
+            rows, negated, position = self.__parse_not(list_tokens, position)
+            (list_negative if negated else list_positive).append(rows)
+            if not self.__is_keyword(list_tokens, position, 'AND'):
+                break
+            position += 1
+        if not list_negative:
+            return self.all_of(*list_positive), position
+        within = self.all_of(*list_positive) if list_positive else None
+        return self.none_of(*list_negative, within=within), position
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __parse_not(self, list_tokens: list, position: int):
+        if self.__is_keyword(list_tokens, position, 'NOT'):
+            rows, negated, position = self.__parse_not(list_tokens, position + 1)
+            return rows, not negated, position
+        if position < len(list_tokens) and list_tokens[position] == ('paren', '('):
+            rows, position = self.__parse_or(list_tokens, position + 1)
+            if position >= len(list_tokens) or list_tokens[position] != ('paren', ')'):
+                raise ValueError("A '(' in the query is not closed.")
+            return rows, False, position + 1
+        return self.__parse_condition(list_tokens, position)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __parse_condition(self, list_tokens: list, position: int):
+        """Parse one condition. Returns the rows it matches, whether they are negated, and the new position."""
+        # The name is every word (or quoted string) up to the operator or PRESENT.
+        list_name_parts = []
+        while position < len(list_tokens) and list_tokens[position][0] in ('word', 'quoted') \
+                and not self.__is_keyword(list_tokens, position):
+            list_name_parts.append(list_tokens[position][1])
+            position += 1
+        if not list_name_parts:
+            found = list_tokens[position][1] if position < len(list_tokens) else 'the end of the query'
+            raise ValueError(f"Expected a trait name in the query, found {found}.")
+        name = ' '.join(list_name_parts)
+
+        if self.__is_keyword(list_tokens, position, 'PRESENT'):
+            return self.with_trait(self.__known_trait(name)), False, position + 1
+        if position >= len(list_tokens) or list_tokens[position][0] != 'op':
+            raise ValueError(f"Expected PRESENT or an operator after '{name}' in the query.")
+        op = list_tokens[position][1]
+        if position + 1 >= len(list_tokens) or list_tokens[position + 1][0] not in ('word', 'quoted'):
+            raise ValueError(f"Expected a value after '{name} {op}' in the query.")
+        value = list_tokens[position + 1][1]
+        position += 2
+
+        if name.lower() == 'owner':
+            if op not in ('=', '!='):
+                raise ValueError(f"Owners can only be compared with = and !=, not '{op}'.")
+            return self.owned_by(value), op == '!=', position
+
+        trait = self.__known_trait(name)
+        if op == '=':
+            return self.with_trait(trait, value), False, position
+        if op == '!=':
+            return self.none_of(self.with_trait(trait, value), within=self.with_trait(trait)), False, position
+        number = self.__as_number(value)
+        if number is None:
+            raise ValueError(f"'{value}' is not a number, so '{name} {op}' cannot be applied to it.")
+        if op in ('>=', '>'):
+            return self.in_range(trait, minimum=number, include_minimum=(op == '>=')), False, position
+        return self.in_range(trait, maximum=number, include_maximum=(op == '<=')), False, position
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __known_trait(self, name: str) -> str:
+        if name not in self.dict_presence_postings:
+            raise ValueError(f"There is no trait called '{name}'. Known traits are: "
+                             f"{', '.join(self.dict_presence_postings)}")
+        return name
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __index_trait(self, col: str, column: pd.Series):
+        present = column.notna().to_numpy()
+        rows = self.all_rows[present]
+        values = column[present].astype(str)
+        self.dict_presence_postings[col] = rows
+        for value, value_rows in self.__postings(values, rows).items():
+            self.dict_value_postings[(col, value)] = value_rows
+
+        # The trait is numeric if every value it has is a number (or 'X of Y'.)
+        numbers = pd.to_numeric(values.str.extract(self.regex_numeric_value, expand=False), errors='coerce')
+        if len(numbers) and numbers.notna().all():
+            numbers = numbers.to_numpy(dtype=np.float64)
+            order = np.argsort(numbers, kind='stable')
+            self.dict_sorted_numeric[col] = (numbers[order], rows[order])
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __postings(self, values: pd.Series, rows: np.ndarray = None) -> dict:
+        """
+        Group rows by value.
+        :return: A dict of value -> sorted array of the rows that have it. Missing values are left out.
+        """
+        if rows is None:
+            present = values.notna().to_numpy()
+            rows = self.all_rows[present]
+            values = values[present]
+        codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+        # A stable sort by value keeps the rows of each value in ascending order.
+        order = np.argsort(codes, kind='stable')
+        splits = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+        return dict(zip(uniques, np.split(rows[order], splits)))
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def __as_number(cls, value):
+        match = cls.regex_numeric_value.match(str(value))
+        return float(match.group(1)) if match else None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __empty() -> np.ndarray:
+        return np.empty(0, dtype=np.int64)
+    # ------------------------ END FUNCTION ------------------------ #
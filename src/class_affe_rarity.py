@@ -0,0 +1,179 @@
+import logging
+import numpy as np
+import pandas as pd
+from class_affe_data_manipulator import AffeDataManipulator
+
+
+class AffeRarity:
+    """This class works out how rare each trait value is across the collection, and scores and
+    ranks every ape by rarity. All of it is done with vectorized counts over the final Affen table
+    (eg. output/affe.csv), and the counts can be updated when only a few tokens change."""
+
+    # The value that stands in for 'this ape does not have this trait'. Not having a trait that
+    # most apes have is rare in itself, so it is counted like any other value.
+    value_for_missing_trait = '<none>'
+
+    # The formulas used to score apes, and whether a higher score means a rarer ape (ranks always
+    # go the same way regardless: rank 1 is the rarest ape.) 'Frequency' below is the fraction of
+    # apes that share the ape's value of a trait.
+    #  - rarity_score: the sum, over all traits, of 1 / frequency.
+    #  - statistical: the product of the frequencies, ie. the odds of an ape with exactly the
+    #    same traits coming out by chance.
+    #  - average: the average of the frequencies.
+    #  - information_content: the sum of -log2(frequency), divided by the entropy of the whole
+    #    collection (the OpenRarity way of doing it.)
+    formulas = {'rarity_score': True, 'statistical': False, 'average': False, 'information_content': True}
+
+    def __init__(self, df_affen: pd.DataFrame, list_trait_columns: list = None, key: str = 'token_id'):
+        """
+        Initialize the AffeRarity class.
+        :param df_affen: The final Affen table, with one row per ape.
+        :param list_trait_columns: The columns to treat as traits. If not provided, they are the
+          common attributes other than the name, the emotions, and every column that the
+          AffeDataManipulator would turn into a rare attribute.
+        :param key: The column that identifies each ape.
+        """
+        self.key = key
+        if list_trait_columns is None:
+            list_trait_columns = self.default_trait_columns(df_affen)
+        self.list_trait_columns = list_trait_columns
+        self.df_values = self.__normalize(df_affen, list_trait_columns)
+        # One series of value -> number of apes with that value, per trait.
+        self.dict_counts = {col: self.df_values[col].value_counts() for col in list_trait_columns}
+        # The same counts, looked up for every ape (one row per ape, one column per trait.) The
+        # scores are computed from this matrix, so it is kept up to date by update().
+        self.df_ape_counts = pd.DataFrame({col: self.__ape_counts(col) for col in list_trait_columns},
+                                          index=self.df_values.index)
+        self.df_scores = None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def default_trait_columns(df_affen: pd.DataFrame) -> list:
+        """The columns of the final Affen table that hold traits (see __init__.)"""
+        set_not_traits = set(AffeDataManipulator.fields_to_ignore_as_affen_attributes)
+        list_columns = []
+        for col in df_affen.columns:
+            if col in AffeDataManipulator.fields_all_affen_emotions or col == 'AK47':
+                list_columns.append(col)
+            elif (col not in set_not_traits) and ('unnamed' not in col.lower()):
+                list_columns.append(col)
+        return list_columns
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def trait_frequencies(self) -> pd.DataFrame:
+        """
+        How many apes have each value of each trait.
+        :return: A dataframe with the columns trait_type, value, count and frequency, sorted from the
+          rarest value to the most common one.
+        """
+        num_apes = len(self.df_values)
+        list_frames = [pd.DataFrame({'trait_type': col, 'value': counts.index, 'count': counts.to_numpy()})
+                       for col, counts in self.dict_counts.items()]
+        if not list_frames:
+            return pd.DataFrame(columns=['trait_type', 'value', 'count', 'frequency'])
+        df_frequencies = pd.concat(list_frames, ignore_index=True)
+        df_frequencies['frequency'] = df_frequencies['count'] / num_apes
+        return df_frequencies.sort_values(['count', 'trait_type', 'value'], kind='stable', ignore_index=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def scores(self) -> pd.DataFrame:
+        """
+        The rarity score and rank of every ape, under every formula (see the formulas attribute.)
+        :return: A dataframe with the key column, then one score column and one 'rank_<formula>'
+          column per formula. Rank 1 is the rarest ape; apes with the same score share a rank.
+        """
+        if self.df_scores is None:
+            self.df_scores = self.__compute_scores()
+        return self.df_scores.copy()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def update(self, df_changed_affen: pd.DataFrame):
+        """
+        Update the counts and scores for some apes that changed (or are new), without recounting the
+        whole collection. Only the traits whose counts changed are looked up again.
+        :param df_changed_affen: Rows of the final Affen table, for the apes that changed. Apes that
+          are already known are replaced; the rest are added.
+        """
+        if df_changed_affen.empty:
+            return
+        df_new = self.__normalize(df_changed_affen, self.list_trait_columns)
+        df_new = df_new[~df_new.index.duplicated(keep='last')]
+        index_known = df_new.index.intersection(self.df_values.index)
+        index_added = df_new.index.difference(self.df_values.index, sort=False)
+
+        # Which traits changed for which apes, compared in one go over the whole block of values.
+        df_old = self.df_values.loc[index_known]
+        df_new_known = df_new.loc[index_known]
+        differs = df_old.to_numpy() != df_new_known.to_numpy()
+        if index_added.empty:
+            list_changed_columns = [col for col, changed in zip(self.list_trait_columns, differs.any(axis=0)) if changed]
+        else:
+            list_changed_columns = list(self.list_trait_columns)
+        for col in list_changed_columns:
+            rows = differs[:, self.list_trait_columns.index(col)]
+            counts = self.dict_counts[col].sub(df_old[col][rows].value_counts(), fill_value=0)
+            counts = counts.add(df_new_known[col][rows].value_counts(), fill_value=0)
+            if not index_added.empty:
+                counts = counts.add(df_new.loc[index_added, col].value_counts(), fill_value=0)
+            self.dict_counts[col] = counts[counts > 0].astype('int64')
+
+        if not list_changed_columns:
+            logging.debug("Rarity update: nothing changed.")
+            return
+        positions = self.df_values.index.get_indexer(index_known)
+        for col in list_changed_columns:
+            values = self.df_values[col].to_numpy(copy=True)
+            values[positions] = df_new_known[col].to_numpy()
+            self.df_values[col] = values
+        if not index_added.empty:
+            self.df_values = pd.concat([self.df_values, df_new.loc[index_added]])
+            self.df_ape_counts = self.df_ape_counts.reindex(self.df_values.index)
+        for col in list_changed_columns:
+            self.df_ape_counts[col] = self.__ape_counts(col)
+        self.df_scores = None
+        logging.debug(f"Rarity update: {len(index_known)} apes replaced, {len(index_added)} added, "
+                      f"{len(list_changed_columns)} traits recounted.")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __normalize(self, df_affen: pd.DataFrame, list_trait_columns: list) -> pd.DataFrame:
+        """
+        The trait columns of some apes, indexed by the key, with every value as a string (so that eg.
+        the 2 read from one file and the '2' read from another count as the same value) and missing
+        values replaced by value_for_missing_trait.
+        """
+        keys = df_affen[self.key].astype(str)
+        df_values = df_affen.reindex(columns=list_trait_columns)
+        df_values.index = pd.Index(keys, name=self.key)
+        return df_values.astype(object).fillna(self.value_for_missing_trait).astype(str)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __ape_counts(self, col: str) -> pd.Series:
+        """For every ape, how many apes have the same value of a trait as it does."""
+        return self.df_values[col].map(self.dict_counts[col]).astype('int64')
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __compute_scores(self) -> pd.DataFrame:
+        num_apes = len(self.df_values)
+        df_scores = pd.DataFrame({self.key: self.df_values.index})
+        frequencies = self.df_ape_counts.to_numpy(dtype=np.float64) / max(num_apes, 1)
+        num_traits = frequencies.shape[1]
+        if num_traits == 0:
+            frequencies = np.ones((num_apes, 1))
+        log2_frequencies = np.log2(frequencies)
+
+        # The entropy of the collection is the expected information content of an ape, ie. the sum
+        # over all traits of -sum(p * log2(p)) over the values of the trait.
+        entropy = 0.0
+        for counts in self.dict_counts.values():
+            p = counts.to_numpy(dtype=np.float64) / num_apes
+            entropy -= float((p * np.log2(p)).sum())
+
+        df_scores['rarity_score'] = (1.0 / frequencies).sum(axis=1)
+        df_scores['statistical'] = np.exp2(log2_frequencies.sum(axis=1))
+        df_scores['average'] = frequencies.mean(axis=1)
+        df_scores['information_content'] = -log2_frequencies.sum(axis=1) / entropy if entropy > 0 else 0.0
+        for formula, higher_is_rarer in self.formulas.items():
+            df_scores[f"rank_{formula}"] = df_scores[formula].rank(method='min', ascending=not higher_is_rarer)\
+                .astype('int64')
+        return df_scores
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from os.path import exists, getsize
+from pathlib import Path
+
+
+class ChangeAwareWriter:
+    """This class writes files into an output directory, but only touches the files whose content
+    actually changed. It keeps a manifest with a hash of every file it wrote, so unchanged files keep
+    their modification time (and downstream jobs such as rsync or IPFS pinning leave them alone.)
+    Files are written to a temporary file first and then renamed, so a reader never sees a half
+    written file."""
+
+    manifest_file_name = '.manifest.json'
+
+    def __init__(self, full_path_to_output_directory: Path):
+        """
+        Initialize the ChangeAwareWriter class.
+        :param full_path_to_output_directory: The directory the files are written to. It should
+          already exist.
+        """
+        self.fullpath_dir = full_path_to_output_directory
+        self.fullpath_manifest = full_path_to_output_directory / self.manifest_file_name
+        self.dict_manifest = {}
+        if exists(self.fullpath_manifest):
+            try:
+                with open(self.fullpath_manifest, mode='r') as f:
+                    self.dict_manifest = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Could not read the manifest in '{self.fullpath_dir}', every file will be rewritten: {e}")
+        self.dict_new_manifest = {}
+        self.report = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+        self._lock = threading.Lock()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def write(self, file_name: str, content: bytes) -> str:
+        """
+        Write a file, unless a file with exactly the same content is already there.
+        :param file_name: The name of the file, within the output directory.
+        :param content: The bytes to write.
+        :return: 'added', 'changed' or 'unchanged'.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        fullpath_file = self.fullpath_dir / file_name
+        with self._lock:
+            previous = self.dict_manifest.get(file_name)
+            self.dict_new_manifest[file_name] = {'sha256': digest, 'size': len(content)}
+
+        if previous is not None and previous['sha256'] == digest \
+                and exists(fullpath_file) and getsize(fullpath_file) == len(content):
+            outcome = 'unchanged'
+        else:
+            outcome = 'changed' if exists(fullpath_file) else 'added'
+            self.__write_atomically(fullpath_file, content)
+        with self._lock:
+            self.report[outcome] += 1
+        return outcome
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def write_json(self, file_name: str, data, **kwargs) -> str:
+        """Serialize some data as json (kwargs are passed to json.dumps) and write it with write()."""
+        return self.write(file_name, json.dumps(data, **kwargs).encode('utf-8'))
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def finish(self, remove_stale_files: bool = True) -> dict:
+        """
+        Call once every file of the run has been written. Files that were written by a previous run
+        but not by this one are removed, and the manifest is saved.
+        :param remove_stale_files: Set to False to keep (but stop tracking) files that were not
+          written in this run.
+        :return: A report (dict) with the number of files added, changed, unchanged and removed.
+        """
+        with self._lock:
+            list_stale = [name for name in self.dict_manifest if name not in self.dict_new_manifest]
+            for file_name in list_stale:
+                if remove_stale_files:
+                    (self.fullpath_dir / file_name).unlink(missing_ok=True)
+                    self.report['removed'] += 1
+            self.dict_manifest = self.dict_new_manifest
+            self.dict_new_manifest = {}
+            manifest_serialized = json.dumps(self.dict_manifest, indent=2, sort_keys=True)
+            report = dict(self.report)
+        self.__write_atomically(self.fullpath_manifest, manifest_serialized.encode('utf-8'))
+        logging.info(f"Output written to '{self.fullpath_dir}' -> {report}")
+        return report
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __write_atomically(fullpath_file: Path, content: bytes):
+        fullpath_tmp = fullpath_file.with_name(f".{fullpath_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(fullpath_tmp, mode='wb') as f:
+                f.write(content)
+            os.replace(fullpath_tmp, fullpath_file)
+        except OSError:
+            # The file that was there (if any) is left as it was, and so is the directory.
+            fullpath_tmp.unlink(missing_ok=True)
+            raise
+    # ------------------------ END FUNCTION ------------------------ #
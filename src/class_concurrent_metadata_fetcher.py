@@ -0,0 +1,102 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from class_moralis_http import MoralisHTTP
+from class_token_bucket import TokenBucket
+
+
+class ConcurrentMetadataFetcher:
+    """This class fetches NFT metadata from Moralis with several requests in flight at once,
+    while keeping the overall request rate within the limits of our Moralis plan."""
+
+    def __init__(self,
+                 max_requests_in_flight: int = 8,
+                 requests_per_second: float = 5.0,
+                 client_factory=None,
+                 instrumentation=None):
+        """
+        Initialize the ConcurrentMetadataFetcher class.
+        :param max_requests_in_flight: The number of worker threads, ie. the maximum number of
+          requests that can be waiting on the network at the same time.
+        :param requests_per_second: The sustained rate of requests allowed by the Moralis plan. A
+          token bucket of this rate is shared by all the worker threads.
+        :param client_factory: A callable that returns a new Moralis client (with the interface of
+          MoralisHTTP.get_many_nft_tokens_metadata.) Each worker thread gets its own client. By
+          default, a MoralisHTTP with a session of its own. Pass AffeDataGetter.new_moralis_http
+          for every client to send its requests through the pooled session of the run.
+        :param instrumentation: Used by the default clients, which count every request (and its
+          bytes and status) with it. A client_factory is expected to count its own requests.
+        """
+        self.max_requests_in_flight = max(1, int(max_requests_in_flight))
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=self.max_requests_in_flight)
+        self.client_factory = client_factory if client_factory is not None \
+            else (lambda: MoralisHTTP(instrumentation=instrumentation))
+        self._thread_local = threading.local()
+        self.instrumentation = instrumentation
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_many_nft_tokens_metadata(self,
+                                     contract_address: str,
+                                     iterable_with_token_ids,
+                                     list_of_metadata_fields_to_extract: list = None,
+                                     on_token_done=None) -> pd.DataFrame:
+        """
+        Concurrent equivalent of MoralisHTTP.get_many_nft_tokens_metadata. Each token is fetched on
+        its own with the Moralis client, so the resulting dataframe has exactly the same columns as
+        the serial version.
+        :param contract_address: The contract in which the tokens live.
+        :param iterable_with_token_ids: The IDs of the tokens to fetch metadata for.
+        :param list_of_metadata_fields_to_extract: Passed as-is to the Moralis client.
+        :param on_token_done: If given, a callable that is called with the token id and its dataframe
+          as soon as each token has been fetched (eg. to journal it.) Tokens that fail are not passed
+          to it.
+        :return: A dataframe with one row per token, in the same order as the token ids were given.
+        """
+        # dict.fromkeys() de-duplicates the ids while keeping their order.
+        list_token_ids = list(dict.fromkeys(iterable_with_token_ids))
+        dict_results = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_requests_in_flight) as executor:
+            futures = {executor.submit(self.get_one_nft_token_metadata,
+                                       contract_address,
+                                       token_id,
+                                       list_of_metadata_fields_to_extract): token_id
+                       for token_id in list_token_ids}
+            for future in as_completed(futures):
+                token_id = futures[future]
+                try:
+                    dict_results[token_id] = future.result()
+                except Exception as e:
+                    # A single failing token should not throw away the work done for all the others,
+                    # so we log it and carry on (the same way a token without metadata is handled.)
+                    logging.warning(f"Failed to fetch metadata for token -> '{token_id}': {e}")
+                    continue
+                if on_token_done is not None:
+                    on_token_done(token_id, dict_results[token_id])
+
+        list_dfs = [dict_results[token_id] for token_id in list_token_ids
+                    if token_id in dict_results and not dict_results[token_id].empty]
+        logging.info(f"Fetched metadata for {len(list_dfs)} of {len(list_token_ids)} tokens.")
+        if not list_dfs:
+            return pd.DataFrame()
+        return pd.concat(list_dfs, ignore_index=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_one_nft_token_metadata(self, contract_address: str, token_id,
+                                   list_of_metadata_fields_to_extract: list = None) -> pd.DataFrame:
+        """
+        Fetch the metadata of a single token (within the shared rate limit.) It can be called from
+        several threads at once; each thread gets its own Moralis client.
+        :return: A dataframe with the row(s) of the token (empty if Moralis has nothing for it.)
+        """
+        client = getattr(self._thread_local, 'client', None)
+        if client is None:
+            client = self.client_factory()
+            self._thread_local.client = client
+        self.rate_limiter.acquire()
+        return client.get_many_nft_tokens_metadata(
+            contract_address,
+            [token_id],
+            list_of_metadata_fields_to_extract=list_of_metadata_fields_to_extract)
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,453 @@
+import base64
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+
+
+class FakeNFTAPIServer:
+    """This class is a local stand-in for the parts of the Moralis API and of the OpenSea website
+    that the pipeline talks to. It serves recorded (or synthetic, see SyntheticAffeData) data, and
+    can be made to behave like the real thing on a bad day: slow responses, 429s when requests come
+    in faster than the quota, and a share of server errors. That way the stages that fetch data can
+    be run (and benchmarked) offline and reproducibly.
+
+    The clients in this repo are pointed at it through the same environment variables that they
+    read their base urls from (see environment().)
+
+    Endpoints served:
+      - GET /api/v2/{address}/nft/transfers                     (Moralis, paginated with a cursor)
+      - GET /api/v2/nft/{contract}                              (Moralis, tokens of a contract, paginated)
+      - GET /api/v2/nft/{contract}/{token_id}                   (Moralis, metadata of a token)
+      - GET /api/v2/nft/{contract}/{token_id}/transfers         (Moralis, transfers of a token, paginated)
+      - GET /api/v2/nft/{contract}/{token_id}/metadata/resync   (Moralis)
+      - GET /assets/ethereum/{contract}/{token_id}              (OpenSea item page, as HTML)
+      - GET /api/v1/asset/{contract}/{token_id}                 (OpenSea API, metadata of a token)"""
+
+    moralis_prefix = '/api/v2'
+    opensea_web_prefix = '/assets/ethereum'
+    opensea_api_prefix = '/api/v1'
+
+    regex_numeric_value = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s+of\s+(\d+(?:\.\d+)?)\s*$')
+
+    def __init__(self,
+                 df_transfers: pd.DataFrame = None,
+                 df_nfts: pd.DataFrame = None,
+                 df_extras: pd.DataFrame = None,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency_seconds: float = 0.0,
+                 latency_distribution: str = 'fixed',
+                 latency_spread: float = 0.5,
+                 page_size: int = 100,
+                 moralis_requests_per_second: float = None,
+                 moralis_burst_size: int = None,
+                 opensea_requests_per_second: float = None,
+                 error_rate: float = 0.0,
+                 seed: int = 42):
+        """
+        Initialize the FakeNFTAPIServer class. The server does not listen until start() is called.
+        :param df_transfers: The transfers served by the transfers endpoint (as in the
+          'xlii_transactions' table.)
+        :param df_nfts: The tokens served by the Moralis metadata endpoint (as in the 'nfts' table.)
+        :param df_extras: The properties shown in the OpenSea item pages (as in the
+          'nfts_extra_data' table.)
+        :param host: The interface to listen on.
+        :param port: The port to listen on. 0 picks a free one.
+        :param latency_seconds: The typical time the server takes to answer a request.
+        :param latency_distribution: 'fixed' (always latency_seconds), 'uniform' (between
+          latency_seconds * (1 - spread) and latency_seconds * (1 + spread)), or 'lognormal'
+          (median latency_seconds, with spread as sigma; this one has the long tail that real
+          APIs have.)
+        :param latency_spread: See latency_distribution.
+        :param page_size: How many transfers (or tokens of a contract) are returned per page.
+        :param moralis_requests_per_second: The quota of the Moralis endpoints. Requests above it are
+          answered with a 429. None means there is no limit.
+        :param moralis_burst_size: How many requests can be made at once before the quota kicks in.
+          By default, one second's worth.
+        :param opensea_requests_per_second: The same, for the OpenSea endpoints.
+        :param error_rate: The share of requests (between 0 and 1) answered with a 500, 502 or 503.
+        :param seed: The seed of the random generator used for latencies and errors.
+        """
+        if latency_distribution not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"Unknown latency distribution -> '{latency_distribution}'")
+        self.host = host
+        self.port = port
+        self.latency_seconds = latency_seconds
+        self.latency_distribution = latency_distribution
+        self.latency_spread = latency_spread
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.dict_limits = {'moralis': self.__new_limit(moralis_requests_per_second, moralis_burst_size),
+                            'opensea': self.__new_limit(opensea_requests_per_second, None)}
+
+        # Transfers are kept newest first (the order Moralis returns them in), with the columns
+        # that requests are filtered on as arrays.
+        df_transfers = df_transfers if df_transfers is not None else pd.DataFrame(
+            columns=['token_id', 'from_address', 'to_address', 'block_number'])
+        if not df_transfers.empty:
+            list_sort_columns = [col for col in ['block_number', 'transaction_index', 'log_index']
+                                 if col in df_transfers.columns]
+            df_transfers = df_transfers.sort_values(list_sort_columns, ascending=False, kind='stable',
+                                                    key=lambda column: pd.to_numeric(column, errors='coerce'))
+        self.list_transfers = self.__records(df_transfers)
+        self.transfer_from = df_transfers['from_address'].astype(str).str.lower().to_numpy()
+        self.transfer_to = df_transfers['to_address'].astype(str).str.lower().to_numpy()
+        self.transfer_token_ids = df_transfers['token_id'].astype(str).to_numpy()
+        self.transfer_blocks = pd.to_numeric(df_transfers['block_number'], errors='coerce').fillna(-1).to_numpy()
+
+        self.dict_nfts = self.__records_by_token(df_nfts)
+        self.dict_extras = self.__records_by_token(df_extras)
+
+        self.stats = {'requests': 0, 'connections': 0, 'by_status': {}, 'by_endpoint': {}}
+        self._server = None
+        self._thread = None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def from_synthetic_data(cls, synthetic_data, **kwargs):
+        """A server with the tables of a SyntheticAffeData (kwargs are passed to __init__.)"""
+        return cls(df_transfers=synthetic_data.transfers(), df_nfts=synthetic_data.nfts(),
+                   df_extras=synthetic_data.extras(), **kwargs)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def from_data_dir(cls, full_path_to_data_dir, table_storage, **kwargs):
+        """
+        A server that replays the tables that a previous run of the pipeline saved in the
+        'intermediate_files' directory of a data directory (kwargs are passed to __init__.)
+        :param table_storage: The TableStorage the tables were written with.
+        """
+        fullpath_dir = full_path_to_data_dir / 'intermediate_files'
+        dict_tables = {}
+        for name, file_stem, schema_name in [('df_transfers', 'xlii_transactions', 'transfers'),
+                                             ('df_nfts', 'nfts', 'nfts'),
+                                             ('df_extras', 'nfts_extra_data', 'extras')]:
+            fullpath_table = table_storage.path(fullpath_dir, file_stem)
+            try:
+                dict_tables[name] = table_storage.read(fullpath_table, schema_name)
+            except FileNotFoundError:
+                logging.warning(f"No recorded table at '{fullpath_table}', its endpoints will return nothing.")
+        return cls(**dict_tables, **kwargs)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def start(self):
+        """
+        Start listening, in a background thread.
+        :return: The instance itself, so that eg. FakeNFTAPIServer(...).start() can be assigned.
+        """
+        fake_api = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            # HTTP/1.1, so connections are kept alive between requests (as the real APIs do.)
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with fake_api._lock:
+                    fake_api.stats['connections'] += 1
+
+            def do_GET(self):
+                fake_api.handle_request(self)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Fake API: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-nft-api', daemon=True)
+        self._thread.start()
+        logging.info(f"Fake NFT API listening on http://{self.host}:{self.port}")
+        return self
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __enter__(self):
+        return self.start()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @property
+    def moralis_url(self) -> str:
+        return f"http://{self.host}:{self.port}{self.moralis_prefix}"
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @property
+    def opensea_web_url(self) -> str:
+        return f"http://{self.host}:{self.port}{self.opensea_web_prefix}"
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @property
+    def opensea_api_url(self) -> str:
+        return f"http://{self.host}:{self.port}{self.opensea_api_prefix}"
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def environment(self) -> dict:
+        """The environment variables that point the clients of this repo (MoralisHTTP, OpenseaHTTP
+        and OpenseaHTMLPropertiesExtractor) at this server."""
+        return {'MORALIS_API_URL': self.moralis_url, 'OPENSEA_WEB_URL': self.opensea_web_url,
+                'OPENSEA_API_URL': self.opensea_api_url}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def handle_request(self, handler: BaseHTTPRequestHandler):
+        """Answer one request (this is called by the request handler, in the thread of the request.)"""
+        url = urlsplit(handler.path)
+        path = url.path
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        service = 'moralis' if path.startswith(self.moralis_prefix) else 'opensea'
+
+        route = self.__route(path)
+        endpoint = route[0] if route else 'unknown'
+        time.sleep(self.__latency())
+
+        dict_headers = {}
+        limit = self.dict_limits[service]
+        if limit is not None:
+            allowed, retry_after = self.__take(limit)
+            if service == 'moralis':
+                dict_headers.update({'x-rate-limit-limit': str(int(limit['rate'])),
+                                     'x-rate-limit-remaining-ttl': '1'})
+            if not allowed:
+                dict_headers['Retry-After'] = f"{retry_after:.3f}"
+                return self.__send(handler, endpoint, 429, {'message': 'Rate limit exceeded.'}, dict_headers)
+
+        with self._lock:
+            is_error = self._random.random() < self.error_rate
+            error_status = self._random.choice([500, 502, 503])
+        if is_error:
+            return self.__send(handler, endpoint, error_status, {'message': 'Injected server error.'}, dict_headers)
+        if route is None:
+            return self.__send(handler, endpoint, 404, {'message': f"Not found: {path}"}, dict_headers)
+
+        endpoint, arguments = route
+        if endpoint == 'transfers':
+            return self.__send(handler, endpoint, 200, self.__transfers_page(arguments[0], query), dict_headers)
+        if endpoint == 'contract_nfts':
+            return self.__send(handler, endpoint, 200, self.__contract_nfts_page(arguments[0], query), dict_headers)
+        token_id = arguments[1]
+        if endpoint == 'token_transfers':
+            return self.__send(handler, endpoint, 200, self.__token_transfers_page(token_id, query), dict_headers)
+        if endpoint == 'moralis_metadata':
+            record = self.dict_nfts.get(token_id)
+            if record is None:
+                return self.__send(handler, endpoint, 404, {'message': 'No metadata found.'}, dict_headers)
+            return self.__send(handler, endpoint, 200, record, dict_headers)
+        if endpoint == 'resync':
+            if token_id not in self.dict_nfts and token_id not in self.dict_extras:
+                return self.__send(handler, endpoint, 404, {'message': 'Token not found.'}, dict_headers)
+            return self.__send(handler, endpoint, 200,
+                               {'status': 'Request has been received and will be processed'}, dict_headers)
+        if endpoint == 'item_page':
+            if token_id not in self.dict_extras:
+                return self.__send(handler, endpoint, 404, {'message': 'Item not found.'}, dict_headers)
+            return self.__send(handler, endpoint, 200, self.__item_page(token_id), dict_headers)
+        if token_id not in self.dict_nfts and token_id not in self.dict_extras:
+            return self.__send(handler, endpoint, 404, {'success': False}, dict_headers)
+        if endpoint == 'opensea_metadata':
+            return self.__send(handler, endpoint, 200, self.__opensea_metadata(token_id), dict_headers)
+        # endpoint == 'opensea_asset'
+        return self.__send(handler, endpoint, 200, self.__opensea_asset(token_id), dict_headers)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __route(self, path: str):
+        """Which endpoint a path is for, and the parts of the path that matter to it (or None.)"""
+        list_routes = [('resync', rf'^{self.moralis_prefix}/nft/(0x[0-9a-fA-F]+)/(\d+)/metadata/resync/?$'),
+                       ('token_transfers', rf'^{self.moralis_prefix}/nft/(0x[0-9a-fA-F]+)/(\d+)/transfers/?$'),
+                       ('moralis_metadata', rf'^{self.moralis_prefix}/nft/(0x[0-9a-fA-F]+)/(\d+)/?$'),
+                       ('contract_nfts', rf'^{self.moralis_prefix}/nft/(0x[0-9a-fA-F]+)/?$'),
+                       ('transfers', rf'^{self.moralis_prefix}/(0x[0-9a-fA-F]+)/nft/transfers/?$'),
+                       ('item_page', rf'^{self.opensea_web_prefix}/(0x[0-9a-fA-F]+)/(\d+)/?$'),
+                       ('opensea_asset', rf'^{self.opensea_api_prefix}/asset/(0x[0-9a-fA-F]+)/(\d+)/?$'),
+                       ('opensea_metadata', rf'^{self.opensea_api_prefix}/metadata/(0x[0-9a-fA-F]+)/(\d+)/?$')]
+        for endpoint, pattern in list_routes:
+            match = re.match(pattern, path)
+            if match:
+                return endpoint, match.groups()
+        return None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __transfers_page(self, address: str, query: dict) -> dict:
+        address = address.lower()
+        direction = query.get('direction', 'both')
+        mask = np.zeros(len(self.list_transfers), dtype=bool)
+        if direction in ('from', 'both'):
+            mask |= self.transfer_from == address
+        if direction in ('to', 'both'):
+            mask |= self.transfer_to == address
+        if 'from_block' in query:
+            mask &= self.transfer_blocks >= int(query['from_block'])
+        positions = np.flatnonzero(mask)
+        return self.__page([self.list_transfers[position] for position in positions.tolist()], query)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __token_transfers_page(self, token_id: str, query: dict) -> dict:
+        mask = self.transfer_token_ids == token_id
+        if 'from_block' in query:
+            mask &= self.transfer_blocks >= int(query['from_block'])
+        return self.__page([self.list_transfers[position] for position in np.flatnonzero(mask).tolist()], query)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __contract_nfts_page(self, contract_address: str, query: dict) -> dict:
+        # Tokens whose record does not say which contract they live in are listed under any contract.
+        contract_address = contract_address.lower()
+        list_tokens = [record for record in self.dict_nfts.values()
+                       if str(record.get('token_address') or contract_address).lower() == contract_address]
+        return self.__page(list_tokens, query)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __page(self, list_records: list, query: dict) -> dict:
+        """The page of a list that the cursor of a query points to (the first one without a cursor.)"""
+        # The cursor is opaque to the client; here it simply holds where the next page starts.
+        offset = 0
+        if query.get('cursor'):
+            offset = json.loads(base64.urlsafe_b64decode(query['cursor'].encode()))['offset']
+        next_offset = offset + self.page_size
+        cursor = None
+        if next_offset < len(list_records):
+            cursor = base64.urlsafe_b64encode(json.dumps({'offset': next_offset}).encode()).decode()
+        return {'total': len(list_records),
+                'page': offset // self.page_size,
+                'page_size': self.page_size,
+                'cursor': cursor,
+                'result': list_records[offset:next_offset]}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __traits(self, token_id: str) -> list:
+        """The properties of a token, in the shape OpenSea uses for traits."""
+        list_traits = []
+        for name, value in self.dict_extras.get(token_id, {}).items():
+            if name == 'token_id' or value is None:
+                continue
+            match = self.regex_numeric_value.match(value)
+            if match:
+                list_traits.append({'traitType': name, 'value': float(match.group(1)),
+                                    'maxValue': float(match.group(2)), 'displayType': 'number'})
+            else:
+                list_traits.append({'traitType': name, 'value': value})
+        return list_traits
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __item_page(self, token_id: str) -> str:
+        payload = {'props': {'pageProps': {'item': {'tokenId': token_id, 'traits': self.__traits(token_id)}}}}
+        # '</' would end the script tag early, so it is escaped (as real pages do.)
+        json_text = json.dumps(payload).replace('</', '<\\/')
+        return (f"<!DOCTYPE html><html><head><title>Item {token_id}</title></head><body>"
+                f"<div id=\"__next\"></div>"
+                f"<script id=\"__NEXT_DATA__\" type=\"application/json\">{json_text}</script>"
+                f"</body></html>")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __opensea_asset(self, token_id: str) -> dict:
+        record = self.dict_nfts.get(token_id, {})
+        return {'token_id': token_id,
+                'name': record.get('name'),
+                'description': record.get('description'),
+                'image_url': record.get('image'),
+                'external_link': record.get('external_link'),
+                'animation_url': record.get('animation_url'),
+                'traits': [{'trait_type': trait['traitType'], 'value': trait['value']}
+                           for trait in self.__traits(token_id)]}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __opensea_metadata(self, token_id: str) -> dict:
+        """What the tokenURI of a token of the storefront contract serves."""
+        record = self.dict_nfts.get(token_id, {})
+        return {'name': record.get('name'),
+                'description': record.get('description'),
+                'image': record.get('image'),
+                'external_link': record.get('external_link'),
+                'animation_url': record.get('animation_url'),
+                'attributes': [{'trait_type': trait['traitType'], 'value': trait['value']}
+                               for trait in self.__traits(token_id)]}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __send(self, handler: BaseHTTPRequestHandler, endpoint: str, status: int, body, dict_headers: dict):
+        if isinstance(body, str):
+            content = body.encode('utf-8')
+            content_type = 'text/html; charset=utf-8'
+        else:
+            content = json.dumps(body).encode('utf-8')
+            content_type = 'application/json'
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['by_status'][status] = self.stats['by_status'].get(status, 0) + 1
+            dict_endpoint = self.stats['by_endpoint'].setdefault(endpoint, {})
+            dict_endpoint[status] = dict_endpoint.get(status, 0) + 1
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(content)))
+        for name, value in dict_headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(content)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __latency(self) -> float:
+        if self.latency_seconds <= 0:
+            return 0.0
+        with self._lock:
+            if self.latency_distribution == 'uniform':
+                return self._random.uniform(self.latency_seconds * (1 - self.latency_spread),
+                                            self.latency_seconds * (1 + self.latency_spread))
+            if self.latency_distribution == 'lognormal':
+                return self._random.lognormvariate(np.log(self.latency_seconds), self.latency_spread)
+        return self.latency_seconds
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __new_limit(requests_per_second: float, burst_size: int) -> dict:
+        """The state of a (non-blocking) token bucket, or None if there is no limit."""
+        if not requests_per_second:
+            return None
+        capacity = float(burst_size) if burst_size else max(float(requests_per_second), 1.0)
+        return {'rate': float(requests_per_second), 'capacity': capacity, 'tokens': capacity,
+                'last': time.monotonic()}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __take(self, limit: dict):
+        """
+        Take one request out of a quota.
+        :return: Whether the request is allowed, and if it isn't, how many seconds until it would be.
+        """
+        with self._lock:
+            now = time.monotonic()
+            limit['tokens'] = min(limit['capacity'], limit['tokens'] + (now - limit['last']) * limit['rate'])
+            limit['last'] = now
+            if limit['tokens'] >= 1:
+                limit['tokens'] -= 1
+                return True, 0.0
+            return False, (1 - limit['tokens']) / limit['rate']
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __records(df: pd.DataFrame) -> list:
+        """The rows of a table as JSON-ready dicts. Like Moralis, every value is sent as a string."""
+        if df is None or df.empty:
+            return []
+        return [{col: (None if pd.isna(value) else str(value)) for col, value in record.items()}
+                for record in df.astype(object).to_dict('records')]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def __records_by_token(cls, df: pd.DataFrame) -> dict:
+        return {record['token_id']: record for record in cls.__records(df)}
+    # ------------------------ END FUNCTION ------------------------ #
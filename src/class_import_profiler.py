@@ -0,0 +1,108 @@
+import builtins
+import sys
+import threading
+import time
+
+
+class ImportProfiler:
+    """This class measures how long each module takes to import, while it is active (eg. for the
+    duration of a command line run), the way 'python -X importtime' does, but from within the
+    program, so the report can be asked for with a flag. Only the first import of a module is
+    measured (the following ones cost nothing.)
+
+    Usage:
+        with ImportProfiler() as profiler:
+            ...
+        print(profiler.report())"""
+
+    def __init__(self):
+        self.list_records = []
+        self._original_import = None
+        self._thread_local = threading.local()
+        self._start = None
+        self.seconds_active = None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __enter__(self):
+        self.start()
+        return self
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def start(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self.__timed_import
+        self._start = time.perf_counter()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def stop(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+            self.seconds_active = time.perf_counter() - self._start
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def as_dict(self) -> dict:
+        """
+        :return: A dict with the total time spent importing (by the imports made directly by the
+          program, ie. not counting twice the modules they import themselves), and a record per
+          module with its 'seconds' (including the modules it imported), its 'self_seconds' and its
+          'depth' (0 for the imports made directly by the program.)
+        """
+        seconds_importing = sum(record['seconds'] for record in self.list_records if record['depth'] == 0)
+        return {'seconds_active': self.seconds_active,
+                'seconds_importing': seconds_importing,
+                'num_modules': len(self.list_records),
+                'modules': list(self.list_records)}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def report(self, num_modules: int = 15) -> str:
+        """
+        :param num_modules: How many of the slowest modules are listed.
+        :return: A human readable report: the slowest imports made directly by the program, and the
+          slowest modules on their own (without the modules they import.)
+        """
+        dict_profile = self.as_dict()
+        list_lines = [f"Imported {dict_profile['num_modules']} modules in {dict_profile['seconds_importing']:.3f} s"
+                      + (f" (of {dict_profile['seconds_active']:.3f} s in total)"
+                         if dict_profile['seconds_active'] is not None else "")]
+        list_top_level = sorted((record for record in self.list_records if record['depth'] == 0),
+                                key=lambda record: record['seconds'], reverse=True)
+        list_lines.append("Slowest imports (including what they import):")
+        for record in list_top_level[:num_modules]:
+            list_lines.append(f"  {record['seconds'] * 1000:9.1f} ms  {record['module']}")
+        list_lines.append("Slowest modules (on their own):")
+        for record in sorted(self.list_records, key=lambda record: record['self_seconds'], reverse=True)[:num_modules]:
+            list_lines.append(f"  {record['self_seconds'] * 1000:9.1f} ms  {record['module']}")
+        return '\n'.join(list_lines)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module_name = name
+        if level > 0 and globals:
+            # A relative import (eg. 'from . import x'), which is resolved against the importing package.
+            package = globals.get('__package__') or ''
+            list_parts = package.split('.')
+            module_name = '.'.join(list_parts[:len(list_parts) - (level - 1)] + ([name] if name else []))
+        if module_name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        list_stack = getattr(self._thread_local, 'list_stack', None)
+        if list_stack is None:
+            list_stack = self._thread_local.list_stack = []
+        # The time spent in the imports nested in this one is added up here, to work out its self time.
+        list_stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            seconds = time.perf_counter() - start
+            seconds_nested = list_stack.pop()
+            if list_stack:
+                list_stack[-1] += seconds
+            self.list_records.append({'module': module_name, 'seconds': seconds,
+                                      'self_seconds': seconds - seconds_nested, 'depth': len(list_stack)})
+    # ------------------------ END FUNCTION ------------------------ #
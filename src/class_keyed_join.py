@@ -0,0 +1,85 @@
+import logging
+import pandas as pd
+
+
+class KeyedJoin:
+    """This class joins any number of dataframes that share a key column (eg. 'token_id') in a
+    single pass. Every source declares a priority, and where several sources have a column with
+    the same name, the values are coalesced (the highest priority source that has a value for a
+    given key wins) instead of ending up as duplicated '_x'/'_y' columns. The dataframes that are
+    passed in are never modified."""
+
+    def __init__(self, key: str = 'token_id'):
+        """
+        Initialize the KeyedJoin class.
+        :param key: The name of the column that all sources share, and that the join is made on.
+        """
+        self.key = key
+        self.list_sources = []
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def add_source(self, df: pd.DataFrame, name: str = None, priority: int = 0):
+        """
+        Add a dataframe to the join.
+        :param df: The dataframe. It must have the key column.
+        :param name: A name for the source, only used in log messages.
+        :param priority: Where sources share a column, values from sources with a higher priority
+          win. Sources with the same priority win in the order they were added.
+        :return: The instance itself, so calls can be chained.
+        """
+        name = name if name else f"source {len(self.list_sources) + 1}"
+        if self.key not in df.columns:
+            raise ValueError(f"Source '{name}' does not have the key column '{self.key}'.")
+        self.list_sources.append({'df': df, 'name': name, 'priority': priority,
+                                  'order': len(self.list_sources)})
+        return self
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def join(self) -> pd.DataFrame:
+        """
+        Join all the sources (an outer join: every key that appears in any source is kept.)
+        :return: A new dataframe with the key as its first column, followed by the columns of
+          the sources in the order the sources were added.
+        """
+        if not self.list_sources:
+            return pd.DataFrame()
+
+        # Each source is indexed by the key once. Keys are compared as strings, so that a token
+        # id read as a number in one source still matches the same id read as text in another.
+        list_indexed = []
+        for source in self.list_sources:
+            df = source['df']
+            keys = df[self.key].where(df[self.key].isna(), df[self.key].astype(str))
+            df_indexed = df.drop(columns=[self.key]).set_index(pd.Index(keys, name=self.key))
+            df_indexed = df_indexed[df_indexed.index.notna()]
+            if df_indexed.index.has_duplicates:
+                num_duplicates = df_indexed.index.duplicated().sum()
+                logging.warning(f"Source '{source['name']}' has {num_duplicates} rows with a repeated "
+                                f"'{self.key}'; only the first row of each is used.")
+                df_indexed = df_indexed[~df_indexed.index.duplicated(keep='first')]
+            list_indexed.append((source, df_indexed))
+
+        # The union of all keys, in order of first appearance.
+        index_union = pd.Index(pd.unique(pd.concat([pd.Series(df_indexed.index) for _, df_indexed in list_indexed],
+                                                   ignore_index=True)), name=self.key)
+
+        # For every column, the sources that have it, from highest to lowest priority.
+        dict_column_sources = {}
+        for source, df_indexed in list_indexed:
+            for col in df_indexed.columns:
+                dict_column_sources.setdefault(col, []).append((source, df_indexed))
+        dict_columns = {}
+        for col, list_column_sources in dict_column_sources.items():
+            list_column_sources.sort(key=lambda item: (-item[0]['priority'], item[0]['order']))
+            column = None
+            for _, df_indexed in list_column_sources:
+                reindexed = df_indexed[col].reindex(index_union)
+                column = reindexed if column is None else column.combine_first(reindexed)
+            dict_columns[col] = column
+            if len(list_column_sources) > 1:
+                logging.debug(f"Column '{col}' coalesced from sources: "
+                              f"{', '.join(source['name'] for source, _ in list_column_sources)}")
+
+        df_joined = pd.DataFrame(dict_columns, index=index_union)
+        return df_joined.reset_index()
+    # ------------------------ END FUNCTION ------------------------ #
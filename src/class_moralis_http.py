@@ -0,0 +1,362 @@
+import json
+import logging
+import queue
+import threading
+import time
+from os import getenv
+import pandas as pd
+import requests
+
+
+class MoralisHTTP:
+    """A thin wrapper around the Moralis REST API, used where this repo needs access to the raw
+    HTTP responses (eg. status codes and rate-limit headers) rather than the parsed data that
+    MoralisAPIinteractions returns."""
+
+    default_base_url = "https://deep-index.moralis.io/api/v2"
+
+    def __init__(self,
+                 api_key: str = None,
+                 base_url: str = None,
+                 chain: str = 'eth',
+                 timeout_seconds=30,
+                 session: requests.Session = None,
+                 instrumentation=None):
+        """
+        Initialize the MoralisHTTP class.
+        :param api_key: The Moralis API key. If not provided, it is read from the MORALIS_KEY
+          environment variable (the same one the rest of the project uses.)
+        :param base_url: The root of the API. If not provided, it is read from the MORALIS_API_URL
+          environment variable, and if that isn't set either, the public Moralis endpoint is used.
+        :param chain: The chain that is passed along with every request.
+        :param timeout_seconds: How long to wait for the API before giving up on a request (either
+          seconds, or a (connect, read) tuple of seconds.)
+        :param session: A requests session to send the requests through (eg. the session of a
+          PooledHTTPClient shared by the whole run.) If not provided, one is created.
+        :param instrumentation: If given (a RunInstrumentation), every request is counted with it.
+        """
+        self.api_key = api_key if api_key else getenv('MORALIS_KEY')
+        if not self.api_key:
+            logging.warning("No Moralis API key was provided, and MORALIS_KEY is not set.")
+        self.base_url = (base_url if base_url else getenv('MORALIS_API_URL', self.default_base_url)).rstrip('/')
+        self.chain = chain
+        self.timeout_seconds = timeout_seconds
+        # A session that was handed in belongs to whoever created it, and is not closed by close().
+        self._owns_session = session is None
+        self.session = session if session is not None else requests.Session()
+        self.instrumentation = instrumentation
+        # The number of requests that were retried (see get_with_retries.)
+        self.num_retries = 0
+        self._lock = threading.Lock()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get(self, path: str, params: dict = None) -> requests.Response:
+        """
+        Send a GET request to the API.
+        :param path: The path of the endpoint, relative to the base url (eg. '/nft/0x.../1/metadata/resync')
+        :param params: Query parameters. The chain is added automatically unless it is already present.
+        :return: The response, whatever its status code was.
+        """
+        query = {'chain': self.chain}
+        if params:
+            query.update(params)
+        headers = {'accept': 'application/json', 'X-API-Key': self.api_key or ''}
+        try:
+            response = self.session.get(self.base_url + '/' + path.lstrip('/'),
+                                        params=query,
+                                        headers=headers,
+                                        timeout=self.timeout_seconds)
+        except requests.RequestException:
+            if self.instrumentation is not None:
+                self.instrumentation.record_call('moralis', failed=True)
+            raise
+        if self.instrumentation is not None:
+            self.instrumentation.record_response(response, 'moralis')
+        return response
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_with_retries(self, path: str, params: dict = None, max_retries: int = 5,
+                         max_backoff_seconds: float = 60, rate_limiter=None) -> requests.Response:
+        """
+        Send a GET request to the API, retrying it (the same way MoralisResyncScheduler retries a
+        resync) when Moralis says we went too fast (429), when it fails on its side (5xx), or when
+        the request does not get through at all.
+        :param path: The path of the endpoint (see get.)
+        :param params: Query parameters (see get.)
+        :param max_retries: How many times the request is retried before the error is raised.
+        :param max_backoff_seconds: The longest time to wait before a retry.
+        :param rate_limiter: If given (a TokenBucket), a token is taken from it before every attempt,
+          and it is drained after a 429, so that every other user of the bucket slows down too.
+        :return: The response, whose status code is 2xx. Anything else is raised (as an HTTPError, or
+          as the error of the last attempt.)
+        """
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            response = None
+            try:
+                response = self.get(path, params=params)
+            except requests.RequestException as e:
+                if attempt >= max_retries:
+                    raise
+                logging.debug(f"Request to '{path}' raised: {e}")
+            if response is not None:
+                if not self.is_retryable(response.status_code) or attempt >= max_retries:
+                    response.raise_for_status()
+                    return response
+                if response.status_code == 429 and rate_limiter is not None:
+                    rate_limiter.drain()
+
+            attempt += 1
+            with self._lock:
+                self.num_retries += 1
+            if self.instrumentation is not None:
+                self.instrumentation.count('retries')
+            backoff = self.backoff_seconds(attempt, response, max_backoff_seconds)
+            logging.debug(f"Retrying '{path}' in {backoff:.1f}s (attempt {attempt} of {max_retries}, "
+                          f"status: {response.status_code if response is not None else None})")
+            time.sleep(backoff)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def is_retryable(status_code) -> bool:
+        """
+        :param status_code: The status code of a response, or None if the request did not get through.
+        :return: Whether the request is worth sending again: 429 (too many requests), server errors
+          and network errors are, anything else (eg. 400 or 404) will get the same answer again.
+        """
+        return status_code is None or status_code == 429 or status_code >= 500
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def backoff_seconds(attempt: int, response: requests.Response = None, max_backoff_seconds: float = 60) -> float:
+        """
+        :param attempt: The number of the retry about to be made (1 for the first one.)
+        :param response: The response that is being retried, if there was one. After a 429, the time
+          Moralis asks for (in the Retry-After header) is waited rather than the exponential backoff.
+        :param max_backoff_seconds: The longest time to wait.
+        :return: How many seconds to wait before the retry.
+        """
+        backoff = min(max_backoff_seconds, 2 ** (attempt - 1))
+        if response is not None and response.status_code == 429:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None:
+                try:
+                    backoff = min(max_backoff_seconds, max(float(retry_after), 0.0))
+                except ValueError:
+                    pass
+        return backoff
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_token_metadata(self, contract_address: str, token_id,
+                               list_of_metadata_fields_to_extract: list = None, **kwargs_retries) -> dict:
+        """
+        Get the record that Moralis keeps for a token (owner, token_hash, last_metadata_sync,
+        metadata, etc.) The request is retried as get_with_retries does.
+        :param contract_address: The contract in which the token lives.
+        :param token_id: The id of the token.
+        :param list_of_metadata_fields_to_extract: The fields of the token's metadata (a JSON
+          document, as a string) that are also given as columns of their own. A field that the
+          metadata does not have keeps the value Moralis gives it at the top level, if any.
+        :param kwargs_retries: max_retries, max_backoff_seconds and rate_limiter (see get_with_retries.)
+        :return: The record (dict), or None if Moralis does not know the token.
+        """
+        try:
+            response = self.get_with_retries(f"/nft/{contract_address}/{token_id}", params={'format': 'decimal'},
+                                             **kwargs_retries)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        dict_record = response.json()
+        dict_metadata = {}
+        metadata = dict_record.get('metadata')
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except json.JSONDecodeError:
+                logging.debug(f"The metadata of token -> '{token_id}' is not valid JSON.")
+        if isinstance(metadata, dict):
+            dict_metadata = metadata
+        for field in list_of_metadata_fields_to_extract or []:
+            dict_record[field] = dict_metadata.get(field, dict_record.get(field))
+        return dict_record
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_many_nft_tokens_metadata(self, contract_address: str, iterable_with_token_ids,
+                                     list_of_metadata_fields_to_extract: list = None) -> pd.DataFrame:
+        """
+        The same interface as MoralisAPIinteractions.get_many_nft_tokens_metadata (so this class can
+        be the client of ConcurrentMetadataFetcher), with the requests sent through our own session.
+        :return: A dataframe with a row per token that Moralis knows (see get_nft_token_metadata.)
+        """
+        list_records = []
+        for token_id in iterable_with_token_ids:
+            dict_record = self.get_nft_token_metadata(contract_address, token_id,
+                                                      list_of_metadata_fields_to_extract=list_of_metadata_fields_to_extract)
+            if dict_record is not None:
+                list_records.append(dict_record)
+        return pd.DataFrame(list_records)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_contract_nfts_pages(self, contract_address: str, **kwargs_retries):
+        """
+        Page through the tokens of a contract, as Moralis lists them. Every token comes with its
+        sync markers ('token_hash' and 'last_metadata_sync'), so this is a cheap way to learn which
+        tokens Moralis has seen change, without a request per token.
+        :param contract_address: The contract whose tokens are wanted.
+        :param kwargs_retries: max_retries, max_backoff_seconds and rate_limiter (see get_with_retries.)
+          The request of a page that fails is retried with the same cursor.
+        :return: A generator that yields one list of tokens (dicts, as returned by Moralis) per page.
+        """
+        return self.__pages(f"/nft/{contract_address}", {'format': 'decimal', 'limit': 100}, **kwargs_retries)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_token_transfers_pages(self, contract_address: str, token_id, from_block: int = None,
+                                      **kwargs_retries):
+        """
+        Page through every transfer of one token, whoever the sender and the receiver were (unlike
+        get_nft_transfers_pages, which only has the transfers of one address.)
+        :param contract_address: The contract in which the token lives.
+        :param token_id: The id of the token.
+        :param from_block: If given, only transfers in this block or later are returned.
+        :param kwargs_retries: max_retries, max_backoff_seconds and rate_limiter (see get_with_retries.)
+          The request of a page that fails is retried with the same cursor.
+        :return: A generator that yields one list of transfers (dicts, as returned by Moralis) per page.
+        """
+        params = {'format': 'decimal'}
+        if from_block is not None:
+            params['from_block'] = int(from_block)
+        return self.__pages(f"/nft/{contract_address}/{token_id}/transfers", params, **kwargs_retries)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_sync_markers(self, contract_address: str, iterable_with_token_ids,
+                             max_pages: int = None, **kwargs_retries) -> dict:
+        """
+        Get the current sync markers of some tokens, from the listing of their contract (see
+        get_contract_nfts_pages.) The listing is only paged through until every one of the tokens
+        has been seen, or until max_pages pages have been read.
+        :param contract_address: The contract in which the tokens live.
+        :param iterable_with_token_ids: The IDs of the tokens whose markers are wanted.
+        :param max_pages: The most pages to read (a shared contract, like the OpenSea storefront,
+          holds far more tokens than the ones we want.) None reads the whole listing if needed.
+        :param kwargs_retries: max_retries, max_backoff_seconds and rate_limiter (see get_with_retries.)
+        :return: A dict of token_id (as a str) -> {'token_hash': ..., 'last_metadata_sync': ...}, for
+          the tokens that were found. Tokens that are missing from it have no known markers.
+        """
+        set_wanted = {str(token_id) for token_id in iterable_with_token_ids}
+        dict_markers = {}
+        if not set_wanted or max_pages == 0:
+            return dict_markers
+        num_pages = 0
+        for list_tokens in self.get_contract_nfts_pages(contract_address, **kwargs_retries):
+            num_pages += 1
+            for dict_token in list_tokens:
+                token_id = str(dict_token.get('token_id'))
+                if token_id in set_wanted:
+                    dict_markers[token_id] = {'token_hash': dict_token.get('token_hash'),
+                                              'last_metadata_sync': dict_token.get('last_metadata_sync')}
+            if len(dict_markers) == len(set_wanted) or (max_pages is not None and num_pages >= max_pages):
+                break
+        logging.debug(f"Sync markers of {len(dict_markers)} of {len(set_wanted)} tokens found "
+                      f"in {num_pages} pages of the listing of '{contract_address}'.")
+        return dict_markers
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_transfers_pages(self, address: str, direction: str = 'both', from_block: int = None,
+                                max_retries: int = 5, max_backoff_seconds: float = 60, rate_limiter=None):
+        """
+        Page through the NFT transfers of an address. A page whose request fails with an error worth
+        retrying (see get_with_retries) is requested again, with the same cursor, so a transient
+        error does not restart (or abort) the pagination.
+        :param address: The address whose transfers are wanted.
+        :param direction: 'to', 'from' or 'both'.
+        :param from_block: If given, only transfers in this block or later are returned.
+        :param max_retries: How many times the request of a page is retried before the error is raised.
+        :param max_backoff_seconds: The longest time to wait before retrying a page.
+        :param rate_limiter: If given (a TokenBucket), the request of every page takes a token from it.
+        :return: A generator that yields one list of transfers (dicts, as returned by Moralis) per page,
+          newest transfers first.
+        """
+        params = {'format': 'decimal', 'direction': direction}
+        if from_block is not None:
+            params['from_block'] = int(from_block)
+        return self.__pages(f"/{address}/nft/transfers", params, max_retries=max_retries,
+                            max_backoff_seconds=max_backoff_seconds, rate_limiter=rate_limiter)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_transfers_pages_prefetching(self, address: str, direction: str = 'both', from_block: int = None,
+                                            num_pages_ahead: int = 1, **kwargs_retries):
+        """
+        The same as get_nft_transfers_pages, but each page is requested (by a background thread) as
+        soon as the cursor for it is known, rather than when the caller asks for it, so the
+        download of the next page overlaps with whatever the caller does with the current one.
+        :param num_pages_ahead: How many downloaded pages may wait for the caller. The thread stops
+          downloading while they do, so memory stays bounded by a few pages.
+        :param kwargs_retries: max_retries, max_backoff_seconds and rate_limiter (see get_nft_transfers_pages.)
+        :return: A generator that yields one list of transfers per page (as get_nft_transfers_pages.)
+        """
+        queue_pages = queue.Queue(maxsize=max(1, int(num_pages_ahead)))
+        event_stop = threading.Event()
+        end_of_pages = object()
+
+        def put(item) -> bool:
+            # The caller may stop asking for pages (eg. on an error), so the thread never blocks for good.
+            while not event_stop.is_set():
+                try:
+                    queue_pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def download():
+            try:
+                for list_page in self.get_nft_transfers_pages(address, direction=direction, from_block=from_block,
+                                                            **kwargs_retries):
+                    if not put(list_page):
+                        return
+                put(end_of_pages)
+            except Exception as e:
+                # The error is raised in the caller's thread, where the page would have been.
+                put(e)
+
+        thread = threading.Thread(target=download, name='moralis-transfers-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = queue_pages.get()
+                if item is end_of_pages:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            event_stop.set()
+            thread.join()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __pages(self, path: str, params: dict, **kwargs_retries):
+        """
+        Page through an endpoint that Moralis paginates with a cursor. The request of a page that
+        fails with an error worth retrying (see get_with_retries) is sent again, with the same cursor.
+        :return: A generator that yields the 'result' (a list) of every page.
+        """
+        params = dict(params)
+        cursor = None
+        while True:
+            if cursor:
+                params['cursor'] = cursor
+            response = self.get_with_retries(path, params=params, **kwargs_retries)
+            payload = response.json()
+            yield payload.get('result', [])
+            cursor = payload.get('cursor')
+            if not cursor:
+                return
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+    # ------------------------ END FUNCTION ------------------------ #
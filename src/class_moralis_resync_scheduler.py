@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from class_moralis_http import MoralisHTTP
+from class_token_bucket import TokenBucket
+
+
+class MoralisResyncScheduler:
+    """This class asks Moralis to resync the metadata of many tokens, sending the requests in
+    bursts as large as our quota allows, and backing off whenever Moralis says we went too fast."""
+
+    # The bounds of the quota window read from the response headers (see __quota_window_seconds.)
+    min_quota_window_seconds = 1.0
+    max_quota_window_seconds = 60.0
+    # A reset time above this (a few years after 1970) is a timestamp rather than a number of seconds.
+    epoch_threshold_seconds = 1e8
+
+    def __init__(self,
+                 moralis_http: MoralisHTTP = None,
+                 requests_per_second: float = 5.0,
+                 burst_size: int = 10,
+                 max_retries: int = 5,
+                 max_backoff_seconds: float = 60,
+                 instrumentation=None):
+        """
+        Initialize the MoralisResyncScheduler class.
+        :param moralis_http: The client used to talk to Moralis. If not provided, one is created
+          (counting its requests with the instrumentation below.)
+        :param requests_per_second: The quota to start with. As soon as Moralis reports its real
+          quota in the rate-limit headers of a response, that is used instead.
+        :param burst_size: The maximum number of requests sent at once.
+        :param max_retries: How many times a single token is retried (after a 429 or a server
+          error) before it is counted as rejected.
+        :param max_backoff_seconds: The longest time to wait before retrying after a 429.
+        :param instrumentation: If given (a RunInstrumentation), retries are counted with it.
+        """
+        self.moralis_http = moralis_http if moralis_http is not None else MoralisHTTP(instrumentation=instrumentation)
+        self.instrumentation = instrumentation
+        self.burst_size = max(1, int(burst_size))
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=self.burst_size)
+        self.max_retries = max_retries
+        self.max_backoff_seconds = max_backoff_seconds
+        self._lock = threading.Lock()
+        self._quota_from_headers = None
+        self.report = {}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def resync_many_nft_tokens_metadata(self, contract_address: str, iterable_with_token_ids,
+                                        on_token_done=None) -> dict:
+        """
+        Request a metadata resync for each token.
+        :param contract_address: The contract in which the tokens live.
+        :param iterable_with_token_ids: The IDs of the tokens to resync.
+        :param on_token_done: If given, a callable that is called (from the sending threads) with the
+          token id and its outcome ('accepted' or 'rejected') as soon as each token is settled.
+        :return: A report (dict) with the number of tokens whose resync was accepted, the number that
+          were rejected, the number of retries that were needed, and the list of rejected token ids.
+        """
+        self.report = {'accepted': 0, 'rejected': 0, 'retried': 0, 'rejected_token_ids': []}
+        list_token_ids = list(dict.fromkeys(iterable_with_token_ids))
+
+        with ThreadPoolExecutor(max_workers=self.burst_size) as executor:
+            # list() makes sure every request has finished (and re-raises any unexpected error.)
+            list(executor.map(lambda token_id: self.__resync_one_token(contract_address, token_id, on_token_done),
+                              list_token_ids))
+
+        logging.info(f"Metadata resync requested for {len(list_token_ids)} tokens -> "
+                     f"accepted: {self.report['accepted']}, rejected: {self.report['rejected']}, "
+                     f"retried: {self.report['retried']}")
+        return self.report
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __resync_one_token(self, contract_address: str, token_id, on_token_done=None):
+        path = f"/nft/{contract_address}/{token_id}/metadata/resync"
+        params = {'flag': 'uri', 'mode': 'async'}
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            status_code = None
+            response = None
+            try:
+                response = self.moralis_http.get(path, params=params)
+                status_code = response.status_code
+                self.__update_quota_from_headers(response.headers)
+            except Exception as e:
+                logging.debug(f"Resync request for token -> '{token_id}' raised: {e}")
+
+            if status_code is not None and 200 <= status_code < 300:
+                logging.debug(f"Resync accepted for token -> '{token_id}': {response.text}")
+                self.__count('accepted')
+                if on_token_done is not None:
+                    on_token_done(token_id, 'accepted')
+                return
+
+            # 429 (too many requests), server errors and network errors are worth retrying,
+            # anything else (eg. 400 or 404) means Moralis will not resync this token.
+            if not MoralisHTTP.is_retryable(status_code) or attempt >= self.max_retries:
+                logging.warning(f"Resync rejected for token -> '{token_id}' (status: {status_code})")
+                self.__count('rejected', token_id)
+                if on_token_done is not None:
+                    on_token_done(token_id, 'rejected')
+                return
+
+            attempt += 1
+            self.__count('retried')
+            if self.instrumentation is not None:
+                self.instrumentation.count('retries')
+            if status_code == 429:
+                # Everybody slows down, not just the thread that hit the limit.
+                self.rate_limiter.drain()
+            backoff = MoralisHTTP.backoff_seconds(attempt, response if status_code is not None else None,
+                                                  self.max_backoff_seconds)
+            time.sleep(backoff)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __update_quota_from_headers(self, headers):
+        """
+        Moralis (and most other APIs) report the request quota and the length of the quota window
+        in the response headers. When they are present the token bucket is resized to match.
+        """
+        limit = headers.get('x-rate-limit-limit', headers.get('X-RateLimit-Limit'))
+        if limit is None:
+            return
+        window_seconds = self.__quota_window_seconds(headers)
+        try:
+            limit = float(limit)
+        except ValueError:
+            return
+        if limit <= 0 or window_seconds is None:
+            return
+
+        quota = (limit, window_seconds)
+        with self._lock:
+            if quota == self._quota_from_headers:
+                return
+            self._quota_from_headers = quota
+        self.rate_limiter.set_rate(limit / window_seconds, capacity=min(limit, self.burst_size))
+        logging.debug(f"Resync quota updated from response headers -> {limit} requests per {window_seconds}s")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __quota_window_seconds(self, headers):
+        """
+        The length of the quota window, from the time-to-live that Moralis reports (in seconds.) Some
+        APIs only send X-RateLimit-Reset, which is usually the time (since the epoch) at which the
+        window resets, rather than a length, so the time left until then is used instead. Either
+        way, the window is kept between min_quota_window_seconds and max_quota_window_seconds, so
+        that an odd header can't bring the bucket to a (near) standstill.
+        :return: The length of the window in seconds, or None if the headers don't say.
+        """
+        window_seconds = headers.get('x-rate-limit-remaining-ttl')
+        reset = headers.get('X-RateLimit-Reset')
+        try:
+            if window_seconds is not None:
+                window_seconds = float(window_seconds)
+            elif reset is not None:
+                window_seconds = float(reset)
+                if window_seconds > self.epoch_threshold_seconds:
+                    # Rounded, so that the bucket is not resized by every response of the same window.
+                    window_seconds = float(round(window_seconds - time.time()))
+            else:
+                window_seconds = 1.0
+        except ValueError:
+            return None
+        return min(max(window_seconds, self.min_quota_window_seconds), self.max_quota_window_seconds)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __count(self, outcome: str, token_id=None):
+        with self._lock:
+            self.report[outcome] += 1
+            if token_id is not None:
+                self.report['rejected_token_ids'].append(token_id)
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,165 @@
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+import pandas as pd
+import requests
+from class_token_bucket import TokenBucket
+
+
+class OpenseaHTMLPropertiesExtractor:
+    """This class gets the extra properties of NFTs (the ones SeleniumOnOpensea scrapes from the
+    rendered item page) without a browser: it downloads the raw HTML of the item page and parses
+    the JSON payload that OpenSea embeds in it, which is what the page is rendered from anyway."""
+
+    default_base_url = "https://opensea.io/assets/ethereum"
+
+    # The embedded payload is a JSON document inside a <script> tag. Next.js pages use the
+    # '__NEXT_DATA__' id, but any script of type application/json is parsed.
+    regex_json_scripts = re.compile(
+        r'<script[^>]*type="application/json"[^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+
+    # The keys under which a trait's name and its maximum value may appear in the payload.
+    keys_trait_type = ('traitType', 'trait_type')
+    keys_max_value = ('maxValue', 'max_value')
+
+    def __init__(self,
+                 contract_address: str,
+                 base_url: str = None,
+                 max_requests_in_flight: int = 4,
+                 requests_per_second: float = 2.0,
+                 timeout_seconds=30,
+                 session: requests.Session = None,
+                 instrumentation=None):
+        """
+        Initialize the OpenseaHTMLPropertiesExtractor class.
+        :param contract_address: The contract in which the NFTs live.
+        :param base_url: The url that item pages live under. If not provided, it is read from the
+          OPENSEA_WEB_URL environment variable, and if that isn't set either, the public OpenSea
+          site is used.
+        :param max_requests_in_flight: How many pages may be downloading at the same time.
+        :param requests_per_second: How many pages may be requested per second, so OpenSea
+          doesn't start to block us.
+        :param timeout_seconds: How long to wait for a page before giving up on it (either seconds,
+          or a (connect, read) tuple of seconds.)
+        :param session: A requests session to download the pages with (eg. the session of a
+          PooledHTTPClient shared by the whole run.) If not provided, one is created.
+        :param instrumentation: If given (a RunInstrumentation), every page download is counted with it.
+        """
+        self.contract_address = contract_address
+        self.base_url = (base_url if base_url else getenv('OPENSEA_WEB_URL', self.default_base_url)).rstrip('/')
+        self.max_requests_in_flight = max(1, int(max_requests_in_flight))
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=self.max_requests_in_flight)
+        self.timeout_seconds = timeout_seconds
+        self.session = session if session is not None else requests.Session()
+        self.instrumentation = instrumentation
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_many_nfts_properties(self, iterable_with_token_ids, on_token_done=None) -> pd.DataFrame:
+        """
+        Browserless equivalent of SeleniumOnOpensea.get_many_nfts_properties.
+        :param iterable_with_token_ids: The IDs of the tokens to get properties for.
+        :param on_token_done: If given, a callable that is called (from the downloading threads) with
+          the token id and the list of its rows as soon as each page has been extracted.
+        :return: A dataframe with a 'token_id' column, and a column per property. Numeric properties
+          are given as 'X of Y' strings, the same way they appear on the OpenSea website.
+        """
+        list_token_ids = list(dict.fromkeys(iterable_with_token_ids))
+
+        def get_and_report(token_id):
+            row = self.get_nft_properties(token_id)
+            if row is not None and on_token_done is not None:
+                on_token_done(token_id, [row])
+            return row
+
+        with ThreadPoolExecutor(max_workers=self.max_requests_in_flight) as executor:
+            list_rows = list(executor.map(get_and_report, list_token_ids))
+        list_rows = [row for row in list_rows if row is not None]
+        logging.info(f"Extracted properties for {len(list_rows)} of {len(list_token_ids)} tokens from item pages.")
+        return pd.DataFrame(list_rows)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_properties(self, token_id) -> dict:
+        """
+        Download the item page of a token and extract its properties.
+        :return: A dict with the token_id and its properties, or None if the page couldn't be fetched.
+        """
+        url = f"{self.base_url}/{self.contract_address}/{token_id}"
+        self.rate_limiter.acquire()
+        try:
+            response = self.session.get(url, timeout=self.timeout_seconds,
+                                        headers={'accept': 'text/html', 'user-agent': 'Mozilla/5.0'})
+        except requests.RequestException as e:
+            logging.warning(f"Failed to download the item page of token -> '{token_id}': {e}")
+            if self.instrumentation is not None:
+                self.instrumentation.record_call('opensea', failed=True)
+            return None
+        if self.instrumentation is not None:
+            self.instrumentation.record_response(response, 'opensea')
+        if response.status_code != 200:
+            logging.warning(f"Item page of token -> '{token_id}' returned status {response.status_code}")
+            return None
+
+        dict_properties = self.extract_properties_from_html(response.text)
+        if not dict_properties:
+            logging.debug(f"No properties found in the item page of token -> '{token_id}'")
+        dict_row = {'token_id': token_id}
+        dict_row.update(dict_properties)
+        return dict_row
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def extract_properties_from_html(cls, html: str) -> dict:
+        """
+        Parse the JSON that is embedded in an OpenSea item page, and pull the properties out of it.
+        This method does not touch the network, so it can be used directly on saved pages.
+        :param html: The raw HTML of an item page.
+        :return: A dict of property name -> value.
+        """
+        dict_properties = {}
+        for json_text in cls.regex_json_scripts.findall(html):
+            try:
+                payload = json.loads(json_text)
+            except json.JSONDecodeError:
+                continue
+            for trait in cls.__find_traits(payload):
+                dict_properties.update(trait)
+        return dict_properties
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def __find_traits(cls, node):
+        """
+        Walk the payload and yield a {name: value} dict for every object in it that looks like a
+        trait (ie. has a trait type and a value.) The structure of the payload changes from time to
+        time, so rather than following a fixed path, any object of that shape is accepted.
+        """
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, dict):
+                trait_type = next((current[key] for key in cls.keys_trait_type if key in current), None)
+                if isinstance(trait_type, str) and current.get('value') is not None:
+                    value = current['value']
+                    max_value = next((current[key] for key in cls.keys_max_value
+                                      if current.get(key) is not None), None)
+                    if max_value is not None and not isinstance(value, bool) and isinstance(value, (int, float, str)):
+                        # Numeric properties are shown as 'X of Y' on the website (and that is the
+                        # format that the Selenium scraper returns too.)
+                        yield {trait_type: f"{cls.__format_number(value)} of {cls.__format_number(max_value)}"}
+                    else:
+                        yield {trait_type: value}
+                    continue
+                stack.extend(reversed(list(current.values())))
+            elif isinstance(current, list):
+                # reversed() so that traits are found in the order in which they appear in the page.
+                stack.extend(reversed(current))
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __format_number(value) -> str:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+    # ------------------------ END FUNCTION ------------------------ #
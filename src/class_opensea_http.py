@@ -0,0 +1,100 @@
+import logging
+import time
+from os import getenv
+import requests
+from class_moralis_http import MoralisHTTP
+
+
+class OpenseaHTTP:
+    """A thin wrapper around OpenSea's metadata API, which serves (without an API key) the tokenURI
+    of the tokens of the OpenSea Storefront contract. It is used for the tokens that OpenSea knows
+    about but Moralis doesn't (see AffeDataGetter.get_manual_opensea_additions), with the requests
+    sent through a session that can be shared with the rest of the run."""
+
+    default_base_url = "https://api.opensea.io/api/v1"
+
+    def __init__(self,
+                 base_url: str = None,
+                 timeout_seconds=30,
+                 max_retries: int = 3,
+                 max_backoff_seconds: float = 30,
+                 session: requests.Session = None,
+                 instrumentation=None):
+        """
+        Initialize the OpenseaHTTP class.
+        :param base_url: The root of the API. If not provided, it is read from the OPENSEA_API_URL
+          environment variable, and if that isn't set either, the public OpenSea API is used.
+        :param timeout_seconds: How long to wait for the API before giving up on a request (either
+          seconds, or a (connect, read) tuple of seconds.)
+        :param max_retries: How many times a request that failed with a 429, a server error or a
+          network error is retried (with the backoff of MoralisHTTP.backoff_seconds.)
+        :param max_backoff_seconds: The longest time to wait before a retry.
+        :param session: A requests session to send the requests through (eg. the session of a
+          PooledHTTPClient shared by the whole run.) If not provided, one is created.
+        :param instrumentation: If given (a RunInstrumentation), every request is counted with it.
+        """
+        self.base_url = (base_url if base_url else getenv('OPENSEA_API_URL', self.default_base_url)).rstrip('/')
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max(0, int(max_retries))
+        self.max_backoff_seconds = max_backoff_seconds
+        # A session that was handed in belongs to whoever created it, and is not closed by close().
+        self._owns_session = session is None
+        self.session = session if session is not None else requests.Session()
+        self.instrumentation = instrumentation
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_token_metadata(self, contract_address: str, token_id) -> dict:
+        """
+        Get the metadata (name, description, image, external_link, etc.) of a token.
+        :return: The metadata (dict) with the token_id added to it, or None if it couldn't be fetched.
+        """
+        url = f"{self.base_url}/metadata/{contract_address}/{token_id}"
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.get(url, timeout=self.timeout_seconds, headers={'accept': 'application/json'})
+            except requests.RequestException as e:
+                logging.debug(f"Request for the OpenSea metadata of token -> '{token_id}' raised: {e}")
+                if self.instrumentation is not None:
+                    self.instrumentation.record_call('opensea', failed=True)
+            if response is not None and self.instrumentation is not None:
+                self.instrumentation.record_response(response, 'opensea')
+            status_code = response.status_code if response is not None else None
+            if status_code == 200:
+                break
+            if not MoralisHTTP.is_retryable(status_code) or attempt >= self.max_retries:
+                logging.warning(f"Failed to get the OpenSea metadata of token -> '{token_id}' (status: {status_code})")
+                return None
+            attempt += 1
+            if self.instrumentation is not None:
+                self.instrumentation.count('retries')
+            time.sleep(MoralisHTTP.backoff_seconds(attempt, response, self.max_backoff_seconds))
+        try:
+            dict_metadata = response.json()
+        except ValueError:
+            logging.warning(f"OpenSea metadata of token -> '{token_id}' is not valid JSON.")
+            return None
+        if not isinstance(dict_metadata, dict):
+            return None
+        dict_metadata['token_id'] = str(token_id)
+        return dict_metadata
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_many_nft_tokens_metadata(self, contract_address: str, iterable_with_token_ids) -> list:
+        """
+        :return: A list with the metadata (see get_nft_token_metadata) of every token that could be
+          fetched.
+        """
+        list_tokens = []
+        for token_id in iterable_with_token_ids:
+            dict_metadata = self.get_nft_token_metadata(contract_address, token_id)
+            if dict_metadata is not None:
+                list_tokens.append(dict_metadata)
+        return list_tokens
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+    # ------------------------ END FUNCTION ------------------------ #
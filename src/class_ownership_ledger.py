@@ -0,0 +1,238 @@
+import logging
+from bisect import bisect_right
+import numpy as np
+import pandas as pd
+
+
+class OwnershipLedger:
+    """This class keeps the ownership history of tokens, built from transfer rows as returned by
+    Moralis (eg. the output of MoralisAPIinteractions.get_nft_transfers.) For every token it keeps
+    the list of transfers sorted by block, and who held how many of it after each one, so that
+    'who owned token X at block B' and 'what did address A hold at block B' are binary searches
+    rather than scans of the transfer history. ERC1155 tokens can be held by several addresses at
+    once, which is why holders are always returned with the amount they hold."""
+
+    # Tokens are minted from, and burned to, this address; it is never reported as a holder.
+    zero_address = '0x0000000000000000000000000000000000000000'
+
+    def __init__(self, contract_address: str = None):
+        """
+        Initialize the OwnershipLedger class.
+        :param contract_address: If given, transfers of tokens in other contracts are ignored.
+        """
+        self.contract_address = contract_address.lower() if contract_address else None
+        # token id -> list of transfers, each one a tuple of (order, from, to, amount, transaction
+        # hash), sorted by order. The order is (block number, transaction index, log index) so that several
+        # transfers of the same token within one block are applied in the right sequence.
+        self.dict_transfers = {}
+        # token id -> (blocks, holders): holders[i] is the dict of address -> amount right after
+        # the transfer at blocks[i].
+        self.dict_timelines = {}
+        # address -> token id -> (blocks, amounts): how many of the token the address held right
+        # after each transfer that changed it.
+        self.dict_address_timelines = {}
+        # token id -> the addresses that ever held it (ie. where it is in dict_address_timelines.)
+        self.dict_token_addresses = {}
+        # The transfers already in the ledger, so that the same transfer is never applied twice
+        # (eg. when a download starts again from the last block seen.)
+        self.set_transfer_keys = set()
+        self.last_block = None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def from_transfers(cls, df_transfers: pd.DataFrame, contract_address: str = None):
+        """Build a ledger from a dataframe of transfers."""
+        ledger = cls(contract_address)
+        ledger.add_transfers(df_transfers)
+        return ledger
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def add_transfers(self, df_transfers: pd.DataFrame) -> int:
+        """
+        Add transfers to the ledger. They can be in any order, and can overlap with transfers that
+        were already added (those are skipped.) Only the timelines of the tokens that the new
+        transfers touch are rebuilt.
+        :param df_transfers: Transfer rows with at least token_id, from_address, to_address and
+          block_number. amount (for ERC1155), transaction_index, log_index, transfer_index,
+          transaction_hash and token_address are used when present.
+        :return: The number of transfers that were new.
+        """
+        if df_transfers.empty:
+            return 0
+        df = df_transfers
+        if self.contract_address and 'token_address' in df.columns:
+            df = df[df['token_address'].str.lower() == self.contract_address]
+        block_numbers = pd.to_numeric(df['block_number'], errors='coerce')
+        df = df[block_numbers.notna()]
+        if df.empty:
+            return 0
+
+        # Everything that the ledger needs from each row, worked out for all rows at once.
+        blocks = pd.to_numeric(df['block_number']).astype('int64').to_numpy()
+        transaction_indexes, log_indexes = self.__indexes_within_block(df)
+        amounts = pd.to_numeric(df['amount'], errors='coerce').fillna(1).astype('int64').to_numpy() \
+            if 'amount' in df.columns else np.ones(len(df), dtype=np.int64)
+        token_ids = df['token_id'].astype(str).to_numpy()
+        from_addresses = df['from_address'].fillna(self.zero_address).str.lower().to_numpy()
+        to_addresses = df['to_address'].fillna(self.zero_address).str.lower().to_numpy()
+        hashes = df['transaction_hash'].astype(str).to_numpy() if 'transaction_hash' in df.columns \
+            else np.full(len(df), '', dtype=object)
+
+        set_touched_tokens = set()
+        num_new = 0
+        for token_id, block, transaction_index, log_index, from_address, to_address, amount, tx_hash \
+                in zip(token_ids, blocks.tolist(), transaction_indexes.tolist(), log_indexes.tolist(),
+                       from_addresses, to_addresses, amounts.tolist(), hashes):
+            order = (block, transaction_index, log_index)
+            transfer_key = (tx_hash, order, token_id, from_address, to_address)
+            if transfer_key in self.set_transfer_keys:
+                continue
+            self.set_transfer_keys.add(transfer_key)
+            self.dict_transfers.setdefault(token_id, []).append((order, from_address, to_address, amount, tx_hash))
+            set_touched_tokens.add(token_id)
+            num_new += 1
+
+        for token_id in set_touched_tokens:
+            self.__rebuild_token(token_id)
+        max_block = int(blocks.max())
+        self.last_block = max_block if self.last_block is None else max(self.last_block, max_block)
+        logging.debug(f"Ownership ledger: {num_new} new transfers, {len(set_touched_tokens)} tokens updated.")
+        return num_new
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def transfers(self) -> pd.DataFrame:
+        """
+        Every transfer in the ledger, as a dataframe that from_transfers (or add_transfers) takes
+        back, so the ledger can be saved as a table and loaded again without downloading anything.
+        :return: A dataframe with the columns of TableStorage.list_ownership_columns, sorted by token
+          and by order within the token.
+        """
+        list_rows = [(self.contract_address, token_id, from_address, to_address, amount, *order, tx_hash)
+                     for token_id, list_transfers in self.dict_transfers.items()
+                     for order, from_address, to_address, amount, tx_hash in list_transfers]
+        return pd.DataFrame(list_rows, columns=['token_address', 'token_id', 'from_address', 'to_address', 'amount',
+                                                'block_number', 'transaction_index', 'log_index', 'transaction_hash'])
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def last_block_of(self, token_id):
+        """The block of the latest transfer of a token in the ledger (None if it has none.)"""
+        timeline = self.dict_timelines.get(str(token_id))
+        return timeline[0][-1] if timeline and timeline[0] else None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def owners_of(self, token_id, block: int = None) -> dict:
+        """
+        Who held a token at the end of a block.
+        :param block: If not given, the latest state known to the ledger.
+        :return: A dict of address -> amount held (empty if nobody held the token at that block.)
+        """
+        timeline = self.dict_timelines.get(str(token_id))
+        if timeline is None:
+            return {}
+        blocks, list_holders = timeline
+        position = len(blocks) if block is None else bisect_right(blocks, block)
+        return dict(list_holders[position - 1]) if position else {}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def holdings_of(self, address: str, block: int = None) -> dict:
+        """
+        What an address held at the end of a block.
+        :param block: If not given, the latest state known to the ledger.
+        :return: A dict of token id -> amount held, only for the tokens held at that block.
+        """
+        dict_holdings = {}
+        for token_id, (blocks, amounts) in self.dict_address_timelines.get(address.lower(), {}).items():
+            position = len(blocks) if block is None else bisect_right(blocks, block)
+            if position and amounts[position - 1] > 0:
+                dict_holdings[token_id] = amounts[position - 1]
+        return dict_holdings
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def intervals(self, token_id=None) -> pd.DataFrame:
+        """
+        The ownership history as intervals of blocks.
+        :param token_id: If given, only the intervals of this token.
+        :return: A dataframe with the columns token_id, owner, amount, from_block and to_block,
+          sorted by token and block. to_block is the block in which the holding ended (it is missing
+          for holdings that have not ended.)
+        """
+        list_token_ids = [str(token_id)] if token_id is not None else list(self.dict_timelines)
+        list_rows = []
+        for one_token_id in list_token_ids:
+            blocks, list_holders = self.dict_timelines.get(one_token_id, ([], []))
+            dict_open = {}
+            for block, dict_holders in zip(blocks, list_holders):
+                # A holding ends when the address no longer holds the token, or holds a different
+                # amount of it (in which case a new interval starts in the same block.)
+                for owner, (amount, from_block) in list(dict_open.items()):
+                    if dict_holders.get(owner) != amount:
+                        list_rows.append((one_token_id, owner, amount, from_block, block))
+                        del dict_open[owner]
+                for owner, amount in dict_holders.items():
+                    if owner not in dict_open:
+                        dict_open[owner] = (amount, block)
+            for owner, (amount, from_block) in dict_open.items():
+                list_rows.append((one_token_id, owner, amount, from_block, None))
+        df = pd.DataFrame(list_rows, columns=['token_id', 'owner', 'amount', 'from_block', 'to_block'])
+        df['to_block'] = df['to_block'].astype('Int64')
+        return df.sort_values(['token_id', 'from_block'], kind='stable', ignore_index=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __rebuild_token(self, token_id: str):
+        """Sort the transfers of a token and rebuild its timeline, and the timelines of its holders."""
+        list_transfers = self.dict_transfers[token_id]
+        list_transfers.sort(key=lambda transfer: transfer[0])
+        # The token is removed from every address it was in, as the new transfers may have been
+        # older than some of the ones already applied.
+        for address in self.dict_token_addresses.pop(token_id, ()):
+            self.dict_address_timelines[address].pop(token_id, None)
+        set_addresses = set()
+
+        blocks = []
+        list_holders = []
+        dict_holders = {}
+        for order, from_address, to_address, amount, _ in list_transfers:
+            dict_changed = {}
+            if from_address != self.zero_address:
+                dict_changed[from_address] = dict_holders.get(from_address, 0) - amount
+            if to_address != self.zero_address:
+                dict_changed[to_address] = dict_changed.get(to_address, dict_holders.get(to_address, 0)) + amount
+            for address, balance in dict_changed.items():
+                if balance < 0:
+                    # This happens when the history does not go back far enough (eg. transfers that
+                    # were filtered on the sender only); the address is treated as holding nothing.
+                    logging.debug(f"Token {token_id}: {address} would hold {balance} at block {order[0]}.")
+                    balance = 0
+                if balance:
+                    dict_holders[address] = balance
+                else:
+                    dict_holders.pop(address, None)
+                address_blocks, address_amounts = self.dict_address_timelines.setdefault(address, {})\
+                    .setdefault(token_id, ([], []))
+                address_blocks.append(order[0])
+                address_amounts.append(balance)
+                set_addresses.add(address)
+            blocks.append(order[0])
+            list_holders.append(dict(dict_holders))
+        self.dict_timelines[token_id] = (blocks, list_holders)
+        self.dict_token_addresses[token_id] = set_addresses
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __indexes_within_block(df: pd.DataFrame):
+        """
+        The transaction index and log index of every transfer, which order transfers within a block.
+        They are taken from their own columns if there are any, or else from transfer_index (which
+        Moralis returns as [block number, transaction index, log index, ...].)
+        """
+        def column_or_zeros(series: pd.Series) -> np.ndarray:
+            return pd.to_numeric(series, errors='coerce').fillna(0).astype('int64').to_numpy()
+
+        if 'transaction_index' in df.columns and 'log_index' in df.columns:
+            return column_or_zeros(df['transaction_index']), column_or_zeros(df['log_index'])
+        if 'transfer_index' in df.columns:
+            parts = df['transfer_index'].astype(str).str.findall(r'\d+')
+            return column_or_zeros(parts.str[1]), column_or_zeros(parts.str[2])
+        zeros = np.zeros(len(df), dtype=np.int64)
+        return zeros, zeros
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,115 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class PooledHTTPClient:
+    """A long-lived HTTP client for one API: a requests session whose connections are kept alive
+    and pooled, so that the stages of a run (and the threads within a stage) reuse connections that
+    are already open, rather than paying for a new TCP (and TLS) handshake every time. It counts how
+    many connections it had to open, and how many requests went over a connection that was reused.
+
+    The client is meant to be created once (eg. by AffeDataGetter) and handed to every class that
+    talks to the same API, and to be closed explicitly once the run is over."""
+
+    def __init__(self,
+                 name: str,
+                 pool_size: int = 16,
+                 num_hosts: int = 4,
+                 connect_timeout_seconds: float = 10,
+                 read_timeout_seconds: float = 30,
+                 block_when_pool_is_full: bool = False):
+        """
+        Initialize the PooledHTTPClient class.
+        :param name: The name of the API (eg. 'moralis'), used in reports.
+        :param pool_size: How many connections are kept open per host. It should be at least the
+          number of threads that send requests at the same time; connections opened beyond it are
+          closed as soon as their request is done (so the next request opens a new one.)
+        :param num_hosts: How many hosts connections are pooled for.
+        :param connect_timeout_seconds: How long to wait for a connection to be established.
+        :param read_timeout_seconds: How long to wait for the server to send data.
+        :param block_when_pool_is_full: Whether a thread waits for a pooled connection to be free,
+          rather than opening an extra one, when all of them are in use.
+        """
+        self.name = name
+        self.pool_size = max(1, int(pool_size))
+        # requests accepts a (connect, read) tuple wherever it accepts a timeout.
+        self.timeout = (connect_timeout_seconds, read_timeout_seconds)
+        self._lock = threading.Lock()
+        self.dict_counts = {'requests': 0, 'connections_opened': 0}
+        self.session = requests.Session()
+        adapter = _CountingHTTPAdapter(self.__count,
+                                       pool_connections=max(1, int(num_hosts)),
+                                       pool_maxsize=self.pool_size,
+                                       pool_block=block_when_pool_is_full)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __enter__(self):
+        return self
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @property
+    def stats(self) -> dict:
+        """How many requests were sent, how many connections were opened for them, and how many
+        requests were sent over a connection that was already open."""
+        with self._lock:
+            num_requests = self.dict_counts['requests']
+            num_opened = self.dict_counts['connections_opened']
+        return {'pool_size': self.pool_size,
+                'timeout_seconds': list(self.timeout),
+                'requests': num_requests,
+                'connections_opened': num_opened,
+                'connections_reused': max(0, num_requests - num_opened)}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def close(self):
+        """Close every pooled connection. The client can still be used afterwards (new connections
+        are opened as needed.)"""
+        self.session.close()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __count(self, counter: str):
+        with self._lock:
+            self.dict_counts[counter] += 1
+    # ------------------------ END FUNCTION ------------------------ #
+
+
+class _CountingPoolMixin:
+    """Counts the requests a urllib3 connection pool sends, and the connections it opens."""
+
+    count = None
+
+    def _new_conn(self):
+        self.count('connections_opened')
+        return super()._new_conn()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def urlopen(self, *args, **kwargs):
+        self.count('requests')
+        return super().urlopen(*args, **kwargs)
+    # ------------------------ END FUNCTION ------------------------ #
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    """A requests adapter whose connection pools report to a PooledHTTPClient."""
+
+    def __init__(self, count, **kwargs):
+        # Set before HTTPAdapter.__init__, as that is what calls init_poolmanager.
+        self._count = count
+        super().__init__(**kwargs)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        count = staticmethod(self._count)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CountingHTTPConnectionPool', (_CountingPoolMixin, HTTPConnectionPool), {'count': count}),
+            'https': type('CountingHTTPSConnectionPool', (_CountingPoolMixin, HTTPSConnectionPool), {'count': count})}
+    # ------------------------ END FUNCTION ------------------------ #
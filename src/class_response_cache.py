@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from os import makedirs
+from os.path import exists
+from pathlib import Path
+
+
+class ResponseCache:
+    """A persistent, content-addressed cache of per-token API responses. Entries are looked up by
+    (namespace, contract, token_id), and remember the sync markers ('token_hash' and
+    'last_metadata_sync') that Moralis reported for the token when they were stored, so a lookup
+    that knows the current markers only hits when the token has not changed since."""
+
+    # The fields that Moralis returns for each token that tell us whether the token has changed.
+    sync_marker_fields = ('token_hash', 'last_metadata_sync')
+
+    def __init__(self,
+                 full_path_to_cache_dir: Path,
+                 ttl_seconds: float = 7 * 24 * 3600,
+                 max_size_bytes: int = 512 * 1024 * 1024,
+                 enabled: bool = True):
+        """
+        Initialize the ResponseCache class.
+        :param full_path_to_cache_dir: The directory where the cache lives. It is created if needed.
+        :param ttl_seconds: Entries older than this are treated as missing (and evicted on save.)
+        :param max_size_bytes: When the cache grows beyond this size, the oldest entries are evicted.
+        :param enabled: Set to False to bypass the cache completely; every lookup is then a miss, and
+          nothing is stored.
+        """
+        self.fullpath_dir_cache = full_path_to_cache_dir
+        self.fullpath_dir_objects = full_path_to_cache_dir / 'objects'
+        self.fullpath_index = full_path_to_cache_dir / 'index.json'
+        self.ttl_seconds = ttl_seconds
+        self.max_size_bytes = max_size_bytes
+        self.enabled = enabled
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self.dict_index = {}
+
+        if self.enabled:
+            if not exists(self.fullpath_dir_objects):
+                makedirs(self.fullpath_dir_objects)
+            if exists(self.fullpath_index):
+                try:
+                    with open(self.fullpath_index, mode='r') as f:
+                        self.dict_index = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logging.warning(f"Could not read the response cache index, starting with an empty cache: {e}")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @classmethod
+    def sync_markers_from_record(cls, record: dict) -> dict:
+        """
+        Extract the sync markers from a record (eg. a row of the Moralis metadata.) Markers that are
+        missing or NaN are left out.
+        """
+        dict_markers = {}
+        for field in cls.sync_marker_fields:
+            value = record.get(field)
+            # NaN is the only value that is not equal to itself.
+            if value is not None and value == value:
+                dict_markers[field] = str(value)
+        return dict_markers
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get(self, namespace: str, contract_address: str, token_id, current_markers: dict = None):
+        """
+        Look up the response stored for a token.
+        :param current_markers: If given, the entry is only returned when the markers it was stored
+          with are the same as these (ie. the token has not changed since it was cached.)
+        :return: The cached value, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        entry_name = self.__entry_name(namespace, contract_address, token_id)
+        with self._lock:
+            entry = self.dict_index.get(entry_name)
+        if (entry is None
+                or time.time() - entry['stored_at'] > self.ttl_seconds
+                or (current_markers is not None and current_markers != entry['markers'])):
+            self.__count('misses')
+            return None
+        try:
+            with open(self.__object_path(entry['key']), mode='r') as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.__count('misses')
+            return None
+        self.__count('hits')
+        return value
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def put(self, namespace: str, contract_address: str, token_id, value, markers: dict = None):
+        """
+        Store the response for a token. The object is saved under a hash of its identity, its
+        markers and its content, so identical responses are only stored once.
+        """
+        if not self.enabled:
+            return
+        markers = markers if markers else {}
+        serialized = json.dumps(value, sort_keys=True, default=str)
+        key = hashlib.sha256(json.dumps([namespace, contract_address, str(token_id), markers, serialized],
+                                        sort_keys=True).encode('utf-8')).hexdigest()
+        fullpath_object = self.__object_path(key)
+        if not exists(fullpath_object):
+            makedirs(fullpath_object.parent, exist_ok=True)
+            self.__write_atomically(fullpath_object, serialized)
+        entry_name = self.__entry_name(namespace, contract_address, token_id)
+        with self._lock:
+            self.dict_index[entry_name] = {'key': key,
+                                           'markers': markers,
+                                           'stored_at': time.time(),
+                                           'size': len(serialized)}
+            self.stats['stores'] += 1
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def invalidate(self, namespace: str, contract_address: str, iterable_with_token_ids):
+        """Forget the entries of some tokens, so the next lookup for them is a miss."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for token_id in iterable_with_token_ids:
+                self.dict_index.pop(self.__entry_name(namespace, contract_address, token_id), None)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def save(self):
+        """
+        Evict expired entries, then the oldest entries until the cache fits in its maximum size,
+        delete the objects that no entry refers to any more, and write the index to disk.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.time()
+            for entry_name in [name for name, entry in self.dict_index.items()
+                               if now - entry['stored_at'] > self.ttl_seconds]:
+                self.dict_index.pop(entry_name)
+                self.stats['evictions'] += 1
+
+            # The same object may be shared by several entries, so sizes are counted per object.
+            dict_object_sizes = {entry['key']: entry['size'] for entry in self.dict_index.values()}
+            total_size = sum(dict_object_sizes.values())
+            list_oldest_first = sorted(self.dict_index.items(), key=lambda item: item[1]['stored_at'])
+            for entry_name, entry in list_oldest_first:
+                if total_size <= self.max_size_bytes:
+                    break
+                self.dict_index.pop(entry_name)
+                self.stats['evictions'] += 1
+                if not any(other['key'] == entry['key'] for other in self.dict_index.values()):
+                    total_size -= dict_object_sizes.pop(entry['key'], 0)
+
+            set_live_keys = {entry['key'] for entry in self.dict_index.values()}
+            index_serialized = json.dumps(self.dict_index)
+
+        for fullpath_object in self.fullpath_dir_objects.glob('*/*.json'):
+            if fullpath_object.stem not in set_live_keys:
+                fullpath_object.unlink(missing_ok=True)
+        self.__write_atomically(self.fullpath_index, index_serialized)
+        logging.info(f"Response cache -> {self.stats}")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __object_path(self, key: str) -> Path:
+        return self.fullpath_dir_objects / key[:2] / (key + '.json')
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __entry_name(namespace: str, contract_address: str, token_id) -> str:
+        return f"{namespace}|{contract_address.lower()}|{token_id}"
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __write_atomically(fullpath_file: Path, text: str):
+        fullpath_tmp = fullpath_file.with_name(fullpath_file.name + f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(fullpath_tmp, mode='w') as f:
+            f.write(text)
+        os.replace(fullpath_tmp, fullpath_file)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __count(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] += 1
+    # ------------------------ END FUNCTION ------------------------ #
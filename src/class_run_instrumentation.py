@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    # Only available on unix-like systems; without it the peak memory of the process is not known.
+    import resource
+except ImportError:
+    resource = None
+
+
+class RunInstrumentation:
+    """This class records where the time of a run of the pipeline goes. Each stage is wrapped in
+    the stage() context manager, which times it and tracks how much memory the process peaked at
+    while it ran, and the API clients (and the table storage) add to counters of the stage that is
+    running: HTTP calls, retries, bytes downloaded, rows read and rows written. At the end of the
+    run everything is written to a JSON report, and optionally to a Prometheus textfile (the format
+    read by the textfile collector of node_exporter.)"""
+
+    # The counters every stage has (even when they stay at zero), in the order they are reported.
+    counter_names = ['http_calls', 'http_errors', 'retries', 'bytes_downloaded', 'rows_in', 'rows_out']
+
+    # Counters added while no stage is running (eg. a client used on its own) go to this stage.
+    name_outside_stages = '(outside stages)'
+
+    # The prefix of every metric in the Prometheus textfile.
+    metric_prefix = 'affe_pipeline'
+
+    def __init__(self, trace_python_allocations: bool = False, memory_sample_seconds: float = 0.05):
+        """
+        Initialize the RunInstrumentation class.
+        :param trace_python_allocations: Whether the peak of the memory allocated by python is
+          measured too (with tracemalloc.) It is more precise than the memory of the process, but
+          it slows python down a lot, so it is off by default.
+        :param memory_sample_seconds: How often the memory of the process is sampled while a stage
+          runs. The memory is read from /proc/self/statm, so this only works on Linux; elsewhere,
+          the peak of the whole process so far is reported instead.
+        """
+        self.trace_python_allocations = trace_python_allocations
+        self.memory_sample_seconds = memory_sample_seconds
+        self.started = datetime.now(timezone.utc)
+        self._start_perf_counter = time.perf_counter()
+        self._lock = threading.Lock()
+        # stage name -> dict with the measurements and the counters of the stage, in the order the
+        # stages were first seen.
+        self.dict_stages = {}
+        self.current_stage_name = None
+        self.outcome = 'ok'
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure a stage. Everything that is counted while the 'with' block runs (in any thread) is
+        counted for this stage. Stages are expected to run one after the other, not at the same time.
+        If the block raises, the stage (and the run) is recorded as failed, and the error is re-raised.
+        """
+        dict_stage = self.__get_stage(name)
+        dict_stage['outcome'] = 'running'
+        dict_stage['started'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        previous_stage_name = self.current_stage_name
+        self.current_stage_name = name
+
+        sampler = _MemorySampler(self.memory_sample_seconds)
+        sampler.start()
+        if self.trace_python_allocations:
+            tracemalloc.start()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield dict_stage
+            dict_stage['outcome'] = 'ran'
+        except BaseException:
+            dict_stage['outcome'] = 'failed'
+            self.outcome = 'failed'
+            raise
+        finally:
+            dict_stage['seconds'] += time.perf_counter() - start_wall
+            dict_stage['cpu_seconds'] += time.process_time() - start_cpu
+            if self.trace_python_allocations:
+                _, peak_traced = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                dict_stage['peak_traced_memory_bytes'] = max(dict_stage['peak_traced_memory_bytes'] or 0,
+                                                             peak_traced)
+            dict_stage['peak_rss_bytes'] = max(dict_stage['peak_rss_bytes'] or 0, sampler.stop())
+            self.current_stage_name = previous_stage_name
+            logging.info(f"Stage '{name}' {dict_stage['outcome']} in {dict_stage['seconds']:.2f} s "
+                         f"({self.__describe_counters(dict_stage['counters'])})")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def skipped(self, name: str):
+        """Record that a stage was not run (eg. because it was up to date.)"""
+        dict_stage = self.__get_stage(name)
+        if dict_stage['outcome'] is None:
+            dict_stage['outcome'] = 'skipped'
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def count(self, counter_name: str, amount: int = 1):
+        """Add to a counter of the stage that is running."""
+        if not amount:
+            return
+        with self._lock:
+            dict_counters = self.__get_stage(self.__stage_to_count_in())['counters']
+            dict_counters[counter_name] = dict_counters.get(counter_name, 0) + amount
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def record_response(self, response, api: str = None):
+        """
+        Count an HTTP response (a requests.Response) of the stage that is running: the call, the
+        size of its body, and its status code. Responses with a status code of 400 or more are also
+        counted as errors.
+        :param api: The name of the API (eg. 'moralis'), so calls can be told apart per API.
+        """
+        status_code = getattr(response, 'status_code', None)
+        # The body has already been downloaded (responses are not streamed in this repo), so its
+        # length is the number of bytes that came over the network, after decompression.
+        num_bytes = len(response.content) if getattr(response, 'content', None) is not None else 0
+        with self._lock:
+            dict_stage = self.__get_stage(self.__stage_to_count_in())
+            dict_counters = dict_stage['counters']
+            dict_counters['http_calls'] += 1
+            dict_counters['bytes_downloaded'] += num_bytes
+            if status_code is None or status_code >= 400:
+                dict_counters['http_errors'] += 1
+            key = str(status_code)
+            dict_stage['responses_by_status'][key] = dict_stage['responses_by_status'].get(key, 0) + 1
+            if api:
+                dict_stage['calls_by_api'][api] = dict_stage['calls_by_api'].get(api, 0) + 1
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def record_call(self, api: str = None, failed: bool = False):
+        """
+        Count a call made through a client that does not expose its HTTP responses (eg. a browser
+        scraping OpenSea), or a request that got no response at all. Its bytes and status code are
+        not known.
+        """
+        with self._lock:
+            dict_stage = self.__get_stage(self.__stage_to_count_in())
+            dict_stage['counters']['http_calls'] += 1
+            if failed:
+                dict_stage['counters']['http_errors'] += 1
+            if api:
+                dict_stage['calls_by_api'][api] = dict_stage['calls_by_api'].get(api, 0) + 1
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def report(self, extra: dict = None) -> dict:
+        """
+        The measurements of the run so far.
+        :param extra: Any other sections to add to the report (eg. the stats of the response cache.)
+        """
+        with self._lock:
+            list_stages = [{'stage': name, **json.loads(json.dumps(dict_stage))}
+                           for name, dict_stage in self.dict_stages.items()]
+        dict_totals = {counter_name: sum(dict_stage['counters'].get(counter_name, 0) for dict_stage in list_stages)
+                       for counter_name in self.counter_names}
+        dict_totals['seconds_in_stages'] = sum(dict_stage['seconds'] for dict_stage in list_stages)
+        report = {'started': self.started.isoformat(timespec='seconds'),
+                  'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                  'seconds': time.perf_counter() - self._start_perf_counter,
+                  'outcome': self.outcome,
+                  'peak_rss_bytes': _MemorySampler.peak_rss_of_process(),
+                  'totals': dict_totals,
+                  'stages': list_stages}
+        if extra:
+            report.update(extra)
+        return report
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def write_report(self, fullpath_report: Path, extra: dict = None) -> dict:
+        """Write the report (see report()) to a JSON file, and return it."""
+        report = self.report(extra)
+        self.__write_atomically(fullpath_report, json.dumps(report, indent=2, default=str))
+        logging.info(f"Run report written to '{fullpath_report}'")
+        return report
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def write_prometheus_textfile(self, fullpath_textfile: Path, report: dict = None):
+        """
+        Write the measurements in the Prometheus text format. The file is replaced atomically, as
+        the textfile collector may read it at any time.
+        :param report: The report to export. If not given, the current one is.
+        """
+        report = report if report is not None else self.report()
+        prefix = self.metric_prefix
+        list_lines = []
+
+        def add_metric(name: str, help_text: str, list_samples: list):
+            list_lines.append(f"# HELP {prefix}_{name} {help_text}")
+            list_lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in list_samples:
+                if value is None:
+                    continue
+                label_text = ','.join(f'{key}="{self.__escape_label(label)}"' for key, label in labels.items())
+                list_lines.append(f"{prefix}_{name}{{{label_text}}} {float(value):g}" if label_text
+                                  else f"{prefix}_{name} {float(value):g}")
+
+        list_stages = report['stages']
+        add_metric('stage_seconds', "Wall-clock time spent in the stage.",
+                   [({'stage': s['stage']}, s['seconds']) for s in list_stages])
+        add_metric('stage_cpu_seconds', "CPU time used by the process while the stage ran.",
+                   [({'stage': s['stage']}, s['cpu_seconds']) for s in list_stages])
+        add_metric('stage_peak_rss_bytes', "Peak resident memory of the process while the stage ran.",
+                   [({'stage': s['stage']}, s['peak_rss_bytes']) for s in list_stages])
+        add_metric('stage_ran', "1 if the stage ran, 0 if it was skipped, -1 if it failed.",
+                   [({'stage': s['stage']}, {'ran': 1, 'skipped': 0, 'failed': -1}.get(s['outcome']))
+                    for s in list_stages])
+        for counter_name in self.counter_names:
+            add_metric(f"stage_{counter_name}", f"The {counter_name.replace('_', ' ')} of the stage.",
+                       [({'stage': s['stage']}, s['counters'].get(counter_name, 0)) for s in list_stages])
+        add_metric('run_seconds', "Wall-clock time of the whole run.", [({}, report['seconds'])])
+        add_metric('run_success', "1 if the run finished without errors.",
+                   [({}, 1 if report['outcome'] == 'ok' else 0)])
+        add_metric('run_finished_timestamp_seconds', "When the run finished (unix time.)",
+                   [({}, datetime.fromisoformat(report['finished']).timestamp())])
+
+        self.__write_atomically(fullpath_textfile, '\n'.join(list_lines) + '\n')
+        logging.info(f"Prometheus metrics written to '{fullpath_textfile}'")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __get_stage(self, name: str) -> dict:
+        if name not in self.dict_stages:
+            self.dict_stages[name] = {'outcome': None,
+                                      'started': None,
+                                      'seconds': 0.0,
+                                      'cpu_seconds': 0.0,
+                                      'peak_rss_bytes': None,
+                                      'peak_traced_memory_bytes': None,
+                                      'counters': {counter_name: 0 for counter_name in self.counter_names},
+                                      'responses_by_status': {},
+                                      'calls_by_api': {}}
+        return self.dict_stages[name]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __stage_to_count_in(self) -> str:
+        return self.current_stage_name if self.current_stage_name is not None else self.name_outside_stages
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __describe_counters(dict_counters: dict) -> str:
+        list_parts = [f"{name.replace('_', ' ')}: {value}" for name, value in dict_counters.items() if value]
+        return ', '.join(list_parts) if list_parts else 'nothing counted'
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __escape_label(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __write_atomically(fullpath_file: Path, text: str):
+        fullpath_file = Path(fullpath_file)
+        fullpath_temporary = fullpath_file.with_name(fullpath_file.name + '.tmp')
+        with open(fullpath_temporary, mode='w') as f:
+            f.write(text)
+        os.replace(fullpath_temporary, fullpath_file)
+    # ------------------------ END FUNCTION ------------------------ #
+
+
+class _MemorySampler:
+    """Samples the resident memory of the process from a background thread, and keeps the peak."""
+
+    fullpath_statm = Path('/proc/self/statm')
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.peak_bytes = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.available = self.fullpath_statm.exists()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def start(self):
+        if not self.available:
+            return
+        self.__sample()
+        self._thread = threading.Thread(target=self.__run, name='memory-sampler', daemon=True)
+        self._thread.start()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def stop(self) -> int:
+        """Stop sampling and return the peak (or the peak of the process so far, if sampling is not possible.)"""
+        if not self.available:
+            return self.peak_rss_of_process()
+        self._stop_event.set()
+        self._thread.join()
+        self.__sample()
+        return self.peak_bytes
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def peak_rss_of_process() -> int:
+        if resource is None:
+            return None
+        # ru_maxrss is in kilobytes on Linux (and in bytes on macOS.)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            self.__sample()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __sample(self):
+        try:
+            with open(self.fullpath_statm, mode='r') as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return
+        self.peak_bytes = max(self.peak_bytes, resident_pages * os.sysconf('SC_PAGE_SIZE'))
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,202 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from class_selenium_opensea import SeleniumOnOpensea
+
+
+class SeleniumWorkerPool:
+    """This class scrapes the extra properties of many NFTs from OpenSea with several browsers at
+    once. Each browser works on its own shard of token ids, and a browser that crashes is restarted
+    and carries on with its shard from the token where it stopped."""
+
+    def __init__(self,
+                 contract_address: str,
+                 num_workers: int = 4,
+                 max_restarts_per_token: int = 3,
+                 scraper_factory=SeleniumOnOpensea,
+                 instrumentation=None):
+        """
+        Initialize the SeleniumWorkerPool class.
+        :param contract_address: The contract in which the NFTs live.
+        :param num_workers: The number of browsers to run at the same time.
+        :param max_restarts_per_token: How many times the browser may be restarted to scrape a single
+          token before that token is given up on. The count starts again with every token, so a few
+          crashes spread over a long shard do not stop the worker from scraping the rest of it.
+        :param scraper_factory: A callable that receives the contract address and returns a new
+          scraper (with the same interface as SeleniumOnOpensea.)
+        :param instrumentation: If given (a RunInstrumentation), every page that is scraped is
+          counted with it as a call, and every browser restart as a retry.
+        """
+        self.contract_address = contract_address
+        self.num_workers = max(1, int(num_workers))
+        self.max_restarts_per_token = max(0, int(max_restarts_per_token))
+        self.scraper_factory = scraper_factory
+        self.instrumentation = instrumentation
+        # The browsers started by get_nft_properties (one per calling thread), see close().
+        self._thread_local = threading.local()
+        self._lock = threading.Lock()
+        self.list_open_slots = []
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_many_nfts_properties(self, iterable_with_token_ids, on_token_done=None) -> pd.DataFrame:
+        """
+        Parallel equivalent of SeleniumOnOpensea.get_many_nfts_properties.
+        :param iterable_with_token_ids: The IDs of the tokens to scrape.
+        :param on_token_done: If given, a callable that is called (from the worker threads) with the
+          token id and the list of its rows as soon as each token has been scraped.
+        :return: A single dataframe with the properties of all the tokens, in the order the token
+          ids were given.
+        """
+        list_token_ids = list(dict.fromkeys(iterable_with_token_ids))
+        if not list_token_ids:
+            return pd.DataFrame()
+
+        # Tokens are dealt round-robin, so that every shard gets a similar mix of tokens.
+        num_shards = min(self.num_workers, len(list_token_ids))
+        list_shards = [list_token_ids[i::num_shards] for i in range(num_shards)]
+
+        with ThreadPoolExecutor(max_workers=num_shards) as executor:
+            list_shard_results = list(executor.map(self.__scrape_shard, range(num_shards), list_shards,
+                                                   [on_token_done] * num_shards))
+
+        dict_results = {}
+        for shard_results in list_shard_results:
+            dict_results.update(shard_results)
+        list_dfs = [dict_results[token_id] for token_id in list_token_ids
+                    if token_id in dict_results and not dict_results[token_id].empty]
+        logging.info(f"Scraped extra properties for {len(list_dfs)} of {len(list_token_ids)} tokens "
+                     f"using {num_shards} browsers.")
+        if not list_dfs:
+            return pd.DataFrame()
+        return pd.concat(list_dfs, ignore_index=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get_nft_properties(self, token_id) -> pd.DataFrame:
+        """
+        Scrape a single token, with a browser that belongs to the calling thread (it is started the
+        first time the thread asks for a token, and kept open for the next ones.) If the browser
+        fails, it is restarted and the token is tried again, up to max_restarts_per_token times.
+        Call close() once done, to close the browsers.
+        :return: A dataframe with the properties of the token.
+        """
+        slot = getattr(self._thread_local, 'slot', None)
+        if slot is None:
+            slot = self._thread_local.slot = _BrowserSlot()
+            with self._lock:
+                self.list_open_slots.append(slot)
+        return self.__scrape_token(slot, token_id, f"Browser of thread '{threading.current_thread().name}'")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def close(self):
+        """Close the browsers that were started by get_nft_properties."""
+        with self._lock:
+            list_slots = self.list_open_slots
+            self.list_open_slots = []
+        for slot in list_slots:
+            self.__close_slot(slot)
+        # Threads that call get_nft_properties again after this get a new browser.
+        self._thread_local = threading.local()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __scrape_shard(self, worker_number: int, list_token_ids: list, on_token_done=None) -> dict:
+        """
+        Scrape every token of a shard with one browser. Tokens are scraped one at a time, so that
+        if the browser crashes, only the token that was being scraped has to be done again. A token
+        that still fails once its restarts are used up is left out, and the worker carries on with
+        the rest of its shard.
+        :return: A dict of token id -> dataframe with the properties of that token.
+        """
+        dict_results = {}
+        list_failed_token_ids = []
+        slot = _BrowserSlot()
+        try:
+            for token_id in list_token_ids:
+                try:
+                    df_token = self.__scrape_token(slot, token_id, f"Worker {worker_number}")
+                except Exception as e:
+                    logging.error(f"Worker {worker_number} gave up on token -> '{token_id}' after "
+                                  f"{self.max_restarts_per_token} browser restarts ({e}).")
+                    list_failed_token_ids.append(token_id)
+                    continue
+                dict_results[token_id] = df_token
+                # Outside the try above: an error in the callback (eg. the journal could not be
+                # written) is not a browser crash, so it is raised rather than retried.
+                if on_token_done is not None:
+                    on_token_done(token_id, df_token.to_dict('records'))
+        finally:
+            self.__close_slot(slot)
+        if list_failed_token_ids:
+            logging.warning(f"Worker {worker_number} could not scrape {len(list_failed_token_ids)} of the "
+                            f"{len(list_token_ids)} tokens of its shard.")
+        return dict_results
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __scrape_token(self, slot, token_id, who: str) -> pd.DataFrame:
+        """
+        Scrape one token with the browser of a slot, starting the browser if the slot has none. If
+        the browser fails (or can't even be started), it is closed, and the token is tried again
+        with a new one, up to max_restarts_per_token times.
+        :param slot: The _BrowserSlot that holds the browser (it is left with a working browser,
+          or with none.)
+        :param who: Who is scraping (for the log.)
+        :return: A dataframe with the properties of the token. The error of the last try is raised
+          if every try failed.
+        """
+        restarts = 0
+        while True:
+            try:
+                if slot.scraper is None:
+                    slot.scraper = self.__start_scraper()
+                df = slot.scraper.get_many_nfts_properties({token_id})
+            except Exception as e:
+                if self.instrumentation is not None:
+                    self.instrumentation.record_call('opensea', failed=True)
+                self.__close_slot(slot)
+                if restarts >= self.max_restarts_per_token:
+                    raise
+                restarts += 1
+                if self.instrumentation is not None:
+                    self.instrumentation.count('retries')
+                logging.warning(f"{who} failed on token -> '{token_id}' ({e}); "
+                                f"restarting its browser ({restarts}/{self.max_restarts_per_token}).")
+                continue
+            if self.instrumentation is not None:
+                self.instrumentation.record_call('opensea')
+            return df
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __start_scraper(self):
+        scraper = self.scraper_factory(self.contract_address)
+        try:
+            scraper.start_driver()
+        except Exception:
+            # A browser that started halfway is closed, rather than left running.
+            self.__close_scraper(scraper)
+            raise
+        return scraper
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __close_slot(self, slot):
+        """Close the browser of a slot (if it has one), and leave the slot empty."""
+        scraper, slot.scraper = slot.scraper, None
+        if scraper is not None:
+            self.__close_scraper(scraper)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __close_scraper(self, scraper):
+        # The browser may already be gone (that is often why it is being closed), so errors
+        # while closing it are not interesting.
+        try:
+            scraper.close_driver()
+        except Exception as e:
+            logging.debug(f"Error while closing a browser: {e}")
+    # ------------------------ END FUNCTION ------------------------ #
+
+
+class _BrowserSlot:
+    """Holds the browser (a scraper) that a worker thread is using, or None between a crash and the restart."""
+
+    def __init__(self):
+        self.scraper = None
+    # ------------------------ END FUNCTION ------------------------ #
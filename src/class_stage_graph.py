@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+from os.path import exists
+from pathlib import Path
+
+
+class Stage:
+    """Each instance of this class represents one step of the pipeline: a function that reads the
+    outputs of the stages it depends on (from disk) and writes a single output file."""
+
+    def __init__(self,
+                 name: str,
+                 function,
+                 fullpath_output: Path,
+                 dependencies: list = None,
+                 params: dict = None,
+                 fullpaths_extra_inputs: list = None):
+        """
+        Initialize the Stage class.
+        :param name: The name the stage is known by (eg. on the command line.)
+        :param function: A callable with no arguments that does the work of the stage. It is
+          expected to (re)write the file at fullpath_output.
+        :param fullpath_output: The file the stage produces.
+        :param dependencies: The names of the stages whose outputs this stage reads.
+        :param params: Any parameters that change what the stage produces. They must be json
+          serializable, as they are part of the stage's fingerprint.
+        :param fullpaths_extra_inputs: Files that the stage reads which are not produced by any stage
+          (eg. manually maintained files.) Their content is part of the fingerprint too.
+        """
+        self.name = name
+        self.function = function
+        self.fullpath_output = fullpath_output
+        self.fullpath_fingerprint = fullpath_output.with_name(fullpath_output.name + '.fingerprint.json')
+        self.dependencies = dependencies if dependencies else []
+        self.params = params if params else {}
+        self.fullpaths_extra_inputs = fullpaths_extra_inputs if fullpaths_extra_inputs else []
+    # ------------------------ END FUNCTION ------------------------ #
+
+
+class StageGraph:
+    """This class holds the stages of a pipeline as a dependency graph. A stage is only run when
+    its fingerprint (a hash of its parameters and of the content of its inputs) differs from the
+    one recorded the last time it ran, when its output is missing, or when it is invalidated."""
+
+    def __init__(self, instrumentation=None):
+        """
+        Initialize the StageGraph class.
+        :param instrumentation: If given (a RunInstrumentation), every stage that runs is measured
+          with it, and every stage that is skipped is recorded as such.
+        """
+        self.dict_stages = {}
+        self.instrumentation = instrumentation
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def add_stage(self, stage: Stage):
+        for dependency in stage.dependencies:
+            if dependency not in self.dict_stages:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'. "
+                                 f"Stages must be added after the stages they depend on.")
+        self.dict_stages[stage.name] = stage
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def stage_names(self) -> list:
+        """The names of all the stages, in an order in which they can be run."""
+        return list(self.dict_stages)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def invalidate(self, iterable_with_stage_names):
+        """
+        Forget the fingerprint of some stages, so that they run the next time. The stages downstream
+        of them do not need to be invalidated: if an invalidated stage produces a different output,
+        their fingerprints change too.
+        """
+        for name in iterable_with_stage_names:
+            stage = self.__get_stage(name)
+            stage.fullpath_fingerprint.unlink(missing_ok=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def run(self, targets: list = None, include_upstream: bool = True) -> dict:
+        """
+        Run the stages that are out of date.
+        :param targets: The names of the stages to bring up to date. If not provided, all stages are.
+        :param include_upstream: If True, the stages the targets depend on are brought up to date
+          first. If False, only the targets themselves are considered (using whatever their inputs
+          currently are on disk.)
+        :return: A dict of stage name -> 'ran' or 'skipped'.
+        """
+        list_names = self.stage_names() if targets is None else self.__with_upstream(targets, include_upstream)
+        dict_outcomes = {}
+        for name in list_names:
+            stage = self.dict_stages[name]
+            fingerprint = self.fingerprint(name)
+            if self.__recorded_fingerprint(stage) == fingerprint and exists(stage.fullpath_output):
+                logging.info(f"---------- SKIPPING STAGE '{name}' (up to date) ----------")
+                dict_outcomes[name] = 'skipped'
+                if self.instrumentation is not None:
+                    self.instrumentation.skipped(name)
+                continue
+            logging.info(f"---------- RUNNING STAGE '{name}' ----------")
+            if self.instrumentation is not None:
+                with self.instrumentation.stage(name):
+                    stage.function()
+            else:
+                stage.function()
+            # The fingerprint depends on the inputs only, so it is the same before and after the
+            # stage has run.
+            with open(stage.fullpath_fingerprint, mode='w') as f:
+                json.dump({'stage': name, 'fingerprint': fingerprint}, f, indent=2)
+            dict_outcomes[name] = 'ran'
+        return dict_outcomes
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def fingerprint(self, name: str) -> str:
+        """A hash of the stage's parameters and of the content of every file it reads."""
+        stage = self.__get_stage(name)
+        dict_inputs = {'stage': name, 'params': stage.params, 'inputs': {}}
+        list_input_paths = [self.dict_stages[dependency].fullpath_output for dependency in stage.dependencies]
+        list_input_paths.extend(stage.fullpaths_extra_inputs)
+        for fullpath_input in list_input_paths:
+            dict_inputs['inputs'][str(fullpath_input)] = self.__hash_file(fullpath_input)
+        serialized = json.dumps(dict_inputs, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __with_upstream(self, targets: list, include_upstream: bool) -> list:
+        set_needed = set()
+        list_to_visit = [self.__get_stage(name).name for name in targets]
+        while list_to_visit:
+            name = list_to_visit.pop()
+            if name in set_needed:
+                continue
+            set_needed.add(name)
+            if include_upstream:
+                list_to_visit.extend(self.dict_stages[name].dependencies)
+        # Stages are stored in the order they were added, which is always a valid order to run them in.
+        return [name for name in self.dict_stages if name in set_needed]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __get_stage(self, name: str) -> Stage:
+        if name not in self.dict_stages:
+            raise ValueError(f"Unknown stage -> '{name}'. Known stages are: {', '.join(self.dict_stages)}")
+        return self.dict_stages[name]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __recorded_fingerprint(stage: Stage):
+        if not exists(stage.fullpath_fingerprint):
+            return None
+        try:
+            with open(stage.fullpath_fingerprint, mode='r') as f:
+                return json.load(f).get('fingerprint')
+        except (OSError, json.JSONDecodeError):
+            return None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __hash_file(fullpath_file: Path):
+        if not exists(fullpath_file):
+            return None
+        sha = hashlib.sha256()
+        with open(fullpath_file, mode='rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,372 @@
+import logging
+import queue
+import threading
+import time
+import pandas as pd
+from class_affe_data_manipulator import AffeDataManipulator
+from class_concurrent_metadata_fetcher import ConcurrentMetadataFetcher
+from class_opensea_html_extractor import OpenseaHTMLPropertiesExtractor
+from class_response_cache import ResponseCache
+from class_token_journal import TokenJournal
+
+
+class StreamingAffePipeline:
+    """This class builds the Affen data one token at a time rather than one stage at a time. Every
+    token flows on its own through the steps of the pipeline: Moralis metadata -> refine (by name)
+    -> extra properties from OpenSea -> Affe object -> json files. Each step has its own threads,
+    and the steps are connected by bounded queues, so they all work at the same time (on different
+    tokens), the whole run takes about as long as its slowest step, and the first json files are
+    written a few seconds after the run starts.
+
+    The response cache and the journals of the network stages (see TokenJournal) are used the same
+    way as in the stage-by-stage pipeline, and once every token has gone through, the same tables
+    as the stage-by-stage pipeline are written to disk (so both can be mixed from one run to the
+    next.) The only difference in the output is the order of keys in the json of rare traits that
+    are not in AffeDataGetter.list_ordered_columns: here it follows the order in which OpenSea lists
+    the token's own traits, as the traits of the tokens that have not been scraped yet are unknown."""
+
+    def __init__(self,
+                 affe_data_getter,
+                 queue_size: int = 64,
+                 num_converter_threads: int = 1,
+                 num_writer_threads: int = 4,
+                 list_style_names: list = None,
+                 pretty: bool = True):
+        """
+        Initialize the StreamingAffePipeline class.
+        :param affe_data_getter: The AffeDataGetter whose settings (contract, rates, OpenSea backend,
+          response cache, storage, instrumentation) and files the pipeline uses.
+        :param queue_size: How many tokens may wait between two steps. When a step falls behind,
+          the steps before it block rather than piling tokens up in memory.
+        :param num_converter_threads: The number of threads converting tokens into Affe objects.
+        :param num_writer_threads: The number of threads writing json files.
+        :param list_style_names: The styles of json to write (see AffeDataManipulator.json_styles.)
+          By default, all of them.
+        :param pretty: Whether the json should be indented or not.
+        """
+        self.getter = affe_data_getter
+        self.queue_size = max(1, int(queue_size))
+        self.num_converter_threads = max(1, int(num_converter_threads))
+        self.num_writer_threads = max(1, int(num_writer_threads))
+        self.list_style_names = list_style_names if list_style_names else list(AffeDataManipulator.json_styles)
+        self.json_kwargs = {'indent': 2} if pretty else {}
+        self.fullpath_data_dir = affe_data_getter.fullpath_dir_output.parent
+
+        self._lock = threading.Lock()
+        self._start_perf_counter = None
+        self.seconds_to_first_output = None
+        # What went through the pipeline, kept to write the tables at the end of the run.
+        self.list_nft_rows = []
+        self.list_manual_rows = []
+        self.list_refined_rows = []
+        self.list_extra_rows = []
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def run(self, iterable_with_token_ids) -> dict:
+        """
+        Build the data of the tokens, writing the json of each Affe as soon as it is ready, and the
+        tables (as the stage-by-stage pipeline does) once every token is done.
+        :param iterable_with_token_ids: The ids of the tokens in the Affen contract (eg. from the
+          transfers table.) The tokens in the manually maintained list of OpenSea URLs are added.
+        :return: A report (dict) with the time the run took, the time until the first json was
+          written, how many tokens went in and out of each step, and what was written for each style.
+        """
+        getter = self.getter
+        contract = getter.affe_contract_address
+        list_token_ids = list(dict.fromkeys(iterable_with_token_ids))
+        self._start_perf_counter = time.perf_counter()
+
+        self.moralis = ConcurrentMetadataFetcher(max_requests_in_flight=getter.moralis_max_requests_in_flight,
+                                                 requests_per_second=getter.moralis_requests_per_second,
+                                                 client_factory=getter.new_moralis_http)
+        if getter.opensea_properties_backend == 'html':
+            self.opensea = getter.new_opensea_html_extractor()
+            num_scraper_threads = self.opensea.max_requests_in_flight
+        else:
+            # Imported here, so that Selenium is only loaded when it is used.
+            from class_selenium_worker_pool import SeleniumWorkerPool
+            self.opensea = SeleniumWorkerPool(contract, num_workers=getter.opensea_num_browsers,
+                                              instrumentation=getter.instrumentation)
+            num_scraper_threads = self.opensea.num_workers
+        self.journal_metadata = TokenJournal(getter.fullpath_nfts_data_journal,
+                                             params={'contract': contract,
+                                                     'fields': getter.metadata_fields_of_interest})
+        # As in get_nft_metadata_from_moralis, cached metadata is only served while its sync markers
+        # are the ones Moralis reports now.
+        self.dict_live_markers = getter.get_live_sync_markers(list_token_ids)
+        self.journal_extras = TokenJournal(getter.fullpath_nfts_extra_data_journal,
+                                           params={'contract': contract, 'backend': getter.opensea_properties_backend})
+        self.dict_styles = AffeDataManipulator(pd.DataFrame(), self.fullpath_data_dir)\
+            .make_json_style_writers(self.list_style_names)
+
+        # The few tokens of the manual list are fetched before the threads start, as fetching them
+        # saves the response cache, which must not happen while other threads are adding to it.
+        self.list_manual_rows = getter.get_manual_opensea_additions(set(list_token_ids))
+
+        # The steps are created from the last to the first, as each one hands its tokens to the next.
+        num_moralis_threads = self.moralis.max_requests_in_flight
+        step_write = _StreamStep('write', self.__write_json, self.num_writer_threads, self.queue_size,
+                                 next_step=None, num_producers=self.num_converter_threads)
+        step_convert = _StreamStep('convert', self.__convert_to_affe, self.num_converter_threads, self.queue_size,
+                                   next_step=step_write, num_producers=num_scraper_threads)
+        step_scrape = _StreamStep('scrape', self.__get_extra_properties, num_scraper_threads, self.queue_size,
+                                  next_step=step_convert, num_producers=1)
+        # The refine step gets tokens from every Moralis thread, and from the feeder (manual list.)
+        step_refine = _StreamStep('refine', self.__refine, 1, self.queue_size,
+                                  next_step=step_scrape, num_producers=num_moralis_threads + 1)
+        step_metadata = _StreamStep('metadata', self.__get_metadata, num_moralis_threads, self.queue_size,
+                                    next_step=step_refine, num_producers=1)
+        list_steps = [step_metadata, step_refine, step_scrape, step_convert, step_write]
+
+        logging.info(f"Streaming {len(list_token_ids)} tokens (and {len(self.list_manual_rows)} from the manual "
+                     f"list) through {', '.join(step.name for step in list_steps)}.")
+        for step in list_steps:
+            step.start()
+        try:
+            for row in self.list_manual_rows:
+                step_refine.put({'token_id': row['token_id'], 'nft_row': row})
+            step_refine.producer_done()
+            for token_id in list_token_ids:
+                step_metadata.put(token_id)
+            step_metadata.producer_done()
+            for step in list_steps:
+                step.join()
+        finally:
+            if not isinstance(self.opensea, OpenseaHTMLPropertiesExtractor):
+                # The browsers of the SeleniumWorkerPool.
+                self.opensea.close()
+
+        dict_json_reports = self.__finish_json()
+        self.__write_tables()
+        getter.response_cache.save()
+        self.journal_metadata.discard()
+        self.journal_extras.discard()
+
+        report = {'tokens': len(list_token_ids) + len(self.list_manual_rows),
+                  'seconds': time.perf_counter() - self._start_perf_counter,
+                  'seconds_to_first_output': self.seconds_to_first_output,
+                  'steps': {step.name: dict(step.stats) for step in list_steps},
+                  'json': dict_json_reports}
+        logging.info(f"Streaming run done in {report['seconds']:.1f} s (first json after "
+                     f"{report['seconds_to_first_output'] or 0:.1f} s) -> {report['steps']}")
+        return report
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __get_metadata(self, token_id) -> list:
+        """Moralis metadata of a token, from the response cache, the journal, or Moralis."""
+        getter = self.getter
+        contract = getter.affe_contract_address
+        list_rows = getter.get_cached_moralis_metadata(token_id, self.dict_live_markers)
+        if list_rows is None:
+            list_rows = getter.get_journaled_moralis_metadata(token_id, self.journal_metadata, self.dict_live_markers)
+        if list_rows is None:
+            df_token = self.moralis.get_one_nft_token_metadata(
+                contract, token_id, list_of_metadata_fields_to_extract=getter.metadata_fields_of_interest)
+            list_rows = df_token.to_dict('records')
+            self.journal_metadata.record(token_id, list_rows)
+            if list_rows:
+                getter.response_cache.put('moralis_metadata', contract, token_id, list_rows,
+                                          markers=ResponseCache.sync_markers_from_record(list_rows[0]))
+        with self._lock:
+            self.list_nft_rows.extend(list_rows)
+        return [{'token_id': token_id, 'nft_row': row} for row in list_rows]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __refine(self, item: dict) -> list:
+        """Only the tokens that refine_nft_data would keep go on."""
+        if not self.getter.is_affe_record(item['nft_row']):
+            return []
+        with self._lock:
+            self.list_refined_rows.append(item['nft_row'])
+        return [item]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __get_extra_properties(self, item: dict) -> list:
+        """The extra properties of a token, from the response cache, the journal, or OpenSea."""
+        getter = self.getter
+        contract = getter.affe_contract_address
+        token_id = item['token_id']
+        # As in get_extra_metadata_from_opensea, the properties of a token are only scraped again
+        # once Moralis sees the token change (the row of the token carries its current markers, as
+        # cached metadata is only served while its markers are current.)
+        markers = ResponseCache.sync_markers_from_record(item['nft_row'])
+        extras_row = getter.response_cache.get('opensea_properties', contract, token_id, current_markers=markers)
+        if extras_row is None:
+            journaled = self.journal_extras.get(token_id)
+            if journaled is not None and journaled['markers'] == markers:
+                list_rows = journaled['rows']
+            else:
+                list_rows = self.__scrape(token_id)
+                if list_rows is not None:
+                    self.journal_extras.record(token_id, {'markers': markers, 'rows': list_rows})
+            for record in list_rows or []:
+                # Only the properties this token actually has are kept (not the NaNs.)
+                row = {key: value for key, value in record.items() if value == value}
+                getter.response_cache.put('opensea_properties', contract, token_id, row, markers=markers)
+                if extras_row is None:
+                    extras_row = row
+        if extras_row is not None:
+            with self._lock:
+                self.list_extra_rows.append(extras_row)
+        # A token whose page could not be scraped still becomes an Affe (without its extra properties),
+        # the same as in combine_data.
+        item['extras_row'] = extras_row if extras_row is not None else {}
+        return [item]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __scrape(self, token_id) -> list:
+        """Scrape the properties of a token with the chosen backend. None if the scrape failed."""
+        if isinstance(self.opensea, OpenseaHTMLPropertiesExtractor):
+            dict_row = self.opensea.get_nft_properties(token_id)
+            return None if dict_row is None else [dict_row]
+        try:
+            return self.opensea.get_nft_properties(token_id).to_dict('records')
+        except Exception as e:
+            logging.warning(f"Failed to scrape the properties of token -> '{token_id}': {e}")
+            return None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __convert_to_affe(self, item: dict) -> list:
+        """Combine the data of a token (as combine_data and reorganize_the_data do), and make an Affe of it."""
+        nft_row = item['nft_row']
+        extras_row = item['extras_row']
+        # The extra properties win over the data from Moralis, where both have a value.
+        dict_combined = dict(nft_row)
+        for key, value in extras_row.items():
+            if value is not None and value == value:
+                dict_combined[key] = value
+            elif key not in dict_combined:
+                dict_combined[key] = value
+
+        # The columns in list_ordered_columns go first, then the extras, then the rest of the data
+        # from Moralis (the order in which combine_data and reorganize_the_data leave them.)
+        list_columns = [column for column in self.getter.list_ordered_columns if column in dict_combined]
+        for column in list(extras_row) + list(nft_row):
+            if column not in list_columns:
+                list_columns.append(column)
+        df_affe = pd.DataFrame([dict_combined], columns=list_columns)
+
+        affe = AffeDataManipulator(df_affe, self.fullpath_data_dir).make_affe_objects()[0]
+        item['affe_id'] = affe.id
+        item['affe_dicts'] = AffeDataManipulator.affe_as_dict_by_style(affe, self.list_style_names)
+        return [item]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __write_json(self, item: dict) -> list:
+        for style_name, the_ape_as_dict in item['affe_dicts'].items():
+            style = self.dict_styles[style_name]
+            style['writer'].write_json(str(item['affe_id']) + '.json', the_ape_as_dict, **self.json_kwargs)
+            with self._lock:
+                style['list_all_affen'].append((item['affe_id'], the_ape_as_dict))
+        with self._lock:
+            if self.seconds_to_first_output is None:
+                self.seconds_to_first_output = time.perf_counter() - self._start_perf_counter
+        return []
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __finish_json(self) -> dict:
+        """Write the file with the whole collection of each style, and remove the files of Affen that are gone."""
+        dict_reports = {}
+        for style_name, style in self.dict_styles.items():
+            # The Affen arrive in whatever order they were finished in, so they are sorted by id.
+            list_all_affen = [the_ape_as_dict for _, the_ape_as_dict in
+                              sorted(style['list_all_affen'], key=lambda pair: pair[0])]
+            style['writer'].write_json(style['collection_file'], list_all_affen, **self.json_kwargs)
+            dict_reports[style_name] = style['writer'].finish()
+        return dict_reports
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __write_tables(self):
+        """Write the same tables as the stage-by-stage pipeline, so that later runs (of either) can use them."""
+        getter = self.getter
+        storage = getter.table_storage
+        df_nfts = pd.DataFrame(self.list_nft_rows)
+        storage.write(df_nfts, getter.fullpath_nfts_data, 'nfts')
+        df_with_manual_additions = pd.concat([df_nfts, pd.DataFrame(self.list_manual_rows)], ignore_index=True)
+        storage.write(df_with_manual_additions, getter.fullpath_nfts_including_manual_additions, 'nfts')
+        storage.write(pd.DataFrame(self.list_refined_rows), getter.fullpath_nfts_refined_data, 'nfts')
+        storage.write(pd.DataFrame(self.list_extra_rows), getter.fullpath_nfts_extra_data, 'extras')
+        getter.combine_data(use_data_already_on_disk=True)
+        getter.reorganize_the_data(getter.list_ordered_columns, use_data_already_on_disk=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+
+class _StreamStep:
+    """One step of a StreamingAffePipeline: a bounded queue of items, and the threads that work on
+    them, handing what they produce to the next step. Once every producer of the step (the threads
+    of the step before, or the feeder) is done, each thread of the step gets an end-of-stream marker."""
+
+    _end_of_stream = object()
+
+    def __init__(self, name: str, function, num_workers: int, queue_size: int, next_step, num_producers: int):
+        """
+        :param function: Called with each item; it returns a list with the items for the next step
+          (an empty list drops the item.)
+        :param num_producers: How many threads put items into this step.
+        """
+        self.name = name
+        self.function = function
+        self.num_workers = max(1, int(num_workers))
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_step = next_step
+        self.num_producers_left = num_producers
+        self.stats = {'in': 0, 'out': 0, 'failed': 0, 'busy_seconds': 0.0}
+        self._lock = threading.Lock()
+        self.list_threads = []
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def start(self):
+        for worker_number in range(self.num_workers):
+            thread = threading.Thread(target=self.__work, name=f"stream-{self.name}-{worker_number}", daemon=True)
+            thread.start()
+            self.list_threads.append(thread)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def put(self, item):
+        # Blocks while the queue is full, which is what keeps a fast step from running ahead.
+        self.queue.put(item)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def producer_done(self):
+        with self._lock:
+            self.num_producers_left -= 1
+            is_last_producer = self.num_producers_left == 0
+        if is_last_producer:
+            for _ in range(self.num_workers):
+                self.queue.put(self._end_of_stream)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def join(self):
+        for thread in self.list_threads:
+            thread.join()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __work(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._end_of_stream:
+                    break
+                start = time.perf_counter()
+                try:
+                    list_outputs = self.function(item)
+                except Exception as e:
+                    # One bad token should not stop the stream: it is logged, counted, and dropped.
+                    token_id = item.get('token_id') if isinstance(item, dict) else item
+                    logging.warning(f"Step '{self.name}' failed on token -> '{token_id}': {e}")
+                    with self._lock:
+                        self.stats['failed'] += 1
+                    continue
+                finally:
+                    with self._lock:
+                        self.stats['busy_seconds'] += time.perf_counter() - start
+                with self._lock:
+                    self.stats['in'] += 1
+                    self.stats['out'] += len(list_outputs)
+                if self.next_step is not None:
+                    for output in list_outputs:
+                        self.next_step.put(output)
+        finally:
+            if self.next_step is not None:
+                self.next_step.producer_done()
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,197 @@
+import json
+import numpy as np
+import pandas as pd
+from class_table_storage import TableStorage
+
+
+class SyntheticAffeData:
+    """This class generates made-up, but realistic, Affen data of any size: the same tables (with
+    the same columns) that Moralis and OpenSea give us for the real collection, so that the stages
+    of the pipeline can be benchmarked on collections much larger than the real one. The data only
+    depends on the seed, so two runs with the same parameters get exactly the same tables."""
+
+    # Affe are in Opensea storefront at the following address, and are created by this account.
+    default_contract_address = "0x495f947276749ce646f68ac8c248420045cb7b5e"
+    creator_address = "0x023a3905e3b33634758871712f4293ddb919b67f"
+    zero_address = '0x0000000000000000000000000000000000000000'
+
+    emotion_names = ['Anger', 'Anticipation', 'Disgust', 'Fear', 'Joy',
+                     'Negative', 'Positive', 'Sadness', 'Surprise', 'Trust']
+
+    def __init__(self, num_tokens: int, num_traits: int = 20, num_owners: int = None, seed: int = 42,
+                 contract_address: str = None, list_known_trait_names: list = None):
+        """
+        Initialize the SyntheticAffeData class.
+        :param num_tokens: How many Affen the collection has.
+        :param num_traits: How many rare traits (besides CHIMP, AK47 and the emotions) the
+          collection has. Each trait is held by a different share of the Affen, and one in four of
+          them is numeric ('X of 10'.)
+        :param num_owners: How many different addresses hold Affen (by default, one per 4 Affen.)
+        :param seed: The seed of the random generator.
+        :param contract_address: The contract the tokens are in.
+        :param list_known_trait_names: Names to give the rare traits (eg. the ones in
+          AffeDataGetter.list_ordered_columns), so that the tables have the same columns as the real
+          ones. Traits beyond these are called 'TRAIT 1', 'TRAIT 2', etc.
+        """
+        self.num_tokens = num_tokens
+        self.num_traits = num_traits
+        self.num_owners = num_owners if num_owners else max(num_tokens // 4, 1)
+        self.seed = seed
+        self.contract_address = contract_address if contract_address else self.default_contract_address
+
+        # Token ids in the storefront contract are the address of the creator, followed by an
+        # index and the supply (which is 1 for all Affen.)
+        creator = int(self.creator_address, 16)
+        self.affe_numbers = np.arange(1, num_tokens + 1)
+        self.token_ids = [str((creator << 96) | (number << 40) | 1) for number in self.affe_numbers.tolist()]
+        list_known_trait_names = list(list_known_trait_names) if list_known_trait_names else []
+        self.trait_names = (list_known_trait_names + [f"TRAIT {k + 1}" for k in range(num_traits)])[:num_traits]
+
+        # Which tokens are not Affen, which are called 'Affe #X', and which have no metadata. These
+        # are decided here, as both nfts() and extras() depend on them.
+        rng = np.random.default_rng(seed + 4)
+        kind = rng.random(num_tokens)
+        self.is_other_nft = kind < 0.03
+        self.is_short_name = (kind >= 0.03) & (kind < 0.05)
+        self.has_metadata = rng.random(num_tokens) >= 0.05
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def nfts(self) -> pd.DataFrame:
+        """
+        The NFT table, as returned by Moralis for the contract (see TableStorage.list_nft_columns.)
+        Like the real one, a few of the tokens are not Affen, a few are called 'Affe #X' rather
+        than 'Affe mit Waffe #X', and some have no metadata.
+        """
+        rng = np.random.default_rng(self.seed)
+        n = self.num_tokens
+        numbers = pd.Series(self.affe_numbers).astype(str)
+        names = np.where(self.is_other_nft, 'Some Other NFT #' + numbers,
+                         np.where(self.is_short_name, 'Affe #' + numbers, 'Affe mit Waffe #' + numbers))
+        descriptions = [f"The story of ape number {number}. " * 4 for number in self.affe_numbers.tolist()]
+        images = [f"https://lh3.googleusercontent.com/synthetic-{number}" for number in self.affe_numbers.tolist()]
+        metadata = [json.dumps({'name': name, 'description': description, 'image': image})
+                    for name, description, image in zip(names.tolist(), descriptions, images)]
+        metadata = pd.Series(metadata, dtype=object).where(self.has_metadata, np.nan)
+        blocks_minted = 13_000_000 + np.sort(rng.integers(0, 1_000_000, n))
+
+        df = pd.DataFrame({
+            'token_address': self.contract_address,
+            'token_id': self.token_ids,
+            'owner_of': self.__owners(),
+            'block_number_minted': blocks_minted,
+            'block_number': blocks_minted + rng.integers(0, 500_000, n),
+            'token_hash': [f"{number:064x}" for number in rng.integers(0, 2 ** 62, n).tolist()],
+            'amount': 1,
+            'contract_type': 'ERC1155',
+            'name': names,
+            'symbol': 'OPENSTORE',
+            'token_uri': [f"https://api.opensea.io/api/v1/metadata/{self.contract_address}/{token_id}"
+                          for token_id in self.token_ids],
+            'metadata': metadata,
+            'last_token_uri_sync': '2022-04-01T00:00:00.000Z',
+            'last_metadata_sync': '2022-04-01T00:00:00.000Z',
+            'description': descriptions,
+            'image': images,
+            'external_link': 'https://www.affemitwaffe.com',
+            'animation_url': np.nan,
+        })
+        return df[TableStorage.list_nft_columns]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def extras(self) -> pd.DataFrame:
+        """
+        The table of extra properties scraped from OpenSea: token_id, CHIMP, AK47, the emotions
+        (as 'X of 5') and the rare traits, which are missing for the Affen that do not have them.
+        Like the real one, it only has the tokens that refining the NFT table keeps (the Affen, and
+        the tokens without metadata.)
+        """
+        rng = np.random.default_rng(self.seed + 1)
+        n = self.num_tokens
+        numbers = pd.Series(self.affe_numbers).astype(str)
+        dict_columns = {'token_id': self.token_ids,
+                        'CHIMP': 'Chimp ' + numbers,
+                        'AK47': np.where(rng.random(n) < 0.9, 'AK47', 'Golden AK47')}
+        # Values are picked from a small array of labels, rather than formatted one by one.
+        emotion_labels = np.array([f"{value} of 5" for value in range(6)], dtype=object)
+        for emotion in self.emotion_names:
+            dict_columns[emotion] = emotion_labels[rng.integers(0, 6, n)]
+        for k, trait in enumerate(self.trait_names):
+            # Traits go from common (held by 60% of the Affen) to very rare (held by a handful.)
+            share = 0.6 / (k + 1)
+            present = rng.random(n) < share
+            if k % 4 == 3:
+                labels = np.array([f"{value} of 10" for value in range(1, 11)], dtype=object)
+            else:
+                labels = np.array([f"{trait.title()} value {value}" for value in range(1, 3 + k % 11)], dtype=object)
+            values = labels[rng.integers(0, len(labels), n)]
+            values[~present] = np.nan
+            dict_columns[trait] = values
+        return pd.DataFrame(dict_columns)[~(self.is_other_nft & self.has_metadata)].reset_index(drop=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def transfers(self) -> pd.DataFrame:
+        """
+        The transfer history of the collection (see TableStorage.list_transfer_columns), newest
+        first, as Moralis returns it. Every Affe is sent by the creator to a first owner, and some
+        change hands up to three more times; the last owner of each Affe is the owner_of in nfts().
+        """
+        rng = np.random.default_rng(self.seed + 2)
+        n = self.num_tokens
+        final_owners = np.array(self.__owners(), dtype=object)
+        num_hops = 1 + rng.integers(0, 4, n)
+        # One row per transfer: the token it belongs to, and which of its transfers it is.
+        token_rows = np.repeat(np.arange(n), num_hops)
+        hop = np.arange(len(token_rows)) - np.repeat(np.cumsum(num_hops) - num_hops, num_hops)
+        is_last = hop == num_hops[token_rows] - 1
+
+        owner_pool = np.array(self.__owner_addresses(), dtype=object)
+        to_addresses = owner_pool[rng.integers(0, len(owner_pool), len(token_rows))]
+        to_addresses[is_last] = final_owners[token_rows[is_last]]
+        from_addresses = np.empty(len(token_rows), dtype=object)
+        from_addresses[1:] = to_addresses[:-1]
+        from_addresses[hop == 0] = self.creator_address
+
+        # Each transfer of a token happens some blocks after the previous one.
+        blocks_between = np.where(hop == 0, 0, rng.integers(1, 50_000, len(token_rows)))
+        blocks_since_first = np.cumsum(blocks_between)
+        blocks_since_first -= np.repeat(blocks_since_first[np.cumsum(num_hops) - num_hops], num_hops)
+        blocks = 13_000_000 + np.sort(rng.integers(0, 1_000_000, n))[token_rows] + blocks_since_first
+        transaction_indexes = rng.integers(0, 200, len(token_rows))
+        log_indexes = rng.integers(0, 400, len(token_rows))
+        token_ids = np.array(self.token_ids, dtype=object)[token_rows]
+        df = pd.DataFrame({
+            'token_address': self.contract_address,
+            'token_id': token_ids,
+            'from_address': from_addresses,
+            'to_address': to_addresses,
+            'value': '0',
+            'amount': 1,
+            'contract_type': 'ERC1155',
+            'block_number': blocks,
+            'block_timestamp': '2022-04-01T00:00:00.000Z',
+            'block_hash': [f"0x{number:064x}" for number in blocks.tolist()],
+            'transaction_hash': [f"0x{number:064x}" for number in rng.integers(0, 2 ** 62, len(token_rows)).tolist()],
+            'transaction_type': 'Single',
+            'transaction_index': transaction_indexes,
+            'log_index': log_indexes,
+            'operator': from_addresses,
+            'transfer_index': [f"[{block}, {transaction_index}, {log_index}, 0]" for block, transaction_index, log_index
+                               in zip(blocks.tolist(), transaction_indexes.tolist(), log_indexes.tolist())],
+            'verified': 1,
+        })
+        return df.sort_values(['block_number', 'transaction_index', 'log_index'], ascending=False, ignore_index=True)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __owner_addresses(self) -> list:
+        return [f"0x{number:040x}" for number in range(1, self.num_owners + 1)]
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __owners(self) -> list:
+        """The current owner of every Affe. A few owners hold many Affen, as in the real collection."""
+        rng = np.random.default_rng(self.seed + 3)
+        owner_pool = self.__owner_addresses()
+        # A zipf-like spread: owner k holds roughly 1/k as many Affen as the first one.
+        weights = 1.0 / np.arange(1, len(owner_pool) + 1)
+        positions = rng.choice(len(owner_pool), size=self.num_tokens, p=weights / weights.sum())
+        return [owner_pool[position] for position in positions.tolist()]
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,244 @@
+import logging
+import os
+from os.path import exists
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+class TableStorage:
+    """This class reads and writes the tables that the stages of the pipeline pass to each other.
+    Tables are stored as Parquet (or Feather, or CSV) with an explicit schema per table, so that
+    columns come back from disk with the same types they were written with."""
+
+    # File extension for each of the supported formats.
+    extensions = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+
+    # The type of every column that we know about. Token ids are strings: the ids in the OpenSea
+    # Storefront contract are far too large for any integer type, and reading them as numbers
+    # is what used to make them drift between int, float and str from one stage to the next.
+    # Numeric traits that come as 'X of Y' are kept as strings, as that is the format the rest of
+    # the code expects (see AffeDataManipulator.)
+    column_types = {'token_address': 'string', 'token_id': 'string', 'from_address': 'string',
+                    'to_address': 'string', 'value': 'string', 'amount': 'Int64', 'contract_type': 'string',
+                    'block_number': 'Int64', 'block_timestamp': 'string', 'block_hash': 'string',
+                    'transaction_hash': 'string', 'transaction_type': 'string', 'transaction_index': 'Int64',
+                    'log_index': 'Int64', 'operator': 'string', 'transfer_index': 'string', 'verified': 'Int64',
+                    'owner_of': 'string', 'block_number_minted': 'Int64', 'token_hash': 'string',
+                    'name': 'string', 'symbol': 'string', 'token_uri': 'string', 'metadata': 'string',
+                    'last_token_uri_sync': 'string', 'last_metadata_sync': 'string', 'description': 'string',
+                    'image': 'string', 'external_link': 'string', 'animation_url': 'string'}
+
+    list_transfer_columns = ['token_address', 'token_id', 'from_address', 'to_address', 'value', 'amount',
+                             'contract_type', 'block_number', 'block_timestamp', 'block_hash',
+                             'transaction_hash', 'transaction_type', 'transaction_index', 'log_index',
+                             'operator', 'transfer_index', 'verified']
+    # The transfers that OwnershipLedger keeps (see OwnershipLedger.transfers.)
+    list_ownership_columns = ['token_address', 'token_id', 'from_address', 'to_address', 'amount', 'block_number',
+                              'transaction_index', 'log_index', 'transaction_hash']
+    list_nft_columns = ['token_address', 'token_id', 'owner_of', 'block_number_minted', 'block_number',
+                        'token_hash', 'amount', 'contract_type', 'name', 'symbol', 'token_uri', 'metadata',
+                        'last_token_uri_sync', 'last_metadata_sync', 'description', 'image', 'external_link',
+                        'animation_url']
+
+    # The explicit schema of each table: the columns it is expected to have, and their types.
+    # Columns that are not listed (eg. the traits scraped from OpenSea, which differ from one
+    # collection to the next) are stored as strings if they hold text, or as whatever numeric
+    # type pandas gave them.
+    schemas = {
+        'transfers': dict(zip(list_transfer_columns, map(column_types.get, list_transfer_columns))),
+        'ownership': dict(zip(list_ownership_columns, map(column_types.get, list_ownership_columns))),
+        'nfts': dict(zip(list_nft_columns, map(column_types.get, list_nft_columns))),
+        'extras': {'token_id': 'string'},
+        'combined': dict(zip(list_nft_columns, map(column_types.get, list_nft_columns))),
+        'final': dict(zip(list_nft_columns, map(column_types.get, list_nft_columns))),
+    }
+
+    def __init__(self, storage_format: str = 'parquet', export_csv: bool = False, instrumentation=None):
+        """
+        Initialize the TableStorage class.
+        :param storage_format: Acceptable values are 'parquet', 'feather' (Arrow IPC) and 'csv'.
+        :param export_csv: When True, a CSV copy of every table is written next to it as well.
+        :param instrumentation: If given (a RunInstrumentation), the rows of every table that is read
+          are counted as rows in, and the rows of every table that is written as rows out.
+        """
+        if storage_format not in self.extensions:
+            raise ValueError(f"Unknown storage format -> '{storage_format}'. "
+                             f"Acceptable values are: {', '.join(self.extensions)}")
+        self.storage_format = storage_format
+        self.export_csv = export_csv
+        self.instrumentation = instrumentation
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def path(self, fullpath_dir: Path, table_file_stem: str) -> Path:
+        """The full path of a table file, with the extension of the storage format."""
+        return fullpath_dir / (table_file_stem + self.extensions[self.storage_format])
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def apply_schema(self, df: pd.DataFrame, schema_name: str) -> pd.DataFrame:
+        """
+        Cast the columns of a dataframe to the types in a schema. Columns that are not in the
+        schema but hold text are cast to strings, so that every column has a single type.
+        :return: A new dataframe (the one passed in is not modified.)
+        """
+        df = df.copy()
+        dict_schema = self.schemas.get(schema_name, {})
+        for col in df.columns:
+            col_type = dict_schema.get(col, self.column_types.get(col))
+            if col_type is None and (df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype)):
+                col_type = 'string'
+            if col_type == 'Int64':
+                df[col] = pd.to_numeric(df[col], errors='coerce').round().astype('Int64')
+            elif col_type == 'string':
+                # The values are converted to str first, so that eg. ints and strs mixed in one
+                # column end up as the same type (missing values are kept as missing.)
+                df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype('string')
+            elif col_type is not None:
+                df[col] = df[col].astype(col_type)
+        return df
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def write(self, df: pd.DataFrame, fullpath_table: Path, schema_name: str = None, export_csv: bool = None):
+        """
+        Write a table to disk, in the storage format, after casting it to its schema.
+        :param export_csv: Overrides (for this table only) whether a CSV copy is written too.
+        """
+        df_typed = self.apply_schema(df, schema_name) if schema_name else df
+        if self.storage_format == 'parquet':
+            df_typed.to_parquet(fullpath_table, index=False)
+        elif self.storage_format == 'feather':
+            df_typed.reset_index(drop=True).to_feather(fullpath_table)
+        else:
+            df_typed.to_csv(fullpath_table, index=False)
+
+        export_csv = self.export_csv if export_csv is None else export_csv
+        fullpath_csv = fullpath_table.with_suffix('.csv')
+        if export_csv and fullpath_csv != fullpath_table:
+            df_typed.to_csv(fullpath_csv, index=False)
+        if self.instrumentation is not None:
+            self.instrumentation.count('rows_out', len(df_typed))
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def write_batches(self, iterable_with_dataframes, fullpath_table: Path, schema_name: str = None,
+                      export_csv: bool = None) -> int:
+        """
+        Write a table to disk one batch of rows at a time (eg. one page of an API at a time), so the
+        whole table never has to be in memory. The table has the columns of the first batch that
+        has any; columns that later batches add are dropped. Columns that are not in the schema are
+        stored as strings, as their type could otherwise change from one batch to the next.
+        The table is written to a temporary file that replaces the previous table once every batch
+        has been written, so a run that dies halfway leaves the previous table untouched.
+        :param iterable_with_dataframes: The batches (eg. a generator, consumed as it is written.)
+        :param export_csv: Overrides (for this table only) whether a CSV copy is written too.
+        :return: The number of rows written.
+        """
+        if self.storage_format in ('parquet', 'feather'):
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        export_csv = self.export_csv if export_csv is None else export_csv
+        fullpath_csv = fullpath_table.with_suffix('.csv')
+        list_fullpaths = [fullpath_table]
+        if export_csv and fullpath_csv != fullpath_table:
+            list_fullpaths.append(fullpath_csv)
+        dict_temporary = {fullpath: Path(str(fullpath) + '.tmp') for fullpath in list_fullpaths}
+        # Whatever a run that died halfway left behind is started afresh.
+        for fullpath_temporary in dict_temporary.values():
+            fullpath_temporary.unlink(missing_ok=True)
+        dict_schema = self.schemas.get(schema_name, {}) if schema_name else {}
+
+        list_columns = None
+        arrow_schema = None
+        arrow_writer = None
+        num_rows = 0
+        try:
+            for df in iterable_with_dataframes:
+                if list_columns is None:
+                    if len(df.columns) == 0:
+                        continue
+                    list_columns = list(df.columns)
+                df = df.reindex(columns=list_columns)
+                for col in list_columns:
+                    if dict_schema.get(col, self.column_types.get(col)) is None:
+                        df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype('string')
+                df_typed = self.apply_schema(df, schema_name) if schema_name else df
+
+                if self.storage_format in ('parquet', 'feather'):
+                    table = pyarrow.Table.from_pandas(df_typed, preserve_index=False)
+                    if arrow_writer is None:
+                        arrow_schema = table.schema
+                        if self.storage_format == 'parquet':
+                            arrow_writer = pyarrow.parquet.ParquetWriter(dict_temporary[fullpath_table], arrow_schema)
+                        else:
+                            arrow_writer = pyarrow.ipc.new_file(str(dict_temporary[fullpath_table]), arrow_schema)
+                    arrow_writer.write_table(table.cast(arrow_schema))
+                # CSV (the table itself, or its copy) is simply appended to, with the header written once.
+                for fullpath in list_fullpaths:
+                    if fullpath.suffix == '.csv':
+                        df_typed.to_csv(dict_temporary[fullpath], mode='a', header=not exists(dict_temporary[fullpath]),
+                                        index=False)
+                num_rows += len(df_typed)
+            if arrow_writer is not None:
+                arrow_writer.close()
+        except BaseException:
+            if arrow_writer is not None:
+                arrow_writer.close()
+            for fullpath_temporary in dict_temporary.values():
+                Path(fullpath_temporary).unlink(missing_ok=True)
+            raise
+
+        if list_columns is None:
+            # Not a single batch had any columns.
+            self.write(pd.DataFrame(), fullpath_table, schema_name, export_csv=export_csv)
+            return 0
+        for fullpath, fullpath_temporary in dict_temporary.items():
+            os.replace(fullpath_temporary, fullpath)
+        if self.instrumentation is not None:
+            self.instrumentation.count('rows_out', num_rows)
+        return num_rows
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def read(self, fullpath_table: Path, schema_name: str = None, columns: list = None) -> pd.DataFrame:
+        """
+        Read a table from disk.
+        :param schema_name: The schema the table was written with. It is only needed for CSV, as
+          Parquet and Feather files carry their own types.
+        :param columns: If given, only these columns are read (columns that the table does not have
+          are ignored.)
+        :return: A dataframe in which text columns are plain python objects with NaN for missing
+          values (the rest of the code relies on the truthiness of values, which pandas' own
+          missing-value marker does not support.)
+        """
+        if not exists(fullpath_table):
+            raise FileNotFoundError(f"Table not found -> '{fullpath_table}'")
+        if self.storage_format == 'parquet':
+            import pyarrow.parquet
+            list_available = pyarrow.parquet.ParquetFile(fullpath_table).schema_arrow.names
+            df = pd.read_parquet(fullpath_table, columns=self.__keep_available(columns, list_available))
+        elif self.storage_format == 'feather':
+            import pyarrow.ipc
+            with pyarrow.ipc.open_file(fullpath_table) as reader:
+                list_available = reader.schema.names
+            df = pd.read_feather(fullpath_table, columns=self.__keep_available(columns, list_available))
+        else:
+            set_columns = set(columns) if columns else None
+            df = pd.read_csv(fullpath_table,
+                             usecols=(lambda col: col in set_columns) if set_columns else None,
+                             dtype=str)
+            df = self.apply_schema(df, schema_name)
+
+        for col in df.columns:
+            if df[col].dtype == object or isinstance(df[col].dtype, pd.StringDtype):
+                df[col] = df[col].astype(object).where(df[col].notna(), np.nan)
+        logging.debug(f"Read {len(df)} rows and {len(df.columns)} columns from '{fullpath_table}'")
+        if self.instrumentation is not None:
+            self.instrumentation.count('rows_in', len(df))
+        return df
+    # ------------------------ END FUNCTION ------------------------ #
+
+    @staticmethod
+    def __keep_available(columns: list, list_available: list):
+        if not columns:
+            return None
+        return [col for col in columns if col in list_available]
+    # ------------------------ END FUNCTION ------------------------ #
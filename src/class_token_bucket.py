@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """A thread-safe token bucket, used to keep the rate of calls to an API within the limits of a plan."""
+
+    def __init__(self, rate_per_second: float, capacity: float = 1.0):
+        """
+        Initialize the TokenBucket class.
+        :param rate_per_second: How many tokens are added to the bucket every second. With the
+          default cost of 1 token per call, this is the sustained number of calls per second.
+        :param capacity: The maximum number of tokens the bucket can hold, ie. the size of the
+          burst of calls that can be sent at once after a quiet period.
+        """
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be greater than zero.")
+        self.rate_per_second = float(rate_per_second)
+        self.capacity = max(float(capacity), 1.0)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def acquire(self, cost: float = 1.0):
+        """
+        Block until 'cost' tokens are available in the bucket, and then take them.
+        :param cost: The number of tokens that the call about to be made consumes.
+        """
+        while True:
+            with self._lock:
+                self.__refill()
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                seconds_to_wait = (cost - self.tokens) / self.rate_per_second
+            time.sleep(seconds_to_wait)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def set_rate(self, rate_per_second: float, capacity: float = None):
+        """
+        Change the rate (and optionally the capacity) of the bucket while it is in use, for example
+        once an API has told us (in its response headers) what our real quota is.
+        """
+        with self._lock:
+            self.__refill()
+            self.rate_per_second = float(rate_per_second)
+            if capacity is not None:
+                self.capacity = max(float(capacity), 1.0)
+                self.tokens = min(self.tokens, self.capacity)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def drain(self):
+        """Empty the bucket, eg. after an API answered with 'too many requests'."""
+        with self._lock:
+            self.__refill()
+            self.tokens = 0.0
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_second)
+    # ------------------------ END FUNCTION ------------------------ #
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import threading
+from os.path import exists
+from pathlib import Path
+
+
+class TokenJournal:
+    """An append-only journal (one JSON document per line) of the tokens that a long stage has
+    finished with. Each token is written, and flushed to disk, as soon as it is done, so that if the
+    process dies halfway through the stage, a new run can read the journal back and only work on
+    the tokens that are missing. Once the stage has written its output, the journal is discarded.
+
+    The first line of the journal holds the parameters of the stage. A journal that was written with
+    different parameters (eg. by the other OpenSea backend) is not trusted, and is started afresh."""
+
+    def __init__(self, fullpath_journal: Path, params: dict = None, fsync: bool = True):
+        """
+        Initialize the TokenJournal class, reading back whatever a previous (interrupted) run left.
+        :param fullpath_journal: The file of the journal (eg. intermediate_files/extras.journal.jsonl)
+        :param params: Anything that changes what the stage produces for a token. They must be json
+          serializable.
+        :param fsync: Whether every line is forced to disk (rather than only to the operating system)
+          before record() returns. It makes every token survive a power cut, not only a crash.
+        """
+        self.fullpath_journal = fullpath_journal
+        self.params = params if params else {}
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = None
+        # token id -> what was recorded for it (the last record wins, if a token was recorded twice.)
+        self.dict_records = {}
+        self.__load()
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __len__(self):
+        return len(self.dict_records)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __contains__(self, token_id):
+        return str(token_id) in self.dict_records
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def completed_token_ids(self) -> set:
+        """The ids of the tokens that are already in the journal."""
+        return set(self.dict_records)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def get(self, token_id, default=None):
+        return self.dict_records.get(str(token_id), default)
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def record(self, token_id, value):
+        """
+        Append a finished token to the journal. It can be called from several threads at once.
+        :param value: What the stage produced for the token (anything json serializable; values
+          that json does not know, such as timestamps, are stored as strings.)
+        """
+        line = json.dumps({'token_id': str(token_id), 'value': value}, default=str)
+        with self._lock:
+            if self._file is None:
+                self.__open_for_appending()
+            self._file.write(line + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.dict_records[str(token_id)] = value
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def records(self, iterable_with_token_ids=None) -> dict:
+        """
+        What was recorded for each token.
+        :param iterable_with_token_ids: If given, only these tokens (the ones that are not in the
+          journal are left out.)
+        :return: A dict of token id -> value.
+        """
+        if iterable_with_token_ids is None:
+            return dict(self.dict_records)
+        return {str(token_id): self.dict_records[str(token_id)] for token_id in iterable_with_token_ids
+                if str(token_id) in self.dict_records}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def discard(self):
+        """Delete the journal, once the stage it belongs to has written its output."""
+        self.close()
+        Path(self.fullpath_journal).unlink(missing_ok=True)
+        self.dict_records = {}
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __load(self):
+        """
+        Read back the journal of a previous run, if there is one. A run that died while writing a
+        line leaves that line incomplete, so lines that can not be parsed are skipped, and the
+        journal is rewritten without them before anything new is appended to it.
+        """
+        if not exists(self.fullpath_journal):
+            return
+        list_valid_lines = []
+        num_bad_lines = 0
+        header = None
+        needs_rewrite = False
+        with open(self.fullpath_journal, mode='r') as f:
+            for line in f:
+                # A line that was cut short just before its newline still parses, but whatever is
+                # appended next would end up on the same line, so the journal is rewritten.
+                needs_rewrite = not line.endswith('\n')
+                try:
+                    document = json.loads(line)
+                except json.JSONDecodeError:
+                    num_bad_lines += 1
+                    continue
+                if header is None:
+                    header = document
+                elif 'token_id' in document:
+                    self.dict_records[document['token_id']] = document.get('value')
+                list_valid_lines.append(line if line.endswith('\n') else line + '\n')
+
+        # Parameters are compared after a round trip through json, as that is how they were stored.
+        if header is None or header.get('params') != json.loads(json.dumps(self.params, default=str)):
+            logging.info(f"Journal '{self.fullpath_journal}' was written with other parameters; starting afresh.")
+            self.dict_records = {}
+            Path(self.fullpath_journal).unlink(missing_ok=True)
+            return
+
+        if num_bad_lines or needs_rewrite:
+            if num_bad_lines:
+                logging.warning(f"Skipped {num_bad_lines} incomplete lines in journal '{self.fullpath_journal}'.")
+            fullpath_temporary = Path(str(self.fullpath_journal) + '.tmp')
+            with open(fullpath_temporary, mode='w') as f:
+                f.writelines(list_valid_lines)
+            os.replace(fullpath_temporary, self.fullpath_journal)
+        logging.info(f"Resuming from journal '{self.fullpath_journal}': {len(self.dict_records)} tokens already done.")
+    # ------------------------ END FUNCTION ------------------------ #
+
+    def __open_for_appending(self):
+        is_new = not exists(self.fullpath_journal)
+        self._file = open(self.fullpath_journal, mode='a')
+        if is_new:
+            self._file.write(json.dumps({'params': self.params}, default=str) + '\n')
+    # ------------------------ END FUNCTION ------------------------ #
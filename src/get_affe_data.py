@@ -1,22 +1,230 @@
+import argparse
 import logging
-from pathlib import Path
+import sys
 from os import getenv
-from class_affe_data_getter import AffeDataGetter
-from class_affe_data_manipulator import AffeDataManipulator
-from helper_functions import setup_logging
+from pathlib import Path
+
+# Nothing heavy (pandas, the API clients, Selenium) is imported at the top of this file: each
+# subcommand imports what it needs when it runs, so the short ones (eg. export and museum, which
+# are run from cron and webhooks many times a day) are not slowed down by what they don't use.
+
+# Affe are in Opensea storefront at the following address
+opensea_storefront = "0x495f947276749ce646f68ac8c248420045cb7b5e"
+# The address of the Monkeyverse DAO museum, whose tokens the 'museum' subcommand lists.
+address_of_museum = "0x11f515b85d46ba8aba99cc7a7b385fe9986fe964"
+
+# The stages (see AffeDataGetter.build_stage_graph) that each subcommand brings up to date.
+dict_stages_of_command = {'fetch': ['transfers', 'ownership', 'resync', 'moralis_metadata', 'opensea_augment'],
+                          'refine': ['refine'],
+                          'scrape': ['extras'],
+                          'combine': ['combine', 'reorganize']}
+# Data on the internet may have changed even if nothing on disk did, so the stages that fetch data
+# always run; the other ones only run if their inputs changed (or with --force.)
+list_commands_that_always_run = ['fetch', 'scrape']
+
+
+def make_affe_getter(args):
+    from class_affe_data_getter import AffeDataGetter
+    return AffeDataGetter(opensea_storefront, args.data_dir,
+                          opensea_properties_backend=getattr(args, 'backend', 'selenium'),
+                          storage_format=args.storage_format,
+                          fullpath_prometheus_textfile=Path(args.prometheus_textfile)
+                          if args.prometheus_textfile else None)
+
+
+def command_stages(args) -> int:
+    """fetch, refine, scrape and combine: bring the stages of the subcommand up to date."""
+    list_stage_names = dict_stages_of_command[args.command]
+    always_run = args.command in list_commands_that_always_run or args.force
+    with make_affe_getter(args) as affe_getter:
+        dict_outcomes = affe_getter.run_stages(list_stage_names=list_stage_names,
+                                               list_stages_to_invalidate=list_stage_names if always_run else [],
+                                               include_upstream=False,
+                                               request_moralis_metadata_resync=getattr(args, 'resync', False),
+                                               full_backfill_of_transfers=getattr(args, 'full_backfill', False))
+    logging.info(f"Stages -> {dict_outcomes}")
+    return 0
+
+
+def command_export(args) -> int:
+    """export: write the json files of the Affen from the final table on disk."""
+    from class_affe_data_manipulator import AffeDataManipulator
+    from class_table_storage import TableStorage
+    storage = TableStorage(storage_format=args.storage_format)
+    df_affen = storage.read(storage.path(args.data_dir / 'output', 'affe'), 'final')
+    list_style_names = [style_name.strip() for style_name in args.styles.split(',') if style_name.strip()]
+    affe_manip = AffeDataManipulator(df_affen, args.data_dir)
+    dict_reports = affe_manip.dump_all_to_json(normal_json='normal' in list_style_names,
+                                               opensea_style_json='nft-style' in list_style_names,
+                                               flat_json='flat' in list_style_names,
+                                               pretty=not args.compact)
+    logging.info(f"Exported the json of {len(df_affen)} Affen -> {dict_reports}")
+    return 0
+
+
+def command_museum(args) -> int:
+    """museum: list the Affen held by the museum (or by any other address), now or at any block."""
+    from class_ownership_ledger import OwnershipLedger
+    from class_table_storage import TableStorage
+    import pandas as pd
+    storage = TableStorage(storage_format=args.storage_format)
+    # The ledger that the 'ownership' stage keeps up to date (see AffeDataGetter.update_ownership_ledger.)
+    fullpath_ledger = storage.path(args.data_dir / 'intermediate_files', 'ownership_ledger')
+    ledger = OwnershipLedger.from_transfers(storage.read(fullpath_ledger, 'ownership'), opensea_storefront)
+    dict_holdings = ledger.holdings_of(args.address, block=args.block)
+    # The ids of the storefront are too large for numpy, so they are sorted as python ints.
+    list_token_ids = sorted(dict_holdings, key=int)
+    df = pd.DataFrame({'token_id': list_token_ids, 'amount': [dict_holdings[token_id] for token_id in list_token_ids]})
+
+    # The names of the Affen are added if the final table is there.
+    fullpath_final = storage.path(args.data_dir / 'output', 'affe')
+    if fullpath_final.exists():
+        df_names = storage.read(fullpath_final, 'final', columns=['token_id', 'name'])
+        df = df.merge(df_names.drop_duplicates('token_id'), on='token_id', how='left')
+
+    as_of = f"block {args.block}" if args.block is not None else f"the latest block known ({ledger.last_block})"
+    if args.output:
+        df.to_csv(args.output, index=False)
+        logging.info(f"{len(df)} Affen held by {args.address} at {as_of} written to '{args.output}'")
+    else:
+        logging.info(f"{len(df)} Affen held by {args.address} at {as_of}")
+        df.to_csv(sys.stdout, index=False)
+    return 0
+
+
+def command_refresh(args) -> int:
+    """refresh: the whole pipeline, from the APIs to the json files (what used to be the only option.)"""
+    with make_affe_getter(args) as affe_getter:
+        if args.list_stages:
+            print('\n'.join(affe_getter.build_stage_graph().stage_names()))
+        elif args.stages or args.stages_to_invalidate:
+            affe_getter.run_stages(list_stage_names=args.stages,
+                                   list_stages_to_invalidate=args.stages_to_invalidate,
+                                   include_upstream=not args.only)
+        elif args.streaming:
+            # The json files are written by the stream itself.
+            affe_getter.build_affen_data_files_streaming(request_moralis_metadata_resync=not args.no_resync)
+        else:
+            from class_affe_data_manipulator import AffeDataManipulator
+            affe_getter.build_affen_data_files(request_moralis_metadata_resync=not args.no_resync,
+                                               use_data_already_on_disk=False)
+            affe_manip = AffeDataManipulator(affe_getter.load_previously_fetched_data(), args.data_dir)
+            affe_manip.dump_all_to_json()
+    return 0
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Get as much data as possible about Affe mit Waffe.",
+                                     epilog="Without a subcommand, 'refresh' is run.")
+    parser.add_argument('--data-dir', default=getenv('DATA_PATH'),
+                        help="The data directory. Default: the DATA_PATH environment variable.")
+    parser.add_argument('--storage-format', default='parquet', choices=['parquet', 'feather', 'csv'],
+                        help="The format of the tables on disk. Default: %(default)s")
+    parser.add_argument('--prometheus-textfile', metavar='PATH',
+                        help="Also write the measurements of the run (see run_report.json in the data "
+                             "directory) to this file, in the Prometheus text format.")
+    parser.add_argument('--profile-imports', action='store_true',
+                        help="Report (on stderr) how long the modules took to import.")
+    parser.add_argument('--quiet', action='store_true', help="Only log warnings and errors to the console.")
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    # The options that may also be given after the subcommand. Their default is SUPPRESS, so that
+    # a subcommand that is not given the option keeps the value given (or defaulted) before it.
+    parser_storage = argparse.ArgumentParser(add_help=False)
+    parser_storage.add_argument('--storage-format', default=argparse.SUPPRESS, choices=['parquet', 'feather', 'csv'],
+                                help="The format of the tables on disk (the same as before the subcommand.)")
+    # The subcommands that scrape OpenSea.
+    parser_backend = argparse.ArgumentParser(add_help=False)
+    parser_backend.add_argument('--backend', default='selenium', choices=['selenium', 'html'],
+                                help="How OpenSea is scraped. Default: %(default)s")
+
+    parser_fetch = subparsers.add_parser('fetch', help="Download the transfers and the metadata of the tokens.",
+                                         parents=[parser_storage])
+    parser_fetch.add_argument('--resync', action='store_true',
+                              help="Ask Moralis to resync the metadata of every token first.")
+    parser_fetch.add_argument('--full-backfill', action='store_true',
+                              help="Download the complete transfer history again.")
+    parser_fetch.set_defaults(function=command_stages)
+
+    parser_refine = subparsers.add_parser('refine', help="Keep only the tokens that are Affen.",
+                                          parents=[parser_storage])
+    parser_refine.add_argument('--force', action='store_true', help="Run even if the inputs did not change.")
+    parser_refine.set_defaults(function=command_stages)
+
+    parser_scrape = subparsers.add_parser('scrape', help="Get the extra properties of the Affen from OpenSea.",
+                                          parents=[parser_storage, parser_backend])
+    parser_scrape.set_defaults(function=command_stages)
+
+    parser_combine = subparsers.add_parser('combine', help="Combine all the data into the final table.",
+                                           parents=[parser_storage])
+    parser_combine.add_argument('--force', action='store_true', help="Run even if the inputs did not change.")
+    parser_combine.set_defaults(function=command_stages)
+
+    parser_export = subparsers.add_parser('export', help="Write the json files from the final table on disk.",
+                                          parents=[parser_storage])
+    parser_export.add_argument('--styles', default='normal,nft-style,flat',
+                               help="Comma-separated styles of json. Default: %(default)s")
+    parser_export.add_argument('--compact', action='store_true', help="Do not indent the json.")
+    parser_export.set_defaults(function=command_export)
+
+    parser_museum = subparsers.add_parser('museum', help="List the Affen in the museum, from the ownership ledger "
+                                                         "on disk (see the 'fetch' subcommand.)",
+                                          parents=[parser_storage])
+    parser_museum.add_argument('--address', default=address_of_museum, help="Default: the museum (%(default)s)")
+    parser_museum.add_argument('--block', type=int,
+                               help="List what the address held at the end of this block. Default: the latest "
+                                    "block in the ledger.")
+    parser_museum.add_argument('--output', metavar='PATH', help="Write the list to this CSV file rather than to stdout.")
+    parser_museum.set_defaults(function=command_museum)
+
+    parser_refresh = subparsers.add_parser('refresh', help="Run the whole pipeline and write the json files.",
+                                           parents=[parser_storage, parser_backend])
+    parser_refresh.add_argument('--streaming', action='store_true',
+                                help="Stream each token through all the stages as soon as it is fetched, writing "
+                                     "its json right away, rather than running one stage after the other.")
+    parser_refresh.add_argument('--no-resync', action='store_true',
+                                help="Do not ask Moralis to resync the metadata of every token first.")
+    parser_refresh.add_argument('--stage', action='append', dest='stages', metavar='NAME',
+                                help="Only bring this stage (and, unless --only is given, the stages it depends "
+                                     "on) up to date. Can be given several times.")
+    parser_refresh.add_argument('--invalidate', action='append', dest='stages_to_invalidate', default=[],
+                                metavar='NAME',
+                                help="Re-run this stage even if its inputs did not change. Can be given several times.")
+    parser_refresh.add_argument('--only', action='store_true',
+                                help="With --stage, do not bring the stages it depends on up to date.")
+    parser_refresh.add_argument('--list-stages', action='store_true', help="List the stages and exit.")
+    parser_refresh.set_defaults(function=command_refresh)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(argv + ['refresh'])
+    if not args.data_dir:
+        parser.error("The data directory is not known: pass --data-dir, or set DATA_PATH.")
+    args.data_dir = Path(args.data_dir)
 
-setup_logging(destination='both',
-              file_logging_level='debug',
-              console_logging_level='info',
-              full_path_to_log_file=Path(getenv('DATA_PATH')) / 'main.log')
+    profiler = None
+    if args.profile_imports:
+        from class_import_profiler import ImportProfiler
+        profiler = ImportProfiler()
+        profiler.start()
+    try:
+        from helper_functions import setup_logging
+        setup_logging(destination='both',
+                      file_logging_level='debug',
+                      console_logging_level='warning' if args.quiet else 'info',
+                      full_path_to_log_file=args.data_dir / 'main.log')
+        logging.info(f" -------------------- STARTING MAIN PROGRAM ({args.command}) -------------------- ")
+        return args.function(args)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            print(profiler.report(), file=sys.stderr)
 
 
 if __name__ == "__main__":
-    logging.info(" -------------------- STARTING MAIN PROGRAM -------------------- ")
-    # Affe are in Opensea storefront at the following address
-    opensea_storefront = "0x495f947276749ce646f68ac8c248420045cb7b5e"
-    full_path_data_dir = Path(getenv('DATA_PATH'))
-    affe_getter = AffeDataGetter(opensea_storefront, full_path_data_dir)
-    affe_getter.build_affen_data_files(request_moralis_metadata_resync=True, use_data_already_on_disk=False)
-    affe_manip = AffeDataManipulator(affe_getter.load_previously_fetched_data(), full_path_data_dir)
-    affe_manip.dump_all_to_json()
+    sys.exit(main())
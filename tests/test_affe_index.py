@@ -0,0 +1,74 @@
+import sys
+from pathlib import Path
+import pandas as pd
+import pytest
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_affe_index import AffeIndex
+
+museum = AffeIndex.default_owner_aliases['museum']
+
+df_affen = pd.DataFrame({'token_id': ['1', '2', '3', '4', '5'],
+                         'owner_of': [museum, '0x00000000000000000000000000000000000000A1', museum,
+                                      '0x00000000000000000000000000000000000000a1', '0x00000000000000000000000000000000000000b0'],
+                         'CHIMP': ['Gorilla', 'Bonobo', 'Gorilla', 'Gibbon', 'Bonobo'],
+                         'HAT': ['Fez', None, 'Top Hat', None, 'Fez'],
+                         'Joy': ['7 of 10', '2 of 10', '4 of 10', '4.5 of 10', None],
+                         'SPECIAL ABILITY': [None, 'Laser Eyes', None, 'Banana Boomerang', 'Laser Eyes']})
+list_trait_columns = ['CHIMP', 'HAT', 'Joy', 'SPECIAL ABILITY']
+
+
+@pytest.mark.parametrize('query, list_expected_token_ids', [
+    ('HAT PRESENT', ['1', '3', '5']),
+    ('CHIMP = Gorilla', ['1', '3']),
+    ('CHIMP != Gorilla', ['2', '4', '5']),
+    # Numeric traits are compared as numbers, whether written as 'X of Y' or not.
+    ('Joy >= 4', ['1', '3', '4']),
+    ('Joy > 4', ['1', '4']),
+    ('Joy ≤ 4', ['2', '3']),
+    ('Joy < 4', ['2']),
+    ('Joy = 4', ['3']),
+    ('owner = museum', ['1', '3']),
+    ('owner = 0x00000000000000000000000000000000000000A1', ['2', '4']),
+    ('owner != museum AND HAT PRESENT', ['5']),
+    # Quoted names and values, and unquoted names of several words.
+    ('"SPECIAL ABILITY" = "Laser Eyes"', ['2', '5']),
+    ('SPECIAL ABILITY PRESENT', ['2', '4', '5']),
+    # AND binds tighter than OR, and parentheses change that.
+    ('CHIMP = Gibbon OR HAT PRESENT AND Joy >= 5', ['1', '4']),
+    ('(CHIMP = Gibbon OR HAT PRESENT) AND Joy >= 5', ['1']),
+    ('NOT HAT PRESENT', ['2', '4']),
+    ('NOT NOT HAT PRESENT', ['1', '3', '5']),
+    ('HAT PRESENT AND NOT owner = museum', ['5']),
+    ('CHIMP = Orangutan', []),
+])
+def test_query(query, list_expected_token_ids):
+    index = AffeIndex(df_affen, list_trait_columns=list_trait_columns)
+    assert index.query(query) == list_expected_token_ids
+
+
+@pytest.mark.parametrize('query', [
+    'HAT',
+    'HAT =',
+    'Joy >= many',
+    'CHIMP >= 3',
+    'owner > museum',
+    'WINGS PRESENT',
+    '(HAT PRESENT',
+    'HAT PRESENT)',
+    'HAT PRESENT AND',
+    'Joy >= 4 !',
+])
+def test_query_that_cannot_be_answered(query):
+    index = AffeIndex(df_affen, list_trait_columns=list_trait_columns)
+    with pytest.raises(ValueError):
+        index.query(query)
+
+
+def test_sets_can_be_combined_without_a_query():
+    index = AffeIndex(df_affen, list_trait_columns=list_trait_columns)
+    rows = index.all_of(index.with_trait('CHIMP', 'Bonobo'), index.any_of(index.with_trait('HAT'),
+                                                                        index.in_range('Joy', maximum=2)))
+    assert index.token_ids_of(rows) == ['2', '5']
+    assert index.token_ids_of(index.none_of(index.owned_by('MUSEUM'))) == ['2', '4', '5']
@@ -0,0 +1,73 @@
+import os
+import sys
+from pathlib import Path
+import pytest
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_change_aware_writer import ChangeAwareWriter
+
+
+def test_unchanged_files_are_not_touched(tmp_path):
+    writer = ChangeAwareWriter(tmp_path)
+    assert writer.write('1.json', b'{"name": "Affe 1"}') == 'added'
+    assert writer.write_json('2.json', {'name': 'Affe 2'}) == 'added'
+    assert writer.finish() == {'added': 2, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    # An old modification time, to see whether the next run rewrites the file.
+    os.utime(tmp_path / '1.json', (1_000_000_000, 1_000_000_000))
+
+    writer = ChangeAwareWriter(tmp_path)
+    assert writer.write('1.json', b'{"name": "Affe 1"}') == 'unchanged'
+    assert writer.write_json('2.json', {'name': 'Affe 2 (renamed)'}) == 'changed'
+    assert writer.finish() == {'added': 0, 'changed': 1, 'unchanged': 1, 'removed': 0}
+    assert os.path.getmtime(tmp_path / '1.json') == 1_000_000_000
+    assert (tmp_path / '2.json').read_text() == '{"name": "Affe 2 (renamed)"}'
+
+
+def test_a_file_edited_behind_the_manifest_is_rewritten(tmp_path):
+    writer = ChangeAwareWriter(tmp_path)
+    writer.write('1.json', b'{"name": "Affe 1"}')
+    writer.finish()
+    (tmp_path / '1.json').write_bytes(b'{"name": "Affe 1", "edited": true}')
+
+    writer = ChangeAwareWriter(tmp_path)
+    assert writer.write('1.json', b'{"name": "Affe 1"}') == 'changed'
+    assert (tmp_path / '1.json').read_bytes() == b'{"name": "Affe 1"}'
+
+
+def test_files_not_written_again_are_removed(tmp_path):
+    writer = ChangeAwareWriter(tmp_path)
+    writer.write('1.json', b'1')
+    writer.write('2.json', b'2')
+    writer.finish()
+
+    writer = ChangeAwareWriter(tmp_path)
+    writer.write('1.json', b'1')
+    assert writer.finish()['removed'] == 1
+    assert not (tmp_path / '2.json').exists()
+
+    # Unless they are to be kept.
+    writer = ChangeAwareWriter(tmp_path)
+    writer.finish(remove_stale_files=False)
+    assert (tmp_path / '1.json').exists()
+
+
+def test_a_failed_write_leaves_the_previous_file_whole(tmp_path, monkeypatch):
+    writer = ChangeAwareWriter(tmp_path)
+    writer.write('1.json', b'{"name": "Affe 1"}')
+    writer.finish()
+
+    def replace_that_fails(source, destination):
+        raise OSError("Disk full")
+
+    writer = ChangeAwareWriter(tmp_path)
+    monkeypatch.setattr(os, 'replace', replace_that_fails)
+    with pytest.raises(OSError):
+        writer.write('1.json', b'{"name": "Affe 1 (renamed)"}')
+    monkeypatch.undo()
+    assert (tmp_path / '1.json').read_bytes() == b'{"name": "Affe 1"}'
+
+    # Neither the failed write nor the one that goes through leave a temporary file behind.
+    writer.write('1.json', b'{"name": "Affe 1 (renamed)"}')
+    writer.finish()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['.manifest.json', '1.json']
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+import pandas as pd
+import pytest
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_keyed_join import KeyedJoin
+
+
+def rows(df: pd.DataFrame) -> list:
+    """The rows of a dataframe as dicts, with NaN as None (so they can be compared.)"""
+    return [{key: (None if pd.isna(value) else value) for key, value in record.items()}
+            for record in df.astype(object).to_dict('records')]
+
+
+def test_shared_columns_are_coalesced_by_priority():
+    df_moralis = pd.DataFrame({'token_id': ['1', '2', '3'],
+                               'name': ['Affe 1', None, 'Affe 3 (Moralis)'],
+                               'owner_of': ['0xa1', '0xb0', '0xc0']})
+    df_manual = pd.DataFrame({'token_id': ['2', '3', '4'],
+                              'name': ['Affe 2 (manual)', 'Affe 3 (manual)', 'Affe 4 (manual)']})
+    df_extras = pd.DataFrame({'token_id': ['4', '1'], 'CHIMP': ['Bonobo', 'Gorilla']})
+
+    df = KeyedJoin('token_id')\
+        .add_source(df_moralis, 'moralis', priority=1)\
+        .add_source(df_manual, 'manual', priority=0)\
+        .add_source(df_extras, 'extras')\
+        .join()
+
+    # One column per name (no '_x'/'_y'), keys in order of first appearance, and the lower priority
+    # source only fills in where the higher one has no value.
+    assert list(df.columns) == ['token_id', 'name', 'owner_of', 'CHIMP']
+    assert rows(df) == [{'token_id': '1', 'name': 'Affe 1', 'owner_of': '0xa1', 'CHIMP': 'Gorilla'},
+                        {'token_id': '2', 'name': 'Affe 2 (manual)', 'owner_of': '0xb0', 'CHIMP': None},
+                        {'token_id': '3', 'name': 'Affe 3 (Moralis)', 'owner_of': '0xc0', 'CHIMP': None},
+                        {'token_id': '4', 'name': 'Affe 4 (manual)', 'owner_of': None, 'CHIMP': 'Bonobo'}]
+
+
+def test_sources_of_the_same_priority_win_in_the_order_they_were_added():
+    df_first = pd.DataFrame({'token_id': ['1'], 'name': ['first']})
+    df_second = pd.DataFrame({'token_id': ['1'], 'name': ['second']})
+    assert rows(KeyedJoin().add_source(df_first).add_source(df_second).join()) == [{'token_id': '1', 'name': 'first'}]
+    assert rows(KeyedJoin().add_source(df_first).add_source(df_second, priority=1).join()) == [
+        {'token_id': '1', 'name': 'second'}]
+
+
+def test_keys_of_different_types_match_and_repeated_keys_keep_the_first_row():
+    df_numbers = pd.DataFrame({'token_id': [1, 2, 2], 'name': ['Affe 1', 'Affe 2', 'Affe 2 again']})
+    df_text = pd.DataFrame({'token_id': ['2', None], 'CHIMP': ['Bonobo', 'Nobody']})
+    df = KeyedJoin().add_source(df_numbers).add_source(df_text).join()
+    # The row without a key is dropped.
+    assert rows(df) == [{'token_id': '1', 'name': 'Affe 1', 'CHIMP': None},
+                        {'token_id': '2', 'name': 'Affe 2', 'CHIMP': 'Bonobo'}]
+
+
+def test_the_sources_are_not_modified_and_need_the_key():
+    df_moralis = pd.DataFrame({'token_id': [1], 'name': ['Affe 1']})
+    KeyedJoin().add_source(df_moralis).join()
+    assert df_moralis['token_id'].tolist() == [1]
+    assert list(df_moralis.columns) == ['token_id', 'name']
+
+    with pytest.raises(ValueError):
+        KeyedJoin().add_source(pd.DataFrame({'id': ['1']}), 'no key')
+    assert KeyedJoin().join().empty
@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+import pandas as pd
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_fake_nft_api_server import FakeNFTAPIServer
+from class_moralis_http import MoralisHTTP
+from class_response_cache import ResponseCache
+
+contract_address = '0x495f947276749ce646f68ac8c248420045cb7b5e'
+
+# The tokens of the contract as Moralis knew them when they were cached...
+dict_nfts_before = {'token_address': [contract_address] * 3,
+                    'token_id': ['1', '2', '3'],
+                    'name': ['Affe 1', 'Affe 2', 'Affe 3'],
+                    'token_hash': ['aaa', 'bbb', 'ccc'],
+                    'last_metadata_sync': ['2022-04-01T00:00:00.000Z'] * 3}
+# ... and after the metadata of token 2 was resynced.
+dict_nfts_after = {'token_address': [contract_address] * 3,
+                   'token_id': ['1', '2', '3'],
+                   'name': ['Affe 1', 'Affe 2 (renamed)', 'Affe 3'],
+                   'token_hash': ['aaa', 'bbb', 'ccc'],
+                   'last_metadata_sync': ['2022-04-01T00:00:00.000Z', '2022-05-01T00:00:00.000Z',
+                                          '2022-04-01T00:00:00.000Z']}
+
+
+def get_cached_or_fetch(moralis: MoralisHTTP, response_cache: ResponseCache, list_token_ids: list) -> tuple:
+    """What the metadata stage does: serve a token from the cache while its markers are current."""
+    dict_live_markers = {token_id: ResponseCache.sync_markers_from_record(record) for token_id, record
+                         in moralis.get_nft_sync_markers(contract_address, list_token_ids).items()}
+    dict_records = {}
+    list_fetched = []
+    for token_id in list_token_ids:
+        record = None
+        if token_id in dict_live_markers:
+            record = response_cache.get('moralis_metadata', contract_address, token_id,
+                                        current_markers=dict_live_markers[token_id])
+        if record is None:
+            record = moralis.get_nft_token_metadata(contract_address, token_id)
+            response_cache.put('moralis_metadata', contract_address, token_id, record,
+                               markers=ResponseCache.sync_markers_from_record(record))
+            list_fetched.append(token_id)
+        dict_records[token_id] = record
+    return dict_records, list_fetched
+
+
+def test_changed_sync_marker_causes_a_refetch(tmp_path):
+    response_cache = ResponseCache(tmp_path / 'response_cache', ttl_seconds=3600)
+
+    with FakeNFTAPIServer(df_nfts=pd.DataFrame(dict_nfts_before)) as server:
+        moralis = MoralisHTTP(api_key='test', base_url=server.moralis_url)
+        dict_records, list_fetched = get_cached_or_fetch(moralis, response_cache, ['1', '2', '3'])
+        moralis.close()
+    assert list_fetched == ['1', '2', '3']
+    assert dict_records['2']['name'] == 'Affe 2'
+
+    with FakeNFTAPIServer(df_nfts=pd.DataFrame(dict_nfts_after)) as server:
+        moralis = MoralisHTTP(api_key='test', base_url=server.moralis_url)
+        dict_records, list_fetched = get_cached_or_fetch(moralis, response_cache, ['1', '2', '3'])
+        moralis.close()
+    # Only the token whose markers changed is fetched again, and its new metadata is the one given.
+    assert list_fetched == ['2']
+    assert dict_records['2']['name'] == 'Affe 2 (renamed)'
+    assert dict_records['1']['name'] == 'Affe 1'
+
+
+def test_sync_markers_stop_paging_once_every_token_is_found():
+    with FakeNFTAPIServer(df_nfts=pd.DataFrame(dict_nfts_after), page_size=1) as server:
+        moralis = MoralisHTTP(api_key='test', base_url=server.moralis_url)
+        dict_markers = moralis.get_nft_sync_markers(contract_address, ['2'])
+        dict_markers_limited = moralis.get_nft_sync_markers(contract_address, ['3'], max_pages=1)
+        moralis.close()
+        dict_requests = server.stats['by_endpoint']['contract_nfts']
+
+    assert dict_markers == {'2': {'token_hash': 'bbb', 'last_metadata_sync': '2022-05-01T00:00:00.000Z'}}
+    # Token 3 is on the third page, which the limited lookup does not get to.
+    assert dict_markers_limited == {}
+    # Two pages for token 2, one for the limited lookup.
+    assert dict_requests == {200: 3}
@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+import pandas as pd
+import pytest
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_opensea_html_extractor import OpenseaHTMLPropertiesExtractor
+
+fullpath_fixtures = Path(__file__).resolve().parent / 'fixtures' / 'opensea_item_pages'
+
+# The properties that each saved item page should give, in the order in which the page lists them.
+dict_expected_properties = {
+    # A Next.js page, with text and numeric traits, and other JSON scripts that hold no traits.
+    'affe_with_properties.html': {'CHIMP': 'Gorilla',
+                                  'AK47': 'Golden',
+                                  'Anger': '7 of 10',
+                                  'Joy': '2 of 10',
+                                  'SPECIAL ABILITY': 'Banana Boomerang'},
+    # A token that has not been revealed yet.
+    'affe_without_properties.html': {},
+    # Upper case tags, attributes in another order, a script with broken JSON, snake_case keys,
+    # traits nested in a relay cache, numbers given as strings, and a trait without a value.
+    'affe_with_odd_layout.html': {'CHIMP': 'Bonobo',
+                                  'TRINKET': 'Rubber Duck </quack>',
+                                  'Fear': '3 of 10',
+                                  'Sadness': '4.5 of 10',
+                                  'Laser eyes': True},
+    # What OpenSea sends instead of the item page when it suspects a bot.
+    'challenge_page.html': {},
+}
+
+
+class _FakeResponse:
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+        self.content = text.encode('utf-8')
+
+
+class _FakeSession:
+    """Serves the saved item pages, one per token id, the way the requests session of the extractor would."""
+
+    def __init__(self, dict_pages: dict):
+        self.dict_pages = dict_pages
+
+    def get(self, url, **kwargs):
+        token_id = url.rstrip('/').rsplit('/', 1)[-1]
+        if token_id not in self.dict_pages:
+            return _FakeResponse(404, 'Not found')
+        return _FakeResponse(200, self.dict_pages[token_id])
+
+
+def read_fixture(file_name: str) -> str:
+    with open(fullpath_fixtures / file_name, encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('file_name', sorted(dict_expected_properties))
+def test_extract_properties_from_saved_page(file_name):
+    dict_properties = OpenseaHTMLPropertiesExtractor.extract_properties_from_html(read_fixture(file_name))
+    assert dict_properties == dict_expected_properties[file_name]
+    # The order matters too, as it is the order of the columns of the extras table.
+    assert list(dict_properties) == list(dict_expected_properties[file_name])
+
+
+def test_get_many_nfts_properties_gives_one_row_per_page():
+    dict_pages = {'17': read_fixture('affe_with_properties.html'),
+                  '404': read_fixture('affe_without_properties.html'),
+                  '23': read_fixture('affe_with_odd_layout.html')}
+    extractor = OpenseaHTMLPropertiesExtractor('0x495f947276749ce646f68ac8c248420045cb7b5e',
+                                               base_url='http://opensea.invalid/assets/ethereum',
+                                               requests_per_second=1000,
+                                               session=_FakeSession(dict_pages))
+    list_done = []
+    df = extractor.get_many_nfts_properties(['17', '404', '23', '999'],
+                                            on_token_done=lambda token_id, list_rows: list_done.append(token_id))
+
+    # The token whose page could not be downloaded has no row; the one without properties has an empty one.
+    assert list(df['token_id']) == ['17', '404', '23']
+    assert sorted(list_done) == ['17', '23', '404']
+    # Each row only keeps the properties of its own token (the other columns are NaN.)
+    dict_rows = {row['token_id']: {key: value for key, value in row.items() if key != 'token_id' and pd.notna(value)}
+                 for row in df.to_dict('records')}
+    assert dict_rows['17'] == dict_expected_properties['affe_with_properties.html']
+    assert dict_rows['404'] == {}
+    assert dict_rows['23'] == dict_expected_properties['affe_with_odd_layout.html']
@@ -0,0 +1,89 @@
+import sys
+from pathlib import Path
+import pandas as pd
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_ownership_ledger import OwnershipLedger
+
+contract_address = '0x495f947276749ce646f68ac8c248420045cb7b5e'
+zero = OwnershipLedger.zero_address
+alice = '0x00000000000000000000000000000000000000a1'
+bob = '0x00000000000000000000000000000000000000b0'
+carol = '0x00000000000000000000000000000000000000c0'
+
+# Token 1 is minted to Alice, sold to Bob, then to Carol (the last two within the same block, given
+# in the wrong order, as the log index is what orders them.) Token 2 is an edition of 5, of which
+# Alice sends 2 to Bob. Addresses are given in mixed case, as they sometimes come from Moralis.
+dict_transfers = {'token_address': [contract_address] * 5,
+                  'token_id': ['1', '1', '1', '2', '2'],
+                  'from_address': [zero, alice.upper().replace('0X', '0x'), bob, zero, alice],
+                  'to_address': [alice, bob, carol, alice, bob],
+                  'amount': [1, 1, 1, 5, 2],
+                  'block_number': [10, 20, 20, 12, 30],
+                  'transaction_index': [0, 3, 3, 0, 1],
+                  'log_index': [0, 7, 9, 0, 0],
+                  'transaction_hash': ['0x01', '0x02', '0x02', '0x03', '0x04']}
+
+
+def test_owners_of_a_token_at_a_block():
+    ledger = OwnershipLedger.from_transfers(pd.DataFrame(dict_transfers))
+    assert ledger.owners_of('1', block=9) == {}
+    assert ledger.owners_of('1', block=10) == {alice: 1}
+    assert ledger.owners_of('1', block=19) == {alice: 1}
+    # Bob held token 1 only between the two transfers of block 20.
+    assert ledger.owners_of('1', block=20) == {carol: 1}
+    assert ledger.owners_of('1') == {carol: 1}
+    assert ledger.owners_of('2', block=29) == {alice: 5}
+    assert ledger.owners_of('2') == {alice: 3, bob: 2}
+    assert ledger.owners_of('3') == {}
+    assert ledger.last_block == 30
+    assert ledger.last_block_of('1') == 20
+
+
+def test_holdings_of_an_address_at_a_block():
+    ledger = OwnershipLedger.from_transfers(pd.DataFrame(dict_transfers))
+    assert ledger.holdings_of(alice, block=11) == {'1': 1}
+    assert ledger.holdings_of(alice, block=15) == {'1': 1, '2': 5}
+    assert ledger.holdings_of(alice) == {'2': 3}
+    assert ledger.holdings_of(bob.upper().replace('0X', '0x')) == {'2': 2}
+    assert ledger.holdings_of(carol, block=19) == {}
+    assert ledger.holdings_of(zero) == {}
+
+
+def test_transfers_added_later_and_twice_are_merged():
+    df_all = pd.DataFrame(dict_transfers)
+    # The newest transfers arrive first, then everything again (as when the last block is requested again.)
+    ledger = OwnershipLedger(contract_address)
+    assert ledger.add_transfers(df_all[df_all['block_number'] >= 20]) == 3
+    assert ledger.add_transfers(df_all) == 2
+    assert ledger.add_transfers(df_all) == 0
+    assert ledger.owners_of('1', block=10) == {alice: 1}
+    assert ledger.owners_of('1') == {carol: 1}
+    assert ledger.holdings_of(alice) == {'2': 3}
+
+
+def test_transfers_of_other_contracts_are_ignored():
+    df_other = pd.DataFrame({'token_address': ['0x0000000000000000000000000000000000000bad'], 'token_id': ['1'],
+                             'from_address': [zero], 'to_address': [bob], 'amount': [1], 'block_number': [50]})
+    ledger = OwnershipLedger.from_transfers(pd.concat([pd.DataFrame(dict_transfers), df_other]), contract_address)
+    assert ledger.owners_of('1') == {carol: 1}
+
+
+def test_saved_transfers_rebuild_the_same_ledger():
+    ledger = OwnershipLedger.from_transfers(pd.DataFrame(dict_transfers), contract_address)
+    ledger_loaded = OwnershipLedger.from_transfers(ledger.transfers(), contract_address)
+    for token_id in ['1', '2']:
+        for block in [10, 12, 20, 30]:
+            assert ledger_loaded.owners_of(token_id, block) == ledger.owners_of(token_id, block)
+    assert ledger_loaded.intervals().equals(ledger.intervals())
+    # What was loaded is not applied twice when the same transfers are downloaded again.
+    assert ledger_loaded.add_transfers(pd.DataFrame(dict_transfers)) == 0
+
+
+def test_intervals():
+    ledger = OwnershipLedger.from_transfers(pd.DataFrame(dict_transfers))
+    df = ledger.intervals('1')
+    assert list(df['owner']) == [alice, bob, carol]
+    assert list(df['from_block']) == [10, 20, 20]
+    assert list(df['to_block'].astype(object).where(df['to_block'].notna(), None)) == [20, 20, None]
@@ -0,0 +1,100 @@
+import sys
+import time
+from pathlib import Path
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_response_cache import ResponseCache
+
+contract_address = '0x495f947276749ce646f68ac8c248420045cb7b5e'
+
+dict_markers = {'token_hash': 'aaa', 'last_metadata_sync': '2022-04-01T00:00:00.000Z'}
+dict_markers_after_resync = {'token_hash': 'aaa', 'last_metadata_sync': '2022-05-01T00:00:00.000Z'}
+
+
+def count_objects(fullpath_dir_cache: Path) -> int:
+    return len(list((fullpath_dir_cache / 'objects').glob('*/*.json')))
+
+
+def test_hits_only_while_the_markers_are_the_same(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache')
+    cache.put('moralis_metadata', contract_address, '1', [{'name': 'Affe 1'}], markers=dict_markers)
+
+    assert cache.get('moralis_metadata', contract_address, '1', current_markers=dict_markers) == [{'name': 'Affe 1'}]
+    assert cache.get('moralis_metadata', contract_address, '1', current_markers=dict_markers_after_resync) is None
+    # Without markers to compare with, the entry is served.
+    assert cache.get('moralis_metadata', contract_address, '1') == [{'name': 'Affe 1'}]
+    # Entries are kept apart by namespace, contract (whatever its case) and token.
+    assert cache.get('opensea_properties', contract_address, '1') is None
+    assert cache.get('moralis_metadata', contract_address.upper().replace('0X', '0x'), '1') == [{'name': 'Affe 1'}]
+    assert cache.get('moralis_metadata', contract_address, '2') is None
+    assert cache.stats == {'hits': 3, 'misses': 3, 'stores': 1, 'evictions': 0}
+
+
+def test_sync_markers_from_record():
+    record = {'token_id': '1', 'token_hash': 'aaa', 'last_metadata_sync': float('nan'), 'name': 'Affe 1'}
+    assert ResponseCache.sync_markers_from_record(record) == {'token_hash': 'aaa'}
+    assert ResponseCache.sync_markers_from_record({'token_hash': 123}) == {'token_hash': '123'}
+
+
+def test_entries_survive_a_save_and_identical_responses_are_stored_once(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache')
+    cache.put('opensea_properties', contract_address, '1', {'CHIMP': 'Gorilla'}, markers=dict_markers)
+    cache.put('opensea_properties', contract_address, '1', {'CHIMP': 'Gorilla'}, markers=dict_markers)
+    cache.put('opensea_properties', contract_address, '2', {'CHIMP': 'Bonobo'})
+    cache.save()
+    assert count_objects(tmp_path / 'cache') == 2
+
+    cache_reloaded = ResponseCache(tmp_path / 'cache')
+    assert cache_reloaded.get('opensea_properties', contract_address, '1',
+                              current_markers=dict_markers) == {'CHIMP': 'Gorilla'}
+    assert cache_reloaded.get('opensea_properties', contract_address, '2') == {'CHIMP': 'Bonobo'}
+
+
+def test_expired_entries_are_misses_and_are_evicted_on_save(tmp_path, monkeypatch):
+    list_now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: list_now[0])
+    cache = ResponseCache(tmp_path / 'cache', ttl_seconds=60)
+    cache.put('moralis_metadata', contract_address, '1', [{'name': 'Affe 1'}])
+    list_now[0] += 30
+    cache.put('moralis_metadata', contract_address, '2', [{'name': 'Affe 2'}])
+
+    list_now[0] += 45
+    assert cache.get('moralis_metadata', contract_address, '1') is None
+    assert cache.get('moralis_metadata', contract_address, '2') == [{'name': 'Affe 2'}]
+    cache.save()
+    assert cache.stats['evictions'] == 1
+    assert count_objects(tmp_path / 'cache') == 1
+
+
+def test_oldest_entries_are_evicted_when_the_cache_is_too_big(tmp_path, monkeypatch):
+    list_now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: list_now[0])
+    # Each of these responses takes 18 bytes once serialized, so only two of them fit.
+    cache = ResponseCache(tmp_path / 'cache', max_size_bytes=45)
+    for token_id in ['1', '2', '3']:
+        cache.put('moralis_metadata', contract_address, token_id, {'name': f"Affe {token_id}"})
+        list_now[0] += 1
+    cache.save()
+
+    assert cache.get('moralis_metadata', contract_address, '1') is None
+    assert cache.get('moralis_metadata', contract_address, '2') == {'name': 'Affe 2'}
+    assert cache.get('moralis_metadata', contract_address, '3') == {'name': 'Affe 3'}
+    assert count_objects(tmp_path / 'cache') == 2
+
+
+def test_invalidated_entries_are_misses(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache')
+    for token_id in ['1', '2']:
+        cache.put('moralis_metadata', contract_address, token_id, [{'name': f"Affe {token_id}"}])
+    cache.invalidate('moralis_metadata', contract_address, ['1'])
+    assert cache.get('moralis_metadata', contract_address, '1') is None
+    assert cache.get('moralis_metadata', contract_address, '2') == [{'name': 'Affe 2'}]
+
+
+def test_a_disabled_cache_stores_nothing(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache', enabled=False)
+    cache.put('moralis_metadata', contract_address, '1', [{'name': 'Affe 1'}])
+    cache.save()
+    assert cache.get('moralis_metadata', contract_address, '1') is None
+    assert not (tmp_path / 'cache').exists()
@@ -0,0 +1,96 @@
+import sys
+from pathlib import Path
+import pytest
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_stage_graph import Stage, StageGraph
+
+
+def build_graph(fullpath_dir: Path, list_runs: list, upper: bool = False) -> StageGraph:
+    """
+    transfers -> nfts -> final, plus a manually maintained file that nfts reads. Every stage writes
+    what it read (and the name of the stage) to its output, and notes in list_runs that it ran.
+    """
+    fullpath_manual = fullpath_dir / 'manual.csv'
+    fullpath_transfers = fullpath_dir / 'transfers.txt'
+    fullpath_nfts = fullpath_dir / 'nfts.txt'
+    fullpath_final = fullpath_dir / 'final.txt'
+
+    def run_transfers():
+        list_runs.append('transfers')
+        fullpath_transfers.write_text('transfers')
+
+    def run_nfts():
+        list_runs.append('nfts')
+        fullpath_nfts.write_text(fullpath_transfers.read_text() + fullpath_manual.read_text() + '|nfts')
+
+    def run_final():
+        list_runs.append('final')
+        text = fullpath_nfts.read_text() + '|final'
+        fullpath_final.write_text(text.upper() if upper else text)
+
+    graph = StageGraph()
+    graph.add_stage(Stage('transfers', run_transfers, fullpath_transfers))
+    graph.add_stage(Stage('nfts', run_nfts, fullpath_nfts, dependencies=['transfers'],
+                          fullpaths_extra_inputs=[fullpath_manual]))
+    graph.add_stage(Stage('final', run_final, fullpath_final, dependencies=['nfts'], params={'upper': upper}))
+    return graph
+
+
+def test_stages_whose_inputs_did_not_change_are_skipped(tmp_path):
+    (tmp_path / 'manual.csv').write_text('|manual')
+    list_runs = []
+    assert build_graph(tmp_path, list_runs).run() == {'transfers': 'ran', 'nfts': 'ran', 'final': 'ran'}
+    assert build_graph(tmp_path, list_runs).run() == {'transfers': 'skipped', 'nfts': 'skipped', 'final': 'skipped'}
+    assert list_runs == ['transfers', 'nfts', 'final']
+    assert (tmp_path / 'final.txt').read_text() == 'transfers|manual|nfts|final'
+
+
+def test_a_changed_input_or_param_reruns_the_stages_downstream(tmp_path):
+    (tmp_path / 'manual.csv').write_text('|manual')
+    build_graph(tmp_path, []).run()
+
+    # The manual file is read by nfts, and the output of nfts by final.
+    list_runs = []
+    (tmp_path / 'manual.csv').write_text('|manual, edited')
+    assert build_graph(tmp_path, list_runs).run() == {'transfers': 'skipped', 'nfts': 'ran', 'final': 'ran'}
+
+    # A param only changes the fingerprint of its own stage.
+    assert build_graph(tmp_path, list_runs, upper=True).run() == {'transfers': 'skipped', 'nfts': 'skipped',
+                                                                  'final': 'ran'}
+    assert list_runs == ['nfts', 'final', 'final']
+    assert (tmp_path / 'final.txt').read_text() == 'TRANSFERS|MANUAL, EDITED|NFTS|FINAL'
+
+
+def test_invalidated_or_missing_outputs_rerun(tmp_path):
+    (tmp_path / 'manual.csv').write_text('|manual')
+    build_graph(tmp_path, []).run()
+
+    list_runs = []
+    graph = build_graph(tmp_path, list_runs)
+    graph.invalidate(['transfers'])
+    # transfers wrote the same output again, so the stages downstream are still up to date.
+    assert graph.run() == {'transfers': 'ran', 'nfts': 'skipped', 'final': 'skipped'}
+
+    (tmp_path / 'final.txt').unlink()
+    assert build_graph(tmp_path, list_runs).run() == {'transfers': 'skipped', 'nfts': 'skipped', 'final': 'ran'}
+    assert list_runs == ['transfers', 'final']
+
+
+def test_targets_with_and_without_their_upstream(tmp_path):
+    (tmp_path / 'manual.csv').write_text('|manual')
+    list_runs = []
+    assert build_graph(tmp_path, list_runs).run(targets=['nfts']) == {'transfers': 'ran', 'nfts': 'ran'}
+    build_graph(tmp_path, list_runs).invalidate(['transfers', 'final'])
+    assert build_graph(tmp_path, list_runs).run(targets=['final'], include_upstream=False) == {'final': 'ran'}
+    assert list_runs == ['transfers', 'nfts', 'final']
+
+
+def test_unknown_stages_are_rejected(tmp_path):
+    graph = build_graph(tmp_path, [])
+    with pytest.raises(ValueError):
+        graph.add_stage(Stage('combine', lambda: None, tmp_path / 'combined.txt', dependencies=['extras']))
+    with pytest.raises(ValueError):
+        graph.run(targets=['extras'])
+    assert graph.stage_names() == ['transfers', 'nfts', 'final']
@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+
+# The classes of this repo live in the 'src' directory, next to this one.
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'src'))
+from class_token_journal import TokenJournal
+
+dict_params = {'contract': '0x495f947276749ce646f68ac8c248420045cb7b5e', 'backend': 'html'}
+
+
+def test_an_interrupted_run_is_resumed(tmp_path):
+    fullpath_journal = tmp_path / 'extras.journal.jsonl'
+    journal = TokenJournal(fullpath_journal, params=dict_params, fsync=False)
+    journal.record(1, {'CHIMP': 'Gorilla'})
+    journal.record('2', {'CHIMP': 'Bonobo'})
+    journal.record('2', {'CHIMP': 'Orangutan'})
+    # The run dies here: the journal is never discarded.
+    journal.close()
+
+    journal_resumed = TokenJournal(fullpath_journal, params=dict_params, fsync=False)
+    # Token ids are keyed as strings, whatever type they were recorded with, and the last record wins.
+    assert len(journal_resumed) == 2
+    assert 1 in journal_resumed and '1' in journal_resumed and '3' not in journal_resumed
+    assert journal_resumed.completed_token_ids() == {'1', '2'}
+    assert journal_resumed.get(2) == {'CHIMP': 'Orangutan'}
+    assert journal_resumed.get('3', 'missing') == 'missing'
+    assert journal_resumed.records([2, '3']) == {'2': {'CHIMP': 'Orangutan'}}
+
+    # What the resumed run records is appended to what was there.
+    journal_resumed.record('3', {'CHIMP': 'Gibbon'})
+    journal_resumed.close()
+    assert TokenJournal(fullpath_journal, params=dict_params, fsync=False).completed_token_ids() == {'1', '2', '3'}
+
+
+def test_a_journal_with_other_params_is_started_afresh(tmp_path):
+    fullpath_journal = tmp_path / 'extras.journal.jsonl'
+    journal = TokenJournal(fullpath_journal, params=dict_params, fsync=False)
+    journal.record('1', {'CHIMP': 'Gorilla'})
+    journal.close()
+
+    journal_other = TokenJournal(fullpath_journal, params={**dict_params, 'backend': 'selenium'}, fsync=False)
+    assert len(journal_other) == 0
+    assert not fullpath_journal.exists()
+
+
+def test_a_line_cut_short_by_a_crash_is_skipped(tmp_path):
+    fullpath_journal = tmp_path / 'nfts.journal.jsonl'
+    journal = TokenJournal(fullpath_journal, params=dict_params, fsync=False)
+    journal.record('1', [{'name': 'Affe 1'}])
+    journal.close()
+    with open(fullpath_journal, mode='a') as f:
+        f.write('{"token_id": "2", "value": [{"na')
+
+    journal_resumed = TokenJournal(fullpath_journal, params=dict_params, fsync=False)
+    assert journal_resumed.records() == {'1': [{'name': 'Affe 1'}]}
+    # The broken line is gone, so what is appended next is on a line of its own.
+    journal_resumed.record('2', [{'name': 'Affe 2'}])
+    journal_resumed.close()
+    assert TokenJournal(fullpath_journal, params=dict_params, fsync=False).records() == {
+        '1': [{'name': 'Affe 1'}], '2': [{'name': 'Affe 2'}]}
+
+
+def test_discard_deletes_the_journal(tmp_path):
+    fullpath_journal = tmp_path / 'resync.journal.jsonl'
+    journal = TokenJournal(fullpath_journal, params=dict_params)
+    journal.record('1', 'accepted')
+    journal.discard()
+    assert len(journal) == 0
+    assert not fullpath_journal.exists()
+    assert len(TokenJournal(fullpath_journal, params=dict_params)) == 0